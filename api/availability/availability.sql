@@ -1,3 +1,8 @@
+PRAGMA journal_mode = WAL;  -- readers, and backups, never block the writer
+DROP TABLE IF EXISTS listing_windows;
+DROP TABLE IF EXISTS listing_drivers;
+DROP TABLE IF EXISTS listing_rule_exceptions;
+DROP TABLE IF EXISTS listing_rules;
 DROP TABLE IF EXISTS listings;
 
 CREATE TABLE listings (
@@ -5,5 +10,63 @@ CREATE TABLE listings (
     username TEXT NOT NULL, -- driver's username
     ride_date TEXT NOT NULL, -- ISO 8601 date string (YYYY-MM-DD)
     ride_time TEXT NOT NULL, -- 24h time string (HH:MM)
-    price INTEGER NOT NULL -- in cents
-);
\ No newline at end of file
+    price INTEGER NOT NULL, -- in cents
+    duration INTEGER NOT NULL DEFAULT 60 -- minutes the ride blocks in the driver's schedule
+);
+
+CREATE INDEX listings_by_date ON listings (ride_date, ride_time);
+CREATE INDEX listings_by_driver ON listings (username, ride_date, ride_time);
+
+-- Recurring schedules, expanded into listings at search time instead of being
+-- stored one row per date. An instance is addressed by a negative listing id
+-- that encodes the rule id and the ride date.
+CREATE TABLE listing_rules (
+    rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL, -- driver's username
+    weekdays INTEGER NOT NULL, -- bitmask, bit 0 = Monday ... bit 6 = Sunday
+    ride_time TEXT NOT NULL, -- 24h time string (HH:MM)
+    price INTEGER NOT NULL, -- in cents
+    duration INTEGER NOT NULL DEFAULT 60, -- minutes
+    start_date TEXT NOT NULL, -- ISO 8601 date string (YYYY-MM-DD), inclusive
+    end_date TEXT NOT NULL -- ISO 8601 date string (YYYY-MM-DD), inclusive
+);
+
+CREATE INDEX listing_rules_by_end_date ON listing_rules (end_date, start_date);
+CREATE INDEX listing_rules_by_driver ON listing_rules (username);
+
+-- Rule instances that are no longer available, e.g. because they were reserved
+CREATE TABLE listing_rule_exceptions (
+    rule_id INTEGER NOT NULL,
+    ride_date TEXT NOT NULL, -- ISO 8601 date string (YYYY-MM-DD)
+    PRIMARY KEY (rule_id, ride_date),
+    FOREIGN KEY (rule_id) REFERENCES listing_rules(rule_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Compact numeric ids for drivers, used as one dimension of listing_windows
+CREATE TABLE listing_drivers (
+    driver_id INTEGER PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL
+);
+
+-- Interval index over each one-off listing's time window per driver, used to
+-- reject overlapping listings in O(log n). Maintained by the triggers below.
+CREATE VIRTUAL TABLE listing_windows USING rtree_i32(
+    listing_id,
+    driver_min, driver_max, -- listing_drivers.driver_id
+    start_min, end_min -- minutes since the Unix epoch, end exclusive
+);
+
+CREATE TRIGGER listings_window_insert AFTER INSERT ON listings
+BEGIN
+    INSERT OR IGNORE INTO listing_drivers (username) VALUES (NEW.username);
+    INSERT INTO listing_windows
+    SELECT NEW.listing_id, driver_id, driver_id,
+        strftime('%s', NEW.ride_date || ' ' || NEW.ride_time) / 60,
+        strftime('%s', NEW.ride_date || ' ' || NEW.ride_time) / 60 + NEW.duration
+    FROM listing_drivers WHERE username = NEW.username;
+END;
+
+CREATE TRIGGER listings_window_delete AFTER DELETE ON listings
+BEGIN
+    DELETE FROM listing_windows WHERE listing_id = OLD.listing_id;
+END;
@@ -10,46 +10,59 @@ import json
 import logging
 import os
 import sqlite3
+from datetime import date, datetime, timedelta, timezone
 from typing import Optional
 
-import requests
 from flask import Flask, request
 
-from api.common.auth import decode_jwt, extract_token_from_header
-from api.common.clients import get_service_base_url
+from api.common import storage
+from api.common.auth import identity_from_request
+from api.common.backup import backup_endpoint, restore_endpoint
+from api.common.clients import dependency
+from api.common.ratelimit import rate_limited
+from api.common.schema import install_schema
 
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-db_name = "/tmp/availability.db"
+db_name = storage.location("availability.db")
 sql_file = "api/availability/availability.sql"
 db_flag = False
 
+# upper bound on rows accepted by one bulk_listing call
+MAX_BULK_LISTINGS = int(os.getenv("MAX_BULK_LISTINGS", "1000"))
+# stay below SQLite's default limit on bound parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+# minutes a listing blocks in the driver's schedule
+DEFAULT_DURATION_MINUTES = 60
+MAX_DURATION_MINUTES = 12 * 60
+# how far ahead /schedule expands recurring listings
+MAX_SCHEDULE_DAYS = 90
+# longest schedule a single listing rule may cover
+MAX_RULE_DAYS = 2 * 366
+
+# recurring listing instances are addressed as -(rule_id * RULE_ID_FACTOR + YYYYMMDD)
+RULE_ID_FACTOR = 10 ** 8
+WEEKDAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+WEEKDAY_PRESETS = {"daily": 0b1111111, "weekdays": 0b0011111, "weekends": 0b1100000}
+
 
 def create_db() -> None:
-	"""Create the SQLite database from the SQL schema file if it does not exist."""
-	conn: Optional[sqlite3.Connection] = None
+	"""Create the SQLite database from the schema template, or the SQL schema file."""
 	try:
-		conn = sqlite3.connect(db_name)
-		with open(sql_file, 'r') as sql_startup:
-			init_db = sql_startup.read()
-		cursor = conn.cursor()
-		cursor.executescript(init_db)
-		conn.commit()
+		install_schema(db_name, sql_file)
 		global db_flag
 		db_flag = True
 	except Exception:
 		logger.exception("Error in create_db")
-	finally:
-		if conn is not None:
-			conn.close()
 
 
 def get_db() -> sqlite3.Connection:
 	"""Return a SQLite connection, creating the database on first use."""
 	if not db_flag:
 		create_db()
-	conn = sqlite3.connect(db_name)
+	conn = storage.connect(db_name)
 	curr = conn.cursor()
 	curr.execute("PRAGMA foreign_keys = ON;")
 	return conn
@@ -69,55 +82,193 @@ def clear() -> tuple[str, int]:
 	if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
 		return "Forbidden", 403
 
-	if os.path.exists(db_name):
-		os.remove(db_name)
+	storage.remove(db_name)
 	create_db()
 	logger.info("Database has been cleared and recreated")
 	return "The database has been cleared", 200
 
+
+@app.route('/api/availability/backup', methods=['POST'])
+def backup() -> tuple[str, int]:
+	"""
+	Copy the availability database into a backup set without stopping traffic. Admin only.
+
+	Pass a valid X-Admin-Token header, and the set's `marker` as a form field
+	(a new one is made up without it). See api/common/backup.py.
+	"""
+	return backup_endpoint("availability", [db_name])
+
+
+@app.route('/api/availability/restore', methods=['POST'])
+def restore() -> tuple[str, int]:
+	"""
+	Overwrite the availability database with the copy in the backup set `marker`. Admin only.
+
+	Pass a valid X-Admin-Token header.
+	"""
+	return restore_endpoint("availability", [db_name], _restored)
+
+
+def _restored() -> None:
+	global db_flag
+	db_flag = True
+
+def _parse_duration(value) -> Optional[int]:
+	"""Parse a listing duration in minutes, defaulting to DEFAULT_DURATION_MINUTES."""
+	if value in (None, ""):
+		return DEFAULT_DURATION_MINUTES
+	try:
+		duration = int(value)
+	except (TypeError, ValueError):
+		return None
+	return duration if 0 < duration <= MAX_DURATION_MINUTES else None
+
+
+def _parse_ride_date(value) -> date:
+	"""
+	An ISO date a ride can be on; raises ValueError if it is malformed.
+
+	The first and last days of the calendar are refused too: overlap checks
+	look a day either side, and date arithmetic past them overflows.
+	"""
+	day = date.fromisoformat(value)
+	if not date.min < day < date.max:
+		raise ValueError(f"{value} is at the end of the calendar")
+	return day
+
+
+def _parse_listing(fields) -> Optional[tuple[int, str, str, int, int]]:
+	"""
+	Validate one listing's fields, returning (listing_id, ride_date, ride_time, price_cents, duration).
+
+	Returns None when a field is missing or malformed.
+	"""
+	try:
+		listing_id = int(fields.get("listingid"))
+		ride_date = _parse_ride_date(fields.get("ride_date")).isoformat()
+		ride_time = datetime.strptime(fields.get("ride_time"), "%H:%M").strftime("%H:%M")
+		price_cents = round(float(fields.get("price")) * 100)
+	except (TypeError, ValueError):
+		return None
+	duration = _parse_duration(fields.get("duration"))
+	if listing_id <= 0 or price_cents < 0 or duration is None:
+		return None
+	return listing_id, ride_date, ride_time, price_cents, duration
+
+
+def _get_driver_status(username: str) -> Optional[int]:
+	"""Ask the users service whether `username` is a driver (1), a rider (0) or unknown (None)."""
+	data = dependency("USERS_SERVICE_URL").get(
+		"/api/users/get_driver_status",
+		params={"username": username},
+		default=request.host_url
+	)
+	return data.get("driver")
+
+
+def _epoch_minutes(ride_date: str, ride_time: str) -> int:
+	"""Minutes since the Unix epoch, matching the listing_windows triggers."""
+	return int(datetime.fromisoformat(f"{ride_date}T{ride_time}")
+			   .replace(tzinfo=timezone.utc).timestamp()) // 60
+
+
+class _OverlapChecker:
+	"""
+	Finds listings and rule instances of one driver that overlap a time window.
+
+	One-off listings are looked up in the listing_windows R*Tree, so each check
+	is O(log n) in the number of listings. The driver's recurring rules are
+	loaded once and matched in Python.
+	"""
+
+	def __init__(self, curr: sqlite3.Cursor, username: str):
+		self.curr = curr
+		curr.execute("""
+			SELECT driver_id FROM listing_drivers WHERE username = ?;
+			""", (username,))
+		row = curr.fetchone()
+		self.driver_id = row[0] if row else None
+		curr.execute("""
+			SELECT rule_id, weekdays, ride_time, duration, start_date, end_date
+			FROM listing_rules WHERE username = ?;
+			""", (username,))
+		self.rules = curr.fetchall()
+
+	def find(self, ride_date: str, ride_time: str, duration: int) -> Optional[int]:
+		"""Return the id of a listing overlapping the window, or None if it is free."""
+		start = _epoch_minutes(ride_date, ride_time)
+		end = start + duration
+		if self.driver_id is not None:
+			self.curr.execute("""
+				SELECT listing_id FROM listing_windows
+				WHERE driver_min <= ? AND driver_max >= ? AND start_min < ? AND end_min > ?
+				LIMIT 1;
+				""", (self.driver_id, self.driver_id, end, start))
+			row = self.curr.fetchone()
+			if row:
+				return row[0]
+
+		# a rule instance on the previous or next day can still reach into this window
+		day = date.fromisoformat(ride_date)
+		for rule_id, weekdays, rule_time, rule_duration, start_date, end_date in self.rules:
+			for offset in (-1, 0, 1):
+				rule_date = (day + timedelta(days=offset)).isoformat()
+				if not start_date <= rule_date <= end_date:
+					continue
+				if not weekdays & (1 << (day.weekday() + offset) % 7):
+					continue
+				rule_start = _epoch_minutes(rule_date, rule_time)
+				if rule_start < end and start < rule_start + rule_duration:
+					return _rule_instance_id(rule_id, rule_date)
+		return None
+
+
 @app.route('/api/availability/listing', methods=['POST'])
 def listing() -> str:
 	"""
 	Create a new availability listing for a driver on a specific date.
 
+	Listings that overlap another of the driver's listings, one-off or
+	recurring, are rejected with OVERLAP.
+
 	Expected form fields:
 	- ride_date: ISO date string (YYYY-MM-DD)
 	- ride_time: 24h time string (HH:MM)
 	- price: decimal price in dollars (e.g. 9.99)
-	- listingid: integer ID chosen by the caller
+	- listingid: positive integer ID chosen by the caller
+	- duration (optional): minutes the ride takes, defaults to 60
 	"""
-	ride_date = request.form.get("ride_date")
-	ride_time = request.form.get("ride_time")
-	price_cents = int(float(request.form.get("price")) * 100)
-	listing_id = request.form.get("listingid")
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
-
-	if not ride_date or not ride_time or not listing_id:
+	parsed = _parse_listing(request.form)
+
+	if not parsed:
 		return json.dumps({"status": 2, "error": "INVALID_INPUT"})
 
-	payload = decode_jwt(token)
+	payload = identity_from_request(request.headers)
 	if not payload or "sub" not in payload:
 		return json.dumps({"status": 2, "error": "UNAUTHORIZED"})
 	username = payload["sub"]
+	listing_id, ride_date, ride_time, price_cents, duration = parsed
 
 	conn: Optional[sqlite3.Connection] = None
 	try:
 		# ensure the user is valid and a driver
-		users_service_url = get_service_base_url("USERS_SERVICE_URL", default=request.host_url)
-		data = requests.get(
-			f"{users_service_url}/api/users/get_driver_status",
-			params={"username": username}
-		).json()
-		if data.get("driver") != 1:
+		if _get_driver_status(username) != 1:
 			return json.dumps({"status": 2, "error": "NOT_DRIVER"})
 
 		conn = get_db()
 		curr = conn.cursor()
+		# hold the write lock so the overlap check and the insert see the same schedule
+		curr.execute("BEGIN IMMEDIATE;")
+		overlapping = _OverlapChecker(curr, username).find(ride_date, ride_time, duration)
+		if overlapping is not None:
+			conn.rollback()
+			conn.close()
+			return json.dumps({"status": 2, "error": "OVERLAP", "conflicts_with": overlapping})
 
 		curr.execute("""
-			INSERT INTO listings VALUES(?,?,?,?,?);
-			""", (listing_id, username, ride_date, ride_time, price_cents))
+			INSERT INTO listings (listing_id, username, ride_date, ride_time, price, duration)
+			VALUES (?,?,?,?,?,?);
+			""", (listing_id, username, ride_date, ride_time, price_cents, duration))
 		conn.commit()
 		conn.close()
 		return json.dumps({"status": 1})
@@ -132,7 +283,305 @@ def listing() -> str:
 		return json.dumps({"status": 2, "error": "INTERNAL_ERROR"})
 
 
+def _read_bulk_listings() -> Optional[list]:
+	"""Read the bulk listing body as a JSON array or an NDJSON stream, or None if malformed."""
+	if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+		items = []
+		try:
+			for line in request.stream:
+				if line.strip():
+					items.append(json.loads(line))
+		except ValueError:
+			return None
+		return items
+
+	items = request.get_json(silent=True)
+	return items if isinstance(items, list) else None
+
+
+@app.route('/api/availability/bulk_listing', methods=['POST'])
+def bulk_listing() -> str:
+	"""
+	Create many availability listings for the authenticated driver in one call.
+
+	The body is a JSON array, or an NDJSON stream sent as application/x-ndjson,
+	of objects with the same fields as `listing()`: ride_date, ride_time, price,
+	listingid and optionally duration. Driver status is checked once and every
+	valid row is inserted in a single transaction.
+
+	The response holds one result per input row, in input order, with status 1
+	for inserted rows and status 2 plus INVALID_INPUT, CONFLICT (listingid
+	taken) or OVERLAP (window clashes with another listing) otherwise.
+	"""
+
+	payload = identity_from_request(request.headers)
+	if not payload or "sub" not in payload:
+		return json.dumps({"status": 2, "error": "UNAUTHORIZED", "data": []})
+	username = payload["sub"]
+
+	items = _read_bulk_listings()
+	if items is None:
+		return json.dumps({"status": 2, "error": "INVALID_INPUT", "data": []})
+	if len(items) > MAX_BULK_LISTINGS:
+		return json.dumps({"status": 2, "error": "TOO_MANY_LISTINGS", "data": []})
+
+	conn: Optional[sqlite3.Connection] = None
+	try:
+		if _get_driver_status(username) != 1:
+			return json.dumps({"status": 2, "error": "NOT_DRIVER", "data": []})
+
+		results = []
+		rows = {}
+		for item in items:
+			parsed = _parse_listing(item) if isinstance(item, dict) else None
+			listing_id = item.get("listingid") if isinstance(item, dict) else None
+			if not parsed:
+				results.append({"listingid": listing_id, "status": 2, "error": "INVALID_INPUT"})
+			elif parsed[0] in rows:
+				results.append({"listingid": parsed[0], "status": 2, "error": "CONFLICT"})
+			else:
+				rows[parsed[0]] = parsed
+				results.append({"listingid": parsed[0], "status": 1})
+
+		conn = get_db()
+		curr = conn.cursor()
+		# hold the write lock so no other writer can claim our ids between the check and the insert
+		curr.execute("BEGIN IMMEDIATE;")
+		rejected = {}
+		ids = list(rows)
+		for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+			chunk = ids[start:start + SQLITE_MAX_PARAMS]
+			curr.execute(f"""
+				SELECT listing_id FROM listings
+				WHERE listing_id IN ({",".join("?" * len(chunk))});
+				""", chunk)
+			rejected.update((row[0], {"error": "CONFLICT"}) for row in curr.fetchall())
+
+		# check every new window against the stored schedule, then sweep the
+		# batch in start order so rows in the same upload cannot overlap either
+		checker = _OverlapChecker(curr, username)
+		windows = []
+		for listing_id, ride_date, ride_time, _price, duration in rows.values():
+			if listing_id in rejected:
+				continue
+			overlapping = checker.find(ride_date, ride_time, duration)
+			if overlapping is not None:
+				rejected[listing_id] = {"error": "OVERLAP", "conflicts_with": overlapping}
+				continue
+			start_minute = _epoch_minutes(ride_date, ride_time)
+			windows.append((start_minute, start_minute + duration, listing_id))
+		windows.sort()
+		latest_end, latest_id = None, None
+		for start_minute, end_minute, listing_id in windows:
+			if latest_end is not None and start_minute < latest_end:
+				rejected[listing_id] = {"error": "OVERLAP", "conflicts_with": latest_id}
+				continue
+			latest_end, latest_id = end_minute, listing_id
+
+		curr.executemany("""
+			INSERT INTO listings (listing_id, username, ride_date, ride_time, price, duration)
+			VALUES (?,?,?,?,?,?);
+			""", ((listing_id, username, ride_date, ride_time, price_cents, duration)
+				  for listing_id, ride_date, ride_time, price_cents, duration in rows.values()
+				  if listing_id not in rejected))
+		conn.commit()
+		conn.close()
+
+		for result in results:
+			if result["status"] == 1 and result["listingid"] in rejected:
+				result.update(status=2, **rejected[result["listingid"]])
+		inserted = sum(1 for result in results if result["status"] == 1)
+		return json.dumps({"status": 1, "inserted": inserted, "data": results})
+
+	except Exception:
+		logger.exception("Error in bulk_listing")
+		try:
+			if conn is not None:
+				conn.close()
+		except Exception:
+			pass
+		return json.dumps({"status": 2, "error": "INTERNAL_ERROR", "data": []})
+
+
+def _rule_instance_id(rule_id: int, ride_date: str) -> int:
+	"""Return the (negative) listing id of a recurring rule's instance on `ride_date`."""
+	return -(rule_id * RULE_ID_FACTOR + int(ride_date.replace("-", "")))
+
+
+def _parse_rule_instance_id(listingid: Optional[str]) -> Optional[tuple[int, str]]:
+	"""Split a rule instance listing id into (rule_id, ride_date), or None if it is not one."""
+	try:
+		listing_id = int(listingid)
+	except (TypeError, ValueError):
+		return None
+	if listing_id >= 0:
+		return None
+	rule_id, ymd = divmod(-listing_id, RULE_ID_FACTOR)
+	try:
+		ride_date = datetime.strptime(f"{ymd:08d}", "%Y%m%d").date().isoformat()
+	except ValueError:
+		return None
+	return rule_id, ride_date
+
+
+def _parse_weekdays(value: Optional[str]) -> Optional[int]:
+	"""
+	Parse a weekday spec into a bitmask (bit 0 = Monday).
+
+	Accepts "daily", "weekdays", "weekends" or a comma separated list such as "mon,wed,fri".
+	"""
+	if not value:
+		return None
+	value = value.strip().lower()
+	if value in WEEKDAY_PRESETS:
+		return WEEKDAY_PRESETS[value]
+	mask = 0
+	for name in value.split(","):
+		name = name.strip()[:3]
+		if name not in WEEKDAY_NAMES:
+			return None
+		mask |= 1 << WEEKDAY_NAMES.index(name)
+	return mask
+
+
+@app.route('/api/availability/listing_rule', methods=['POST'])
+def listing_rule() -> str:
+	"""
+	Register a recurring listing, e.g. "weekdays 08:00, $12.50 until 2026-12-31".
+
+	Instances are expanded by `search()` for each matching date instead of
+	being stored as one listings row per date.
+
+	Expected form fields:
+	- weekdays: "daily", "weekdays", "weekends" or a list like "mon,wed,fri"
+	- ride_time: 24h time string (HH:MM)
+	- price: decimal price in dollars (e.g. 12.50)
+	- end_date: last ISO date (YYYY-MM-DD) of the schedule, inclusive
+	- start_date (optional): first ISO date of the schedule, defaults to today
+	- duration (optional): minutes each ride takes, defaults to 60
+
+	Rules whose instances would overlap any of the driver's other listings are
+	rejected with OVERLAP.
+	"""
+	weekdays = _parse_weekdays(request.form.get("weekdays"))
+	try:
+		ride_time = datetime.strptime(request.form.get("ride_time"), "%H:%M").strftime("%H:%M")
+		price_cents = round(float(request.form.get("price")) * 100)
+		start_date = _parse_ride_date(request.form.get("start_date") or date.today().isoformat())
+		end_date = _parse_ride_date(request.form.get("end_date"))
+	except (TypeError, ValueError):
+		return json.dumps({"status": 2, "error": "INVALID_INPUT"})
+	duration = _parse_duration(request.form.get("duration"))
+	if (not weekdays or price_cents < 0 or duration is None
+			or not 0 <= (end_date - start_date).days <= MAX_RULE_DAYS):
+		return json.dumps({"status": 2, "error": "INVALID_INPUT"})
+
+	payload = identity_from_request(request.headers)
+	if not payload or "sub" not in payload:
+		return json.dumps({"status": 2, "error": "UNAUTHORIZED"})
+	username = payload["sub"]
+
+	conn: Optional[sqlite3.Connection] = None
+	try:
+		if _get_driver_status(username) != 1:
+			return json.dumps({"status": 2, "error": "NOT_DRIVER"})
+
+		conn = get_db()
+		curr = conn.cursor()
+		curr.execute("BEGIN IMMEDIATE;")
+		checker = _OverlapChecker(curr, username)
+		day = start_date
+		while day <= end_date:
+			if weekdays & (1 << day.weekday()):
+				overlapping = checker.find(day.isoformat(), ride_time, duration)
+				if overlapping is not None:
+					conn.rollback()
+					conn.close()
+					return json.dumps({"status": 2, "error": "OVERLAP", "conflicts_with": overlapping})
+			day += timedelta(days=1)
+
+		curr.execute("""
+			INSERT INTO listing_rules (
+				username, weekdays, ride_time, price, duration, start_date, end_date
+			) VALUES (?,?,?,?,?,?,?);
+			""", (username, weekdays, ride_time, price_cents, duration,
+				  start_date.isoformat(), end_date.isoformat()))
+		rule_id = curr.lastrowid
+		conn.commit()
+		conn.close()
+		return json.dumps({"status": 1, "rule_id": rule_id})
+
+	except Exception:
+		logger.exception("Error in listing_rule")
+		try:
+			if conn is not None:
+				conn.close()
+		except Exception:
+			pass
+		return json.dumps({"status": 2, "error": "INTERNAL_ERROR"})
+
+
+@app.route('/api/availability/remove_listing_rule', methods=['POST'])
+def remove_listing_rule() -> str:
+	"""Delete one of the authenticated driver's recurring listings (form field: rule_id)."""
+	rule_id = request.form.get("rule_id")
+
+	payload = identity_from_request(request.headers)
+	if not payload or "sub" not in payload:
+		return json.dumps({"status": 2, "error": "UNAUTHORIZED"})
+	username = payload["sub"]
+
+	conn: Optional[sqlite3.Connection] = None
+	try:
+		conn = get_db()
+		curr = conn.cursor()
+		curr.execute("""
+			DELETE FROM listing_rules WHERE rule_id = ? AND username = ?;
+			""", (rule_id, username))
+		deleted = curr.rowcount
+		conn.commit()
+		conn.close()
+		if not deleted:
+			return json.dumps({"status": 2, "error": "NOT_FOUND"})
+		return json.dumps({"status": 1})
+
+	except Exception:
+		logger.exception("Error in remove_listing_rule")
+		try:
+			if conn is not None:
+				conn.close()
+		except Exception:
+			pass
+		return json.dumps({"status": 2, "error": "INTERNAL_ERROR"})
+
+
+def _expand_rules(curr: sqlite3.Cursor, ride_date: str,
+				  ride_time: Optional[str] = None) -> list[tuple[int, int, str]]:
+	"""Return (listing_id, price, username) for every open rule instance on `ride_date`."""
+	try:
+		weekday_bit = 1 << date.fromisoformat(ride_date).weekday()
+	except (TypeError, ValueError):
+		return []
+
+	query = """
+		SELECT rule_id, price, username FROM listing_rules AS r
+		WHERE end_date >= ? AND start_date <= ? AND (weekdays & ?) != 0
+		AND NOT EXISTS (
+			SELECT 1 FROM listing_rule_exceptions AS e
+			WHERE e.rule_id = r.rule_id AND e.ride_date = ?
+		)
+		"""
+	params = [ride_date, ride_date, weekday_bit, ride_date]
+	if ride_time:
+		query += " AND ride_time = ?"
+		params.append(ride_time)
+	curr.execute(query + ";", params)
+	return [(_rule_instance_id(rule_id, ride_date), price, username)
+			for rule_id, price, username in curr.fetchall()]
+
+
 @app.route('/api/availability/search', methods=['GET'])
+@rate_limited("search", rate=5, burst=20)
 def search() -> str:
 	"""
 	Search for available ride listings on a specific date for an authenticated user.
@@ -143,24 +592,17 @@ def search() -> str:
 	"""
 	ride_date = request.args.get("ride_date")
 	ride_time = request.args.get("ride_time")
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
 	listings = []
 
-	payload = decode_jwt(token)
+	payload = identity_from_request(request.headers)
 	if not payload or "sub" not in payload:
 		return json.dumps({"status": 2, "error": "UNAUTHORIZED", "data": listings})
 	rider_username = payload["sub"]
 
 	conn: Optional[sqlite3.Connection] = None
 	try:
-		users_service_url = get_service_base_url("USERS_SERVICE_URL", default=request.host_url)
 		# ensure the user exists (drivers and riders can both search)
-		data = requests.get(
-			f"{users_service_url}/api/users/get_driver_status",
-			params={"username": rider_username}
-		).json()
-		driver_flag = data.get("driver")
+		driver_flag = _get_driver_status(rider_username)
 		if driver_flag not in (0, 1):
 			return json.dumps({"status": 2, "error": "USER_NOT_FOUND", "data": listings})
 
@@ -178,16 +620,21 @@ def search() -> str:
 				WHERE ride_date = ?;
 				""", (ride_date,))
 		results = curr.fetchall()
+		# add instances of recurring listings that fall on this date
+		results.extend(_expand_rules(curr, ride_date, ride_time))
 		conn.close()
 
 		# if there are any valid listings, append them to the list
 		for tup in results:
 			driver_username = tup[2]
-			# get avg rating of each driver
-			data = requests.get(
-				f"{users_service_url}/api/users/get_average_rating",
-				params={"username": driver_username}
-			).json()
+			# get avg rating of each driver; listings still show while users is down
+			data = dependency("USERS_SERVICE_URL").get(
+				"/api/users/get_average_rating",
+				params={"username": driver_username},
+				default=request.host_url,
+				hedge=True,
+				fallback={"avg": "0.00"}
+			)
 			avg = data.get("avg") if data.get("avg") else "0.00"
 
 			listing = {
@@ -209,9 +656,95 @@ def search() -> str:
 		return json.dumps({"status": 2, "error": "INTERNAL_ERROR", "data": []})
 
 
+@app.route('/api/availability/schedule', methods=['GET'])
+def schedule() -> str:
+	"""
+	Return the authenticated driver's upcoming open listings, sorted by date and time.
+
+	One-off listings are read through the (username, ride_date, ride_time)
+	index and recurring rules are expanded for each day in the window.
+
+	Query parameters:
+	- from_date (optional): first ISO date to include, defaults to today
+	- days (optional): number of days to include, defaults to 14 (max 90)
+	"""
+	payload = identity_from_request(request.headers)
+	if not payload or "sub" not in payload:
+		return json.dumps({"status": 2, "error": "UNAUTHORIZED", "data": []})
+	username = payload["sub"]
+
+	try:
+		from_date = _parse_ride_date(request.args.get("from_date") or date.today().isoformat())
+		days = int(request.args.get("days") or 14)
+		if not 0 < days <= MAX_SCHEDULE_DAYS:
+			raise ValueError(f"{days} days")
+		to_date = _parse_ride_date((from_date + timedelta(days=days - 1)).isoformat())
+	except (ValueError, OverflowError):
+		return json.dumps({"status": 2, "error": "INVALID_INPUT", "data": []})
+
+	conn: Optional[sqlite3.Connection] = None
+	try:
+		conn = get_db()
+		curr = conn.cursor()
+		curr.execute("""
+			SELECT listing_id, ride_date, ride_time, duration, price FROM listings
+			WHERE username = ? AND ride_date BETWEEN ? AND ?
+			ORDER BY ride_date, ride_time;
+			""", (username, from_date.isoformat(), to_date.isoformat()))
+		entries = [{
+			"listingid": listing_id,
+			"ride_date": ride_date,
+			"ride_time": ride_time,
+			"duration": duration,
+			"price": f"{price / 100:.2f}",
+		} for listing_id, ride_date, ride_time, duration, price in curr.fetchall()]
+
+		curr.execute("""
+			SELECT rule_id, weekdays, ride_time, duration, price, start_date, end_date
+			FROM listing_rules WHERE username = ? AND end_date >= ? AND start_date <= ?;
+			""", (username, from_date.isoformat(), to_date.isoformat()))
+		rules = curr.fetchall()
+		curr.execute(f"""
+			SELECT rule_id, ride_date FROM listing_rule_exceptions
+			WHERE rule_id IN ({",".join("?" * len(rules))}) AND ride_date BETWEEN ? AND ?;
+			""", [rule[0] for rule in rules] + [from_date.isoformat(), to_date.isoformat()])
+		claimed = set(curr.fetchall())
+		conn.close()
+
+		for rule_id, weekdays, ride_time, duration, price, start_date, end_date in rules:
+			for offset in range(days):
+				ride_date = (from_date + timedelta(days=offset)).isoformat()
+				if (start_date <= ride_date <= end_date
+						and weekdays & (1 << (from_date.weekday() + offset) % 7)
+						and (rule_id, ride_date) not in claimed):
+					entries.append({
+						"listingid": _rule_instance_id(rule_id, ride_date),
+						"ride_date": ride_date,
+						"ride_time": ride_time,
+						"duration": duration,
+						"price": f"{price / 100:.2f}",
+						"rule_id": rule_id,
+					})
+		entries.sort(key=lambda entry: (entry["ride_date"], entry["ride_time"]))
+		return json.dumps({"status": 1, "data": entries})
+
+	except Exception:
+		logger.exception("Error in schedule")
+		try:
+			if conn is not None:
+				conn.close()
+		except Exception:
+			pass
+		return json.dumps({"status": 2, "error": "INTERNAL_ERROR", "data": []})
+
+
 @app.route('/api/availability/get_driver_price', methods=['GET'])
 def get_driver_price() -> str:
-	"""Internal helper to return (driver_username, price_cents, ride_date, ride_time) for a listing."""
+	"""
+	Internal helper to return (driver_username, price_cents, ride_date, ride_time) for a listing.
+
+	Negative listing ids resolve to an open instance of a recurring listing.
+	"""
 	listingid = request.args.get("listingid")
 
 	conn: Optional[sqlite3.Connection] = None
@@ -219,11 +752,27 @@ def get_driver_price() -> str:
 		conn = get_db()
 		curr = conn.cursor()
 
-		curr.execute("""
-			SELECT username, price, ride_date, ride_time
-			FROM listings WHERE listing_id = ?;
-			""", (listingid,))
-		result = curr.fetchone()
+		instance = _parse_rule_instance_id(listingid)
+		if instance:
+			rule_id, ride_date = instance
+			curr.execute("""
+				SELECT username, price, ride_time, weekdays FROM listing_rules AS r
+				WHERE rule_id = ? AND start_date <= ? AND end_date >= ?
+				AND NOT EXISTS (
+					SELECT 1 FROM listing_rule_exceptions AS e
+					WHERE e.rule_id = r.rule_id AND e.ride_date = ?
+				);
+				""", (rule_id, ride_date, ride_date, ride_date))
+			rule = curr.fetchone()
+			result = None
+			if rule and rule[3] & (1 << date.fromisoformat(ride_date).weekday()):
+				result = (rule[0], rule[1], ride_date, rule[2])
+		else:
+			curr.execute("""
+				SELECT username, price, ride_date, ride_time
+				FROM listings WHERE listing_id = ?;
+				""", (listingid,))
+			result = curr.fetchone()
 		conn.close()
 		if not result:
 			return json.dumps({"status": 2, "error": "NOT_FOUND", "data": None})
@@ -241,15 +790,27 @@ def get_driver_price() -> str:
 
 @app.route('/api/availability/remove_availability', methods=['POST'])
 def remove_availability() -> str:
-	"""Internal helper to delete a listing once a reservation is made."""
+	"""
+	Internal helper to delete a listing once a reservation is made.
+
+	For an instance of a recurring listing, only that date is claimed by
+	recording an exception for the rule.
+	"""
 	listingid = request.form.get("listingid")
 
+	conn: Optional[sqlite3.Connection] = None
 	try:
 		conn = get_db()
 		curr = conn.cursor()
-		curr.execute("""
-			DELETE FROM listings WHERE listing_id = ?;
-			""", (listingid,))
+		instance = _parse_rule_instance_id(listingid)
+		if instance:
+			curr.execute("""
+				INSERT OR IGNORE INTO listing_rule_exceptions VALUES(?,?);
+				""", instance)
+		else:
+			curr.execute("""
+				DELETE FROM listings WHERE listing_id = ?;
+				""", (listingid,))
 		conn.commit()
 		conn.close()
 		return json.dumps({"status": 1})
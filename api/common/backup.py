@@ -0,0 +1,329 @@
+"""
+Online backups of the ridedemand service databases.
+
+Each service has admin-only `backup` and `restore` endpoints.
+`scripts/backup_services.py` calls all four at once with one shared marker,
+either on demand or on a schedule. Service <name> writes its copy to
+BACKUP_DIR/<marker>/<name>.<i>.db and, once every file is written,
+BACKUP_DIR/<marker>/<name>.json. A backup set is complete when all four
+services have written their manifest.
+
+The four copies are one snapshot. Each service takes its databases' write
+locks and pins what it will copy. It then writes BACKUP_DIR/<marker>/<name>.pinned
+and waits until every service named in the request's `services` has written
+its own (the first to see them all leaves BACKUP_DIR/<marker>/barrier). Only
+then are writes let through again, so every copy holds the state of one
+moment in which no service was writing. A request that spans services and
+is halfway through at that moment is in one copy and not another, the same
+as after all four services crashed together. A service that has not pinned
+within BACKUP_BARRIER_SECONDS fails the backup everywhere, and the set stays
+incomplete. Each service removes its .pinned file when its backup ends,
+whether it succeeded or failed. A backup with no `services` waits for no one.
+
+Copies use SQLite's online backup API. They read BACKUP_STEP_PAGES pages per
+step and pause BACKUP_STEP_PAUSE_SECONDS between steps, so the copy's I/O is
+spread out instead of arriving in one burst. The users, availability and
+reservations databases are in WAL mode, where the copy holds a read
+transaction for its whole duration. That pins the snapshot without blocking
+writers, so these are copied in steps after the barrier. Payments keeps the
+rollback journal, because its cross-shard transfers need it to be atomic,
+and in-memory databases have no WAL. These are held by a read transaction
+over every table, and copied through it in one step before it ends, so
+their writers wait for the copy too. In shared cache, writes then fail with
+"database table is locked" instead of waiting.
+copy_database on its own copies such a database in steps instead. Then a
+write between steps makes SQLite restart the copy, and after
+BACKUP_MAX_RESTARTS restarts the rest is copied in one step.
+
+Restoring a copy is one step per file. It overwrites the live database
+in place, so open connections and in-memory databases keep working. Other
+worker processes keep their caches until they restart.
+"""
+import json
+import os
+import re
+import secrets
+import shutil
+import sqlite3
+import time
+from typing import Optional
+
+from flask import request
+
+from api.common import storage
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "/tmp/backups")
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "64"))
+BACKUP_STEP_PAUSE_SECONDS = float(os.getenv("BACKUP_STEP_PAUSE_SECONDS", "0.005"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+# how long writes are held while waiting for the other services to pin their snapshots
+BACKUP_BARRIER_SECONDS = float(os.getenv("BACKUP_BARRIER_SECONDS", "2"))
+BARRIER_POLL_SECONDS = 0.01
+SERVICES = ("users", "availability", "reservations", "payments")
+MARKER_PATTERN = re.compile(r"^[0-9A-Za-z][0-9A-Za-z._-]{0,63}$")
+
+
+class BackupError(Exception):
+	"""A backup or restore that cannot be done, e.g. an unknown or incomplete marker."""
+
+
+class _Restarting(Exception):
+	pass
+
+
+def new_marker() -> str:
+	"""A marker that sorts by creation time, e.g. 20261019T120000Z-3fa2c1."""
+	return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()) + "-" + secrets.token_hex(3)
+
+
+def _marker_dir(marker: str) -> str:
+	if not MARKER_PATTERN.match(marker or ""):
+		raise BackupError("Invalid marker.")
+	return os.path.join(BACKUP_DIR, marker)
+
+
+def _manifest_path(marker: str, service: str) -> str:
+	return os.path.join(_marker_dir(marker), f"{service}.json")
+
+
+def _pinned_path(marker: str, service: str) -> str:
+	return os.path.join(_marker_dir(marker), f"{service}.pinned")
+
+
+def _open_source(location: str) -> tuple[sqlite3.Connection, bool]:
+	"""A connection to copy location from, and whether its snapshot is pinned (WAL mode)."""
+	source = storage.connect(location, isolation_level=None)
+	if source.execute("PRAGMA journal_mode;").fetchone()[0] != "wal":
+		return source, False
+	# pin one snapshot; a WAL reader does not hold up writers, and the copy is never restarted
+	source.execute("BEGIN;")
+	source.execute("SELECT count(*) FROM sqlite_master;").fetchone()
+	return source, True
+
+
+def _copy(source: sqlite3.Connection, target_path: str, pages: int = -1) -> dict:
+	"""Copy source to the file target_path, pages at a time (-1: in one step)."""
+	staged = f"{target_path}.{os.getpid()}.tmp"
+	if os.path.exists(staged):
+		os.remove(staged)
+	stats = {"pages": 0, "restarts": 0, "steps": 0}
+	last_remaining = [None]
+
+	def pause(status, remaining, total):
+		stats["steps"] += 1
+		stats["pages"] = total
+		if last_remaining[0] is not None and remaining > last_remaining[0]:
+			stats["restarts"] += 1
+			if stats["restarts"] > BACKUP_MAX_RESTARTS:
+				raise _Restarting()
+		last_remaining[0] = remaining
+		if remaining:
+			time.sleep(BACKUP_STEP_PAUSE_SECONDS)
+
+	target = sqlite3.connect(staged)
+	try:
+		try:
+			source.backup(target, pages=pages, progress=pause)
+		except _Restarting:
+			# the source changes faster than small steps can copy it
+			source.backup(target)
+	finally:
+		target.close()
+	os.replace(staged, target_path)
+	return stats
+
+
+def copy_database(location: str, target_path: str) -> dict:
+	"""Copy the live database at location to the file target_path in small steps."""
+	source, _ = _open_source(location)
+	try:
+		return _copy(source, target_path, BACKUP_STEP_PAGES)
+	finally:
+		source.close()
+
+
+def _barrier_path(marker: str) -> str:
+	return os.path.join(_marker_dir(marker), "barrier")
+
+
+def _wait_for_pins(marker: str, services) -> None:
+	"""Wait until every service has pinned its snapshot, or raise BackupError after BACKUP_BARRIER_SECONDS."""
+	deadline = time.monotonic() + BACKUP_BARRIER_SECONDS
+	# the first to see every pin leaves the barrier file, as the others may already be removing theirs
+	while not os.path.exists(_barrier_path(marker)):
+		missing = [service for service in services if not os.path.exists(_pinned_path(marker, service))]
+		if not missing:
+			with open(_barrier_path(marker), "w"):
+				pass
+			return
+		if time.monotonic() >= deadline:
+			raise BackupError(f"{', '.join(missing)} did not reach the marker in time.")
+		time.sleep(BARRIER_POLL_SECONDS)
+
+
+def _hold_writes(location: str) -> tuple[Optional[sqlite3.Connection], sqlite3.Connection, bool]:
+	"""
+	Lock out location's writers and pin what will be copied.
+
+	Returns the connection holding the write lock, the connection to copy
+	from, and whether that one holds its own snapshot (WAL mode) so it can
+	be copied after writes resume. SQLite will not back up a database while
+	a write transaction is open on it, and in shared cache that is any
+	connection's, so other journal modes are held by a read transaction
+	over every table instead: writers cannot commit, or in shared cache
+	write, until it ends. Read-only replicas have their writer elsewhere.
+	"""
+	if storage.is_read_only(location):
+		source, pinned = _open_source(location)
+		return None, source, pinned
+	conn = storage.connect(location, isolation_level=None)
+	try:
+		if conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal":
+			conn.execute("BEGIN IMMEDIATE;")  # writers wait from here on
+			source, pinned = _open_source(location)
+			return conn, source, pinned
+		conn.execute("BEGIN;")
+		tables = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")]
+		for name in tables:
+			conn.execute(f'SELECT 1 FROM "{name}" LIMIT 1;').fetchall()
+		return None, conn, False
+	except Exception:
+		conn.close()
+		raise
+
+
+def back_up(service: str, locations: list, marker: str, services=()) -> dict:
+	"""
+	Copy a service's databases into the backup set marker and write its manifest.
+
+	services are all the services backing up under the same marker at the
+	same time. Writes are held until each of them has pinned its snapshot.
+	"""
+	others = [name for name in services if name != service]
+	if any(name not in SERVICES for name in others):
+		raise BackupError("Unknown service.")
+	directory = _marker_dir(marker)
+	os.makedirs(directory, exist_ok=True)
+	manifest = {"marker": marker, "service": service, "services": sorted({service, *others}),
+				"started": time.time(), "files": [None] * len(locations)}
+	held = []  # (lock, source, pinned) per location
+
+	def copy(index, source, pages=-1):
+		filename = f"{service}.{index}.db"
+		manifest["files"][index] = {"file": filename, **_copy(source, os.path.join(directory, filename), pages)}
+
+	try:
+		for location in locations:
+			held.append(_hold_writes(location))
+		if others:
+			with open(_pinned_path(marker, service), "w"):
+				pass
+			_wait_for_pins(marker, manifest["services"])
+		manifest["pinned"] = time.time()
+		for index, (lock, source, pinned) in enumerate(held):
+			if not pinned:  # nothing else holds its snapshot, so copy it before writes resume
+				copy(index, source)
+				source.rollback()
+		for lock, source, pinned in held:
+			if lock is not None:
+				lock.rollback()
+		for index, (lock, source, pinned) in enumerate(held):
+			if pinned:
+				copy(index, source, BACKUP_STEP_PAGES)
+	finally:
+		for lock, source, _ in held:
+			source.close()
+			if lock is not None:
+				lock.close()
+		if os.path.exists(_pinned_path(marker, service)):
+			os.remove(_pinned_path(marker, service))
+	manifest["finished"] = time.time()
+	# written last, so a manifest always describes files that are all there
+	staged = _manifest_path(marker, service) + ".tmp"
+	with open(staged, "w") as out:
+		json.dump(manifest, out)
+	os.replace(staged, _manifest_path(marker, service))
+	return manifest
+
+
+def restore(service: str, locations: list, marker: str) -> dict:
+	"""Overwrite a service's live databases with their copies in the backup set marker."""
+	try:
+		with open(_manifest_path(marker, service)) as manifest_file:
+			manifest = json.load(manifest_file)
+	except FileNotFoundError:
+		raise BackupError(f"No {service} backup for this marker.") from None
+	if len(manifest["files"]) != len(locations):
+		raise BackupError(f"The backup has {len(manifest['files'])} files, the service {len(locations)}.")
+	if any(storage.is_read_only(location) for location in locations):
+		raise BackupError("Read-only databases cannot be restored.")
+	for entry, location in zip(manifest["files"], locations):
+		source = sqlite3.connect(os.path.join(_marker_dir(marker), entry["file"]))
+		target = storage.connect(location)
+		try:
+			source.backup(target)
+		finally:
+			target.close()
+			source.close()
+	return manifest
+
+
+def list_sets() -> list:
+	"""Backup sets, oldest first, with the services each one is complete for."""
+	if not os.path.isdir(BACKUP_DIR):
+		return []
+	sets = []
+	for marker in sorted(os.listdir(BACKUP_DIR)):
+		if MARKER_PATTERN.match(marker) and os.path.isdir(os.path.join(BACKUP_DIR, marker)):
+			services = [service for service in SERVICES if os.path.exists(_manifest_path(marker, service))]
+			sets.append({"marker": marker, "services": services, "complete": len(services) == len(SERVICES)})
+	return sets
+
+
+def prune(keep: int) -> list:
+	"""Delete all but the newest `keep` complete sets, and incomplete sets older than those; return the markers."""
+	if keep < 1:
+		raise ValueError("keep at least one backup set")
+	sets = list_sets()
+	complete = [entry["marker"] for entry in sets if entry["complete"]]
+	if len(complete) <= keep:
+		return []
+	oldest_kept = complete[-keep]
+	removed = [entry["marker"] for entry in sets if entry["marker"] < oldest_kept]
+	for marker in removed:
+		shutil.rmtree(_marker_dir(marker))
+	return removed
+
+
+def _is_admin() -> bool:
+	admin_token = os.getenv("ADMIN_TOKEN")
+	return bool(admin_token) and request.headers.get("X-Admin-Token") == admin_token
+
+
+def backup_endpoint(service: str, locations: list) -> tuple[str, int]:
+	"""
+	Body of a service's backup route: back up into the set named by the `marker` form field.
+
+	`services` lists, comma separated, the services backing up under the same
+	marker at the same time, so that the copies are one snapshot.
+	"""
+	if not _is_admin():
+		return "Forbidden", 403
+	services = [name for name in request.form.get("services", "").split(",") if name]
+	try:
+		manifest = back_up(service, locations, request.form.get("marker") or new_marker(), services)
+		return json.dumps({"status": 1, "data": manifest}), 200
+	except BackupError as e:
+		return json.dumps({"status": 0, "error": str(e)}), 400
+
+
+def restore_endpoint(service: str, locations: list, restored) -> tuple[str, int]:
+	"""Body of a service's restore route; `restored()` then drops the service's caches."""
+	if not _is_admin():
+		return "Forbidden", 403
+	try:
+		manifest = restore(service, locations, request.form.get("marker", ""))
+	except BackupError as e:
+		return json.dumps({"status": 0, "error": str(e)}), 400
+	restored()
+	return json.dumps({"status": 1, "data": manifest}), 200
@@ -0,0 +1,50 @@
+"""
+Compact in-memory Bloom filter shared by the ridedemand microservices.
+
+A Bloom filter answers "definitely absent" without touching the database.
+A positive answer only means "maybe present" and must be confirmed against
+SQLite by the caller. Items are never removed, so callers rebuild the filter
+from the database when it drifts too far from its sizing.
+"""
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+	"""Bit-array Bloom filter sized for `capacity` items at `error_rate` false positives."""
+
+	def __init__(self, capacity: int, error_rate: float = 0.01):
+		capacity = max(capacity, 1)
+		self.capacity = capacity
+		self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+		self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+		self.count = 0
+		self._bits = bytearray((self.size + 7) // 8)
+		self._lock = threading.Lock()
+
+	def _positions(self, item: str):
+		# double hashing: h1 + i * h2 gives hash_count independent-enough positions
+		digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], "little")
+		h2 = int.from_bytes(digest[8:], "little") | 1
+		return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+	def add(self, item: str) -> None:
+		positions = self._positions(item)
+		with self._lock:
+			for position in positions:
+				self._bits[position >> 3] |= 1 << (position & 7)
+			self.count += 1
+
+	def update(self, items) -> None:
+		for item in items:
+			self.add(item)
+
+	def __contains__(self, item: str) -> bool:
+		return all(self._bits[position >> 3] & (1 << (position & 7))
+				   for position in self._positions(item))
+
+	def is_overfull(self) -> bool:
+		"""True once more items were added than the filter was sized for."""
+		return self.count > self.capacity
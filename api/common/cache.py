@@ -0,0 +1,59 @@
+"""
+Small thread-safe LRU cache with a time-to-live, shared by the ridedemand microservices.
+
+Each worker process holds its own cache, so writes made by another process
+are only seen once the entry expires. Callers that write through their own
+process should `invalidate` the affected keys. A reader that loaded a value
+from the database passes the `version` it saw before the load to `set`, so
+a value read before a concurrent invalidation is never cached after it.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+	"""Keeps at most `maxsize` entries, each for at most `ttl` seconds."""
+
+	def __init__(self, maxsize: int, ttl: float):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._entries = OrderedDict()  # key -> (expires_at, value)
+		self._lock = threading.Lock()
+		self.version = 0  # bumped by every invalidation
+
+	def get(self, key, default=None):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return default
+			if entry[0] <= time.monotonic():
+				del self._entries[key]
+				return default
+			self._entries.move_to_end(key)
+			return entry[1]
+
+	def set(self, key, value, version=None) -> None:
+		if self.maxsize <= 0:
+			return
+		with self._lock:
+			if version is not None and version != self.version:
+				return  # invalidated while the value was being loaded
+			self._entries[key] = (time.monotonic() + self.ttl, value)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+
+	def invalidate(self, *keys) -> None:
+		with self._lock:
+			self.version += 1
+			for key in keys:
+				self._entries.pop(key, None)
+
+	def clear(self) -> None:
+		with self._lock:
+			self.version += 1
+			self._entries.clear()
+
+	def __len__(self) -> int:
+		return len(self._entries)
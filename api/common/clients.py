@@ -1,9 +1,73 @@
 """
 Shared client utilities for making service-to-service calls.
+
+Calls to another service go through `dependency(env_var_name)`, which gives
+every downstream service a circuit breaker and a record of its latencies:
+
+- Every call has a timeout. Calls that fail, time out, answer 5xx or take
+  longer than BREAKER_SLOW_CALL_SECONDS count as failures. After
+  BREAKER_FAILURE_THRESHOLD failures in a row the breaker opens, and calls
+  fail at once without touching the network. After BREAKER_RESET_SECONDS a
+  single probe call is let through (half-open): it closes the breaker again
+  if it succeeds and reopens it if it fails.
+- A call made with a `fallback` returns the fallback instead of raising
+  DependencyUnavailable, e.g. a "0.00" rating while users is unavailable.
+- Idempotent GETs can be hedged. If the env var lists several replicas
+  (comma separated), a GET made with hedge=True that has not answered
+  within the dependency's p95 latency is sent again to the next replica,
+  and the first answer wins.
 """
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Optional
 
+DOWNSTREAM_TIMEOUT_SECONDS = float(os.getenv("DOWNSTREAM_TIMEOUT_SECONDS", "3"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "1"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "5"))
+# hedge delay: p95 of the last LATENCY_SAMPLES calls, once there are enough of them
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY_SECONDS = 0.05
+LATENCY_SAMPLES = 200
+CLIENT_POOL_WORKERS = int(os.getenv("CLIENT_POOL_WORKERS", "16"))
+
+_NO_FALLBACK = object()
+
+_dependencies = {}
+_dependencies_lock = threading.Lock()
+_pools = {}  # name -> ThreadPoolExecutor
+_pool_lock = threading.Lock()
+
+
+def _requests():
+    # requests takes ~50ms to import; a cold start only pays for it on its first downstream call
+    import requests
+    return requests
+
+
+def __getattr__(name: str):
+    if name == "requests":
+        return _requests()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class DependencyUnavailable(Exception):
+    """Raised when a downstream call fails or its circuit is open, and there is no fallback."""
+
+
+def get_service_base_urls(env_var_name: str, default: Optional[str] = None) -> list[str]:
+    """Return the base URLs of all replicas of a service (comma separated in the env var)."""
+    urls = [url.strip().rstrip("/") for url in os.getenv(env_var_name, "").split(",") if url.strip()]
+    if urls:
+        return urls
+    if default:
+        return [default.rstrip("/")]
+    raise ValueError(f"Service URL env var {env_var_name} not set and no default provided.")
+
 
 def get_service_base_url(env_var_name: str, default: Optional[str] = None) -> str:
     """
@@ -11,11 +75,149 @@ def get_service_base_url(env_var_name: str, default: Optional[str] = None) -> st
 
     If the environment variable is not set, it falls back to the provided
     default. This allows services to work in both Docker Compose (with env
-    vars) and Vercel (with same-origin URLs).
+    vars) and Vercel (with same-origin URLs). When the variable lists several
+    replicas, the first one is returned.
     """
-    url = os.getenv(env_var_name)
-    if url:
-        return url.rstrip("/")
-    if default:
-        return default.rstrip("/")
-    raise ValueError(f"Service URL env var {env_var_name} not set and no default provided.")
+    return get_service_base_urls(env_var_name, default)[0]
+
+
+class CircuitBreaker:
+    """Closed, open or half-open state of one dependency."""
+
+    def __init__(self, failure_threshold: int, slow_call_seconds: float, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a call may be made now; in half-open state only one probe at a time may."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half-open"
+                return True
+            return False
+
+    def record(self, ok: bool, elapsed: float) -> None:
+        failed = not ok or elapsed > self.slow_call_seconds
+        with self._lock:
+            if not failed:
+                self.state = "closed"
+                self._failures = 0
+                return
+            self._failures += 1
+            if self.state == "half-open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class Dependency:
+    """A downstream service, reached through the URLs in env_var_name."""
+
+    def __init__(self, env_var_name: str):
+        self.env_var_name = env_var_name
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_SLOW_CALL_SECONDS,
+                                      BREAKER_RESET_SECONDS)
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def get(self, path: str, params=None, *, default: Optional[str] = None, headers=None,
+            hedge: bool = False, fallback=_NO_FALLBACK):
+        """GET path and return the decoded JSON body, or fallback if the call fails."""
+        urls = [base + path for base in get_service_base_urls(self.env_var_name, default)]
+        if hedge and len(urls) > 1:
+            return self._call(lambda: self._hedged_get(urls, params, headers), fallback)
+        return self._call(lambda: self._send(_requests().get, urls[0], params=params, headers=headers), fallback)
+
+    def post(self, path: str, data=None, *, default: Optional[str] = None, headers=None,
+             fallback=_NO_FALLBACK):
+        """POST to path and return the decoded JSON body, or fallback if the call fails. Never hedged."""
+        url = get_service_base_url(self.env_var_name, default) + path
+        return self._call(lambda: self._send(_requests().post, url, data=data, headers=headers), fallback)
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the first replica before asking another: the recent p95 latency."""
+        samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_SECONDS
+        return samples[int(HEDGE_PERCENTILE * (len(samples) - 1))]
+
+    def _call(self, send, fallback):
+        if not self.breaker.allow():
+            if fallback is not _NO_FALLBACK:
+                return fallback
+            raise DependencyUnavailable(f"{self.env_var_name}: circuit open")
+        started = time.monotonic()
+        try:
+            result = send()
+        except Exception as e:
+            self.breaker.record(False, time.monotonic() - started)
+            if fallback is not _NO_FALLBACK:
+                return fallback
+            raise DependencyUnavailable(f"{self.env_var_name}: {e}") from e
+        self.breaker.record(True, time.monotonic() - started)
+        return result
+
+    def _send(self, method, url: str, **kwargs):
+        started = time.monotonic()
+        response = method(url, timeout=DOWNSTREAM_TIMEOUT_SECONDS, **kwargs)
+        self._latencies.append(time.monotonic() - started)
+        if response.status_code >= 500:
+            raise DependencyUnavailable(f"{url} answered {response.status_code}")
+        return response.json()
+
+    def _hedged_get(self, urls: list[str], params, headers):
+        pool = _get_pool("hedged-get")
+        primary = pool.submit(self._send, _requests().get, urls[0], params=params, headers=headers)
+        try:
+            return primary.result(timeout=self.hedge_delay())
+        except Exception:
+            pass  # slow, or failed fast: ask the next replica too
+        pending = {primary, pool.submit(self._send, _requests().get, urls[1], params=params, headers=headers)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+def _get_pool(name: str) -> ThreadPoolExecutor:
+    # created on first use so forked workers never inherit pool threads; gathered
+    # calls and hedges use separate pools so a gathered hedge cannot starve itself
+    with _pool_lock:
+        if name not in _pools:
+            _pools[name] = ThreadPoolExecutor(max_workers=CLIENT_POOL_WORKERS, thread_name_prefix=name)
+        return _pools[name]
+
+
+def gather(*calls) -> list:
+    """Run calls concurrently; each result is the call's return value or the exception it raised."""
+    futures = [_get_pool("gather").submit(call) for call in calls]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def dependency(env_var_name: str) -> Dependency:
+    """Return the process-wide Dependency for the service whose URLs are in env_var_name."""
+    with _dependencies_lock:
+        if env_var_name not in _dependencies:
+            _dependencies[env_var_name] = Dependency(env_var_name)
+        return _dependencies[env_var_name]
+
+
+def reset() -> None:
+    """Forget breaker states and latencies, e.g. between tests."""
+    with _dependencies_lock:
+        _dependencies.clear()
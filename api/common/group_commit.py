@@ -0,0 +1,107 @@
+"""
+Group commit for SQLite writes shared by the ridedemand microservices.
+
+Each write is a function of a cursor. Instead of committing (and syncing)
+once per request, a single writer thread per process collects the writes
+that arrive within a short window and applies them in one BEGIN IMMEDIATE
+transaction. Every write runs inside its own SAVEPOINT, so one that raises
+is rolled back alone and the rest still commit. Callers block on a Future
+and only see their result once the batch has committed.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommitWriter:
+	"""Applies submitted writes in batches of up to `max_batch`, gathered for `window` seconds."""
+
+	def __init__(self, connect, max_batch: int, window: float):
+		self.connect = connect  # returns a new sqlite3 connection
+		self.max_batch = max_batch
+		self.window = window
+		self._queue = None
+		self._pid = None
+		self._lock = threading.Lock()
+
+	def submit(self, write):
+		"""Run write(cursor) in a committed transaction and return its result, or raise its error."""
+		if self.max_batch <= 1:
+			return self._apply_inline(write)
+		future = Future()
+		self._get_queue().put((write, future))
+		return future.result()
+
+	def _get_queue(self) -> queue.Queue:
+		# the writer thread is started on first use, and again in forked children
+		with self._lock:
+			if self._pid != os.getpid():
+				self._queue = queue.Queue()
+				self._pid = os.getpid()
+				threading.Thread(target=self._run, args=(self._queue,),
+								 name="group-commit", daemon=True).start()
+			return self._queue
+
+	def _apply_inline(self, write):
+		conn = self.connect()
+		try:
+			curr = conn.cursor()
+			curr.execute("BEGIN IMMEDIATE;")
+			try:
+				result = write(curr)
+				conn.commit()
+			except Exception:
+				conn.rollback()
+				raise
+			return result
+		finally:
+			conn.close()
+
+	def _run(self, pending: queue.Queue) -> None:
+		while True:
+			batch = [pending.get()]
+			deadline = time.monotonic() + self.window
+			while len(batch) < self.max_batch:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				try:
+					batch.append(pending.get(timeout=remaining))
+				except queue.Empty:
+					break
+			self._apply_batch(batch)
+
+	def _apply_batch(self, batch) -> None:
+		outcomes = []
+		conn = None
+		try:
+			conn = self.connect()
+			curr = conn.cursor()
+			curr.execute("BEGIN IMMEDIATE;")
+			for write, future in batch:
+				curr.execute("SAVEPOINT batched_write;")
+				try:
+					outcomes.append((future, write(curr), None))
+				except Exception as e:
+					curr.execute("ROLLBACK TO batched_write;")
+					outcomes.append((future, None, e))
+				curr.execute("RELEASE batched_write;")
+			conn.commit()
+		except Exception as e:
+			# nothing in the batch was committed
+			if conn is not None:
+				conn.rollback()
+			for _, future in batch:
+				future.set_exception(e)
+			return
+		finally:
+			if conn is not None:
+				conn.close()
+
+		for future, result, error in outcomes:
+			if error is None:
+				future.set_result(result)
+			else:
+				future.set_exception(error)
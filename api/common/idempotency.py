@@ -0,0 +1,166 @@
+"""
+Idempotency keys shared by the ridedemand microservices.
+
+A client that sends the same `Idempotency-Key` header twice gets the first
+response replayed instead of the work being redone. Keys and responses are
+stored in the calling service's own SQLite database (the idempotency_keys
+table in its schema) for IDEMPOTENCY_TTL_SECONDS.
+
+A duplicate that arrives while the first request is still running waits for
+it: on an in-process Event when both are in the same worker, otherwise by
+polling the table. A request that crashed leaves a pending row behind. The
+row expires after IDEMPOTENCY_PENDING_SECONDS so a retry can run again.
+Responses with a 5xx status are not stored, so they can be retried. Nor are
+responses a handler wraps in Transient, e.g. a failure because a downstream
+service was unavailable: the key is released and a retry runs again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_PENDING_SECONDS = float(os.getenv("IDEMPOTENCY_PENDING_SECONDS", "60"))
+# how long a duplicate waits for the first request before answering 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+MAX_KEY_LENGTH = 255
+POLL_SECONDS = 0.05
+# expired keys are purged once every this many new keys
+PURGE_EVERY_CLAIMS = 1000
+
+class Transient:
+	"""A handler response that is not the request's final outcome; it is returned but never replayed."""
+
+	def __init__(self, response):
+		self.response = response
+
+
+_in_flight = {}  # (scope, key) -> Event set when the first request finishes
+_in_flight_lock = threading.Lock()
+_claims = 0
+
+
+def derive_key(*parts) -> str:
+	"""Key for a downstream call made on behalf of an idempotent request."""
+	return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def _split(response):
+	"""Normalise a Flask view return value into (body, status, headers)."""
+	if isinstance(response, tuple):
+		body, status_code, *rest = response
+		return body, status_code, rest[0] if rest else {}
+	return response, 200, {}
+
+
+def _claim(connect, scope, key, fingerprint):
+	"""Insert a pending row for key; returns None if claimed, else the stored row."""
+	global _claims
+	now = time.time()
+	conn = connect()
+	try:
+		curr = conn.cursor()
+		curr.execute("""
+			DELETE FROM idempotency_keys WHERE scope = ? AND idempotency_key = ? AND expires_at < ?;
+			""", (scope, key, now))
+		curr.execute("""
+			INSERT INTO idempotency_keys (scope, idempotency_key, fingerprint, expires_at)
+			VALUES (?,?,?,?) ON CONFLICT DO NOTHING;
+			""", (scope, key, fingerprint, now + IDEMPOTENCY_PENDING_SECONDS))
+		claimed = curr.rowcount == 1
+		if claimed:
+			_claims += 1
+			if _claims % PURGE_EVERY_CLAIMS == 0:
+				curr.execute("DELETE FROM idempotency_keys WHERE expires_at < ?;", (now,))
+		conn.commit()
+		if claimed:
+			return None
+		curr.execute("""
+			SELECT fingerprint, status_code, response FROM idempotency_keys
+			WHERE scope = ? AND idempotency_key = ?;
+			""", (scope, key))
+		# gone again if it expired in between; the caller retries the claim
+		return curr.fetchone() or (fingerprint, None, None)
+	finally:
+		conn.close()
+
+
+def _finish(connect, scope, key, status_code=None, body=None):
+	"""Store the response for key, or forget the key if there is nothing to store."""
+	conn = connect()
+	try:
+		if status_code is None:
+			conn.execute("""
+				DELETE FROM idempotency_keys WHERE scope = ? AND idempotency_key = ?;
+				""", (scope, key))
+		else:
+			conn.execute("""
+				UPDATE idempotency_keys SET status_code = ?, response = ?, expires_at = ?
+				WHERE scope = ? AND idempotency_key = ?;
+				""", (status_code, body, time.time() + IDEMPOTENCY_TTL_SECONDS, scope, key))
+		conn.commit()
+	finally:
+		conn.close()
+
+
+def run_idempotent(connect, scope, key, request_data, handler):
+	"""
+	Return handler()'s response, or the stored response of an earlier request with key.
+
+	connect opens the service's database; scope namespaces keys (e.g. per
+	endpoint and user). A repeated key with different request_data is
+	rejected with 422, and one still running after IDEMPOTENCY_WAIT_SECONDS
+	with 409. handler may wrap its response in Transient to release the key.
+	"""
+	if not key:
+		response = handler()
+		return response.response if isinstance(response, Transient) else response
+	if len(key) > MAX_KEY_LENGTH:
+		return json.dumps({"status": 0, "error": "Idempotency-Key is too long."}), 400
+	fingerprint = hashlib.sha256(json.dumps(request_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+	deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+	while True:
+		stored = _claim(connect, scope, key, fingerprint)
+		if stored is None:
+			break
+		stored_fingerprint, status_code, body = stored
+		if stored_fingerprint != fingerprint:
+			return json.dumps({"status": 0, "error": "Idempotency-Key was used for a different request."}), 422
+		if status_code is not None:
+			return body, status_code, {"Idempotent-Replayed": "true"}
+		remaining = deadline - time.monotonic()
+		if remaining <= 0:
+			return (json.dumps({"status": 0, "error": "A request with this Idempotency-Key is in progress."}),
+					409, {"Retry-After": "1"})
+		with _in_flight_lock:
+			event = _in_flight.get((scope, key))
+		if event is not None:
+			event.wait(remaining)
+		else:  # running in another process
+			time.sleep(min(POLL_SECONDS, remaining))
+
+	event = threading.Event()
+	with _in_flight_lock:
+		_in_flight[(scope, key)] = event
+	try:
+		try:
+			response = handler()
+		except Exception:
+			_finish(connect, scope, key)
+			raise
+		if isinstance(response, Transient):
+			_finish(connect, scope, key)
+			return response.response
+		body, status_code, _ = _split(response)
+		if status_code >= 500 or not isinstance(body, str):
+			_finish(connect, scope, key)
+		else:
+			_finish(connect, scope, key, status_code, body)
+		return response
+	finally:
+		with _in_flight_lock:
+			_in_flight.pop((scope, key), None)
+		event.set()
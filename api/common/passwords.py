@@ -0,0 +1,136 @@
+"""
+Password hashing shared by the ridedemand microservices.
+
+Hashes are stored tagged with their algorithm and cost, `algo$params$hex`:
+
+    scrypt$n=16384,r=8,p=1$9f86d0...
+    pbkdf2_sha256$i=600000$5e8848...
+
+Untagged hex digests are legacy sha256(password + salt) rows; they still
+verify, and `needs_rehash` flags them (and any hash made with other settings)
+so callers can upgrade them on the next successful login.
+
+Slow hashes would stall request threads, so they run on a bounded thread pool
+(hashlib releases the GIL while hashing). `offload` raises PasswordHasherBusy
+instead of queueing when the pool is saturated, and callers answer 503.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+DEFAULT_ALGORITHM = os.getenv("PASSWORD_HASH_ALGORITHM", "scrypt")
+SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", "16384"))
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "600000"))
+
+# threads hashing at once, and hashes allowed to wait for a thread
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", str(4 * HASH_WORKERS)))
+RETRY_AFTER_SECONDS = 1
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_DEPTH)
+
+
+class PasswordHasherBusy(Exception):
+	"""Raised when the hashing pool has no room for another request."""
+
+
+def new_salt() -> str:
+	return secrets.token_hex(16)
+
+
+def _scrypt(password: str, salt: str, n: int, r: int, p: int) -> str:
+	return hashlib.scrypt(password.encode("utf-8"), salt=salt.encode("utf-8"),
+						  n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20)).hex()
+
+
+def _pbkdf2(password: str, salt: str, iterations: int) -> str:
+	return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"),
+							   salt.encode("utf-8"), iterations).hex()
+
+
+def _legacy(password: str, salt: str) -> str:
+	return hashlib.sha256((password + salt).encode("utf-8")).hexdigest()
+
+
+def _current_params(algorithm: str) -> str:
+	if algorithm == "scrypt":
+		return f"n={SCRYPT_N},r={SCRYPT_R},p={SCRYPT_P}"
+	if algorithm == "pbkdf2_sha256":
+		return f"i={PBKDF2_ITERATIONS}"
+	raise ValueError(f"unknown password hash algorithm {algorithm!r}")
+
+
+def _digest(password: str, salt: str, algorithm: str, params: str) -> str:
+	values = dict(item.split("=", 1) for item in params.split(","))
+	if algorithm == "scrypt":
+		return _scrypt(password, salt, int(values["n"]), int(values["r"]), int(values["p"]))
+	if algorithm == "pbkdf2_sha256":
+		return _pbkdf2(password, salt, int(values["i"]))
+	raise ValueError(f"unknown password hash algorithm {algorithm!r}")
+
+
+def hash_password(password: str, salt: str, algorithm: Optional[str] = None) -> str:
+	"""Tagged hash of password with the current settings for algorithm."""
+	algorithm = algorithm or DEFAULT_ALGORITHM
+	params = _current_params(algorithm)
+	return f"{algorithm}${params}${_digest(password, salt, algorithm, params)}"
+
+
+def hash_with_tag(password: str, salt: str, tag: str) -> str:
+	"""
+	Hash password the way a stored hash with this tag was made.
+
+	The tag is the stored hash without its digest, `algo$params$`, or "" for
+	legacy rows. Comparing the result with stored hashes checks a password
+	against many rows for the price of one hash per distinct tag.
+	"""
+	if not tag:
+		return _legacy(password, salt)
+	algorithm, params = tag[:-1].split("$")
+	return tag + _digest(password, salt, algorithm, params)
+
+
+def verify_password(password: str, salt: str, stored: Optional[str]) -> bool:
+	"""True if password hashes to stored, whatever algorithm stored was made with."""
+	if not stored or password is None or salt is None:
+		return False
+	if "$" not in stored:
+		return hmac.compare_digest(_legacy(password, salt), stored)
+	algorithm, params, digest = stored.split("$", 2)
+	return hmac.compare_digest(_digest(password, salt, algorithm, params), digest)
+
+
+def needs_rehash(stored: str) -> bool:
+	"""True for legacy hashes and hashes made with other than the current settings."""
+	algorithm = DEFAULT_ALGORITHM
+	return not stored.startswith(f"{algorithm}${_current_params(algorithm)}$")
+
+
+def _get_pool() -> ThreadPoolExecutor:
+	# created on first use so forked workers never inherit pool threads
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+		return _pool
+
+
+def offload(fn, *args):
+	"""Run fn(*args) on the hashing pool and wait for it; PasswordHasherBusy if full."""
+	if not _slots.acquire(blocking=False):
+		raise PasswordHasherBusy()
+	try:
+		future = _get_pool().submit(fn, *args)
+	except Exception:
+		_slots.release()
+		raise
+	future.add_done_callback(lambda _: _slots.release())
+	return future.result()
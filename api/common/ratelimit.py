@@ -0,0 +1,190 @@
+"""
+Admission control shared by the ridedemand microservices.
+
+Expensive endpoints are wrapped with `rate_limited(name, rate, burst)`, which
+checks two things before running the view:
+
+- A per-process concurrency limit. All limited endpoints share
+  RATE_LIMIT_MAX_IN_FLIGHT slots. A request that finds no free slot is
+  answered 503 at once, so latency stays bounded under overload instead of
+  requests queueing behind a stalled dependency.
+- Token buckets keyed by the caller. A caller with a valid JWT is limited by
+  its `sub`, at `rate` requests per second with bursts of up to `burst`.
+  Every caller is also limited by client IP, with IP_BUDGET_FACTOR times the
+  budget, because many users can share one address. A request that finds an
+  empty bucket gets 429.
+
+Both rejections carry Retry-After. Buckets live in process memory by default.
+Set RATE_LIMIT_BACKEND=sqlite to share them between workers through the
+SQLite database RATE_LIMIT_DB, a path or api/common/storage.py location. A
+budget can be overridden without a code change with
+RATE_LIMIT_<NAME>="rate/burst", e.g. RATE_LIMIT_SEARCH="5/10".
+"""
+import functools
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from flask import request
+
+from api.common import storage
+from api.common.auth import IDENTITY_HEADER, identity_from_request
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB") or storage.location("ratelimit.db", read_only=False)
+# set where only the gateway can reach the service, otherwise clients could pick their own IP
+RATE_LIMIT_TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() == "true"
+RATE_LIMIT_MAX_IN_FLIGHT = int(os.getenv("RATE_LIMIT_MAX_IN_FLIGHT", "64"))
+IP_BUDGET_FACTOR = 5
+# memory buckets are swept of full (idle) entries past this many keys
+MAX_MEMORY_BUCKETS = 100000
+OVERLOAD_RETRY_AFTER_SECONDS = 1
+
+_buckets = {}  # key -> (tokens, updated)
+_buckets_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(RATE_LIMIT_MAX_IN_FLIGHT)
+_sqlite_ready = set()  # databases whose table exists
+
+
+def _take_memory(key: str, rate: float, burst: float, now: float) -> float:
+	"""Take a token from the memory bucket key; 0 if taken, else seconds until one is."""
+	with _buckets_lock:
+		tokens, updated = _buckets.get(key, (burst, now))
+		tokens = min(burst, tokens + (now - updated) * rate)
+		if tokens >= 1:
+			_buckets[key] = (tokens - 1, now)
+			if len(_buckets) > MAX_MEMORY_BUCKETS:
+				_sweep(now, rate, burst)
+			return 0.0
+		_buckets[key] = (tokens, now)
+		return (1 - tokens) / rate
+
+
+def _sweep(now: float, rate: float, burst: float) -> None:
+	# a bucket that has refilled completely is the same as no bucket
+	refill_seconds = burst / rate
+	for key in [key for key, (_, updated) in _buckets.items() if now - updated > refill_seconds]:
+		del _buckets[key]
+
+
+def _connect_sqlite() -> sqlite3.Connection:
+	conn = storage.connect(RATE_LIMIT_DB, timeout=1.0)
+	if RATE_LIMIT_DB not in _sqlite_ready:
+		conn.execute("PRAGMA journal_mode = WAL;")
+		conn.execute("""
+			CREATE TABLE IF NOT EXISTS rate_buckets (
+				bucket_key TEXT PRIMARY KEY,
+				tokens REAL NOT NULL,
+				updated REAL NOT NULL
+			) WITHOUT ROWID;
+			""")
+		_sqlite_ready.add(RATE_LIMIT_DB)
+	return conn
+
+
+def _take_sqlite(key: str, rate: float, burst: float, now: float) -> float:
+	"""Take a token from the shared bucket key; 0 if taken, else seconds until one is."""
+	conn = _connect_sqlite()
+	try:
+		# refill and take in one statement, so concurrent workers cannot both take the last token
+		taken = conn.execute("""
+			INSERT INTO rate_buckets (bucket_key, tokens, updated) VALUES (:key, :burst - 1, :now)
+			ON CONFLICT (bucket_key) DO UPDATE SET
+				tokens = min(:burst, tokens + (:now - updated) * :rate) - 1,
+				updated = :now
+			WHERE min(:burst, tokens + (:now - updated) * :rate) >= 1
+			RETURNING tokens;
+			""", {"key": key, "rate": rate, "burst": burst, "now": now}).fetchone()
+		if taken is not None:
+			conn.commit()
+			return 0.0
+		row = conn.execute("""
+			SELECT min(:burst, tokens + (:now - updated) * :rate) FROM rate_buckets WHERE bucket_key = :key;
+			""", {"key": key, "rate": rate, "burst": burst, "now": now}).fetchone()
+		conn.commit()
+		return (1 - row[0]) / rate if row else 0.0
+	finally:
+		conn.close()
+
+
+def take(key: str, rate: float, burst: float) -> float:
+	"""Take a token from bucket key; returns 0 if admitted, else seconds until a token is available."""
+	now = time.time()
+	if RATE_LIMIT_BACKEND == "sqlite":
+		try:
+			return _take_sqlite(key, rate, burst, now)
+		except sqlite3.OperationalError:
+			# a locked or unavailable limiter must not take the endpoint down with it
+			return _take_memory(key, rate, burst, now)
+	return _take_memory(key, rate, burst, now)
+
+
+def reset() -> None:
+	"""Forget all buckets, e.g. between tests."""
+	with _buckets_lock:
+		_buckets.clear()
+	_sqlite_ready.clear()  # an in-memory RATE_LIMIT_DB may have been dropped with its table
+	if RATE_LIMIT_BACKEND == "sqlite":
+		conn = _connect_sqlite()
+		try:
+			conn.execute("DELETE FROM rate_buckets;")
+			conn.commit()
+		finally:
+			conn.close()
+
+
+def _budget(name: str, rate: float, burst: float) -> tuple[float, float]:
+	override = os.getenv(f"RATE_LIMIT_{name.upper()}")
+	if override:
+		rate, burst = (float(value) for value in override.split("/"))
+	return rate, burst
+
+
+def _caller() -> Optional[str]:
+	if "Authorization" not in request.headers and IDENTITY_HEADER not in request.headers:
+		return None
+	payload = identity_from_request(request.headers)
+	return payload.get("sub") if payload else None
+
+
+def _client_ip() -> str:
+	# behind the gateway every request comes from its address; the client's is the hop it appended
+	if RATE_LIMIT_TRUST_FORWARDED_FOR and request.headers.get("X-Forwarded-For"):
+		return request.headers["X-Forwarded-For"].rsplit(",", 1)[-1].strip()
+	return request.remote_addr
+
+
+def _rejected(status_code: int, error: str, retry_after: float):
+	return (json.dumps({"status": 0, "error": error}), status_code,
+			{"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def rate_limited(name: str, rate: float, burst: float):
+	"""Decorate a Flask view with the `name` budget of rate requests/second and bursts of burst."""
+	rate, burst = _budget(name, rate, burst)
+
+	def decorator(view):
+		@functools.wraps(view)
+		def wrapper(*args, **kwargs):
+			if not RATE_LIMIT_ENABLED:
+				return view(*args, **kwargs)
+			# shed load first: a full server should not spend tokens or decode JWTs
+			if not _slots.acquire(blocking=False):
+				return _rejected(503, "Server is busy, retry shortly.", OVERLOAD_RETRY_AFTER_SECONDS)
+			try:
+				wait = take(f"{name}:ip:{_client_ip()}", rate * IP_BUDGET_FACTOR, burst * IP_BUDGET_FACTOR)
+				caller = _caller()
+				if not wait and caller is not None:
+					wait = take(f"{name}:user:{caller}", rate, burst)
+				if wait:
+					return _rejected(429, "Too many requests, retry shortly.", wait)
+				return view(*args, **kwargs)
+			finally:
+				_slots.release()
+		return wrapper
+	return decorator
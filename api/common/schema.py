@@ -0,0 +1,91 @@
+"""
+Database creation shared by the ridedemand microservices.
+
+A service creates its database on its first request, and on serverless
+platforms every cold start begins with an empty /tmp. Running the DDL script
+takes a transaction per statement. Copying the prebuilt template is a single
+file copy. The template is <schema>.template.db next to the schema's .sql
+file. `scripts/build_db_templates.py` rebuilds it and must be re-run after
+the .sql changes; tests/test_schema.py fails until it is. Without a template,
+or with DB_TEMPLATES=false, the .sql script is run as before.
+
+An in-memory database (see api/common/storage.py) cannot be swapped out
+like a file while connections hold it open. Its contents are overwritten
+with the SQLite backup API instead. A read-only location is a replica with
+a writer elsewhere, and is left as it is.
+"""
+import os
+import shutil
+import sqlite3
+
+from api.common import storage
+
+DB_TEMPLATES = os.getenv("DB_TEMPLATES", "true").lower() == "true"
+TEMPLATE_SUFFIX = ".template.db"
+
+
+def template_path(sql_file: str) -> str:
+	"""Where the prebuilt template for sql_file lives."""
+	return os.path.splitext(sql_file)[0] + TEMPLATE_SUFFIX
+
+
+def _run_script(conn: sqlite3.Connection, sql_file: str) -> None:
+	with open(sql_file, 'r') as sql_startup:
+		init_db = sql_startup.read()
+	conn.executescript(init_db)
+	conn.commit()
+
+
+def _install_in_memory(location: str, sql_file: str) -> None:
+	template = template_path(sql_file)
+	if DB_TEMPLATES and os.path.exists(template):
+		source = sqlite3.connect(template)
+	else:
+		source = sqlite3.connect(":memory:")
+		_run_script(source, sql_file)
+	target = storage.connect(location)
+	try:
+		source.backup(target)
+	finally:
+		target.close()
+		source.close()
+
+
+def install_schema(db_path: str, sql_file: str) -> None:
+	"""Replace the database at db_path (a storage location) with an empty one with the schema of sql_file."""
+	if storage.is_read_only(db_path):
+		return
+	if storage.is_memory(db_path):
+		_install_in_memory(db_path, sql_file)
+		return
+	template = template_path(sql_file)
+	if not DB_TEMPLATES or not os.path.exists(template):
+		conn = sqlite3.connect(db_path)
+		try:
+			_run_script(conn, sql_file)
+		finally:
+			conn.close()
+		return
+	# a journal left next to the old file would be replayed into the new one
+	for suffix in ("-journal", "-wal", "-shm"):
+		if os.path.exists(db_path + suffix):
+			os.remove(db_path + suffix)
+	staged = f"{db_path}.{os.getpid()}.tmp"
+	shutil.copyfile(template, staged)
+	os.replace(staged, db_path)
+
+
+def build_template(sql_file: str) -> str:
+	"""(Re)build the template for sql_file from the script and return its path."""
+	template = template_path(sql_file)
+	staged = template + ".tmp"
+	if os.path.exists(staged):
+		os.remove(staged)
+	conn = sqlite3.connect(staged)
+	try:
+		_run_script(conn, sql_file)
+		conn.execute("VACUUM;")
+	finally:
+		conn.close()
+	os.replace(staged, template)
+	return template
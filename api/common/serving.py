@@ -0,0 +1,52 @@
+"""
+Production serving helpers for the ridedemand microservices.
+
+`gunicorn.conf.py` runs a service under gunicorn with the app preloaded:
+
+- `migrate` runs once in the master before it forks the workers. It creates
+  the service's schema when its database has none. An existing database is
+  left as it is, so restarts and extra workers never drop data. The flask
+  development server, by contrast, recreates the database on the first
+  request of every process.
+- `warmup` runs in every worker after the fork. It loads the JWT key and
+  PyJWT's HMAC backend, opens a first database connection, and calls the
+  service's own `warmup()` (e.g. to build its Bloom filters), so the first
+  requests do not pay for it.
+"""
+import importlib
+from types import ModuleType
+
+from api.common import auth
+
+
+def load_service(name: str) -> ModuleType:
+	"""Import api/<name>/index.py."""
+	return importlib.import_module(f"api.{name}.index")
+
+
+def migrate(service: ModuleType) -> None:
+	"""Create the service's schema unless its database already has one."""
+	if not hasattr(service, "create_db"):
+		return  # e.g. the gateway, which has no database
+	service.db_flag = True  # connect without creating
+	conn = service.get_db()
+	try:
+		has_schema = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' LIMIT 1;").fetchone()
+	finally:
+		conn.close()
+	service.db_flag = has_schema is not None
+	if not service.db_flag:
+		service.create_db()
+
+
+def warmup(service: ModuleType) -> None:
+	"""Load what a worker would otherwise load lazily on its first requests."""
+	auth.decode_jwt(auth.generate_jwt("warmup"))
+	if hasattr(service, "get_db"):
+		conn = service.get_db()
+		try:
+			conn.execute("SELECT count(*) FROM sqlite_master;").fetchone()
+		finally:
+			conn.close()
+	if hasattr(service, "warmup"):
+		service.warmup()
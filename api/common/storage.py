@@ -0,0 +1,113 @@
+"""
+Where the ridedemand microservices keep their SQLite databases.
+
+A service names its database once, e.g. `db_name = location("user.db")`, and
+opens it with `connect(db_name)`. The location is a plain string chosen by
+the environment:
+
+- STORAGE_BACKEND=file (default): a file in STORAGE_DIR (default /tmp).
+- STORAGE_BACKEND=memory: a shared-cache in-memory database,
+  `file:<name>?mode=memory&cache=shared`, for ephemeral deployments and
+  tests. Every connection in the process sees the same data. SQLite drops
+  such a database when its last connection closes, so this module holds one
+  open until `remove()` or `reset()`. Nothing is written to disk. Shared
+  cache locks whole tables, so reading a table another connection is
+  writing fails with "database table is locked" instead of returning the
+  last committed rows.
+- STORAGE_READ_ONLY=true: file databases are opened with `mode=ro`, for
+  read-heavy workers serving a replica that another process writes. Their
+  schema is never created or replaced (see api/common/schema.py), and
+  writes fail with sqlite3.OperationalError.
+"""
+import os
+import sqlite3
+import threading
+from typing import Optional
+from urllib.parse import quote, unquote
+
+BACKENDS = ("file", "memory")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "file").lower()
+STORAGE_DIR = os.getenv("STORAGE_DIR", "/tmp")
+STORAGE_READ_ONLY = os.getenv("STORAGE_READ_ONLY", "false").lower() == "true"
+if STORAGE_BACKEND not in BACKENDS:
+	raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(BACKENDS)}, not {STORAGE_BACKEND!r}")
+
+_anchors = {}  # memory location -> connection that keeps the database alive
+_anchors_lock = threading.Lock()
+
+
+def memory_location(name: str) -> str:
+	"""Location of the shared in-memory database called name."""
+	return f"file:{quote(name)}?mode=memory&cache=shared"
+
+
+def location(filename: str, read_only: Optional[bool] = None) -> str:
+	"""Location of the database filename (e.g. "user.db") under the configured backend."""
+	if STORAGE_BACKEND == "memory":
+		return memory_location(os.path.splitext(filename)[0])
+	path = os.path.join(STORAGE_DIR, filename)
+	if STORAGE_READ_ONLY if read_only is None else read_only:
+		return f"file:{quote(path)}?mode=ro"
+	return path
+
+
+def _query(location: str) -> str:
+	return location.partition("?")[2] if location.startswith("file:") else ""
+
+
+def _path(location: str) -> str:
+	return unquote(location.partition("?")[0].removeprefix("file:")) if location.startswith("file:") else location
+
+
+def is_memory(location: str) -> bool:
+	return "mode=memory" in _query(location).split("&")
+
+
+def is_read_only(location: str) -> bool:
+	return "mode=ro" in _query(location).split("&")
+
+
+def variant(location: str, tag: str) -> str:
+	"""A sibling database of location, e.g. variant("/tmp/payments.db", "1") -> "/tmp/payments.1.db"."""
+	path, separator, query = location.partition("?")
+	root, ext = os.path.splitext(path)
+	return f"{root}.{tag}{ext}{separator}{query}"
+
+
+def connect(location: str, **kwargs) -> sqlite3.Connection:
+	"""Open location; keyword arguments are passed on to sqlite3.connect."""
+	if is_memory(location):
+		with _anchors_lock:
+			if location not in _anchors:
+				_anchors[location] = sqlite3.connect(location, uri=True, check_same_thread=False)
+	# a plain path is still a plain path with uri=True; ATTACH then accepts locations too
+	return sqlite3.connect(location, uri=True, **kwargs)
+
+
+def exists(location: str) -> bool:
+	"""Whether the database at location has been created."""
+	if is_memory(location):
+		return location in _anchors
+	return os.path.exists(_path(location))
+
+
+def remove(location: str) -> None:
+	"""Delete the database at location. Read-only replicas belong to their writer and are left alone."""
+	if is_read_only(location):
+		return
+	if is_memory(location):
+		with _anchors_lock:
+			anchor = _anchors.pop(location, None)
+		if anchor is not None:
+			anchor.close()
+	elif os.path.exists(_path(location)):
+		os.remove(_path(location))
+
+
+def reset() -> None:
+	"""Drop every in-memory database this process holds, e.g. between tests."""
+	with _anchors_lock:
+		anchors = list(_anchors.values())
+		_anchors.clear()
+	for anchor in anchors:
+		anchor.close()
@@ -0,0 +1,157 @@
+"""
+API gateway in front of the four ridedemand services.
+
+Requests are routed by path prefix, the way vercel.json rewrites them. The
+gateway verifies a request's JWT once and passes the caller downstream in a
+signed X-Identity header (see api/common/auth.py), so services do not decode
+the token again. Identity headers sent by clients are dropped. Routes only
+services call each other on (INTERNAL_ROUTES) are not reachable through the
+gateway. The path is normalized before either check, and paths that could be
+read differently upstream (dot segments, an encoded `?` or `#`, backslashes)
+are refused. Upstream connections are kept alive in a pooled requests.Session per
+process, and responses are streamed back as they arrive.
+"""
+import json
+import logging
+import os
+import posixpath
+import threading
+from typing import Optional
+from urllib.parse import quote
+
+import requests
+from flask import Flask, Response, request
+from requests.adapters import HTTPAdapter
+
+from api.common.auth import IDENTITY_HEADER, decode_jwt, extract_token_from_header, sign_identity
+from api.common.clients import get_service_base_url
+
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+# path prefix -> env var holding the service's URL
+ROUTES = {
+	"/api/users/": "USERS_SERVICE_URL",
+	"/api/availability/": "AVAILABILITY_SERVICE_URL",
+	"/api/reservations/": "RESERVATIONS_SERVICE_URL",
+	"/api/payments/": "PAYMENTS_SERVICE_URL",
+}
+
+# called by services on each other (or by operators), never by the frontend
+INTERNAL_ROUTES = frozenset({
+	"/api/users/clear",
+	"/api/users/get_average_rating",
+	"/api/users/get_average_ratings",
+	"/api/users/get_driver_status",
+	"/api/users/backup",
+	"/api/users/restore",
+	"/api/availability/clear",
+	"/api/availability/backup",
+	"/api/availability/restore",
+	"/api/availability/get_driver_price",
+	"/api/availability/remove_availability",
+	"/api/reservations/clear",
+	"/api/reservations/backup",
+	"/api/reservations/restore",
+	"/api/reservations/check_reservation",
+	"/api/payments/clear",
+	"/api/payments/backup",
+	"/api/payments/restore",
+	"/api/payments/init_balance",
+	"/api/payments/transfer",
+	"/api/payments/snapshot",
+})
+
+# not forwarded in either direction; requests recomputes Host and Content-Length
+HOP_BY_HOP_HEADERS = frozenset({
+	"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+	"trailer", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+})
+
+GATEWAY_TIMEOUT_SECONDS = float(os.getenv("GATEWAY_TIMEOUT_SECONDS", "30"))
+GATEWAY_POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", "32"))
+STREAM_CHUNK_BYTES = 64 * 1024
+
+_session: Optional[requests.Session] = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+	"""Pooled session for upstream calls; created per process so forked workers get their own sockets."""
+	global _session, _session_pid
+	with _session_lock:
+		if _session is None or _session_pid != os.getpid():
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=len(ROUTES), pool_maxsize=GATEWAY_POOL_SIZE)
+			session.mount("http://", adapter)
+			session.mount("https://", adapter)
+			_session, _session_pid = session, os.getpid()
+		return _session
+
+
+def warmup() -> None:
+	"""Create the session before the first request instead of during it."""
+	get_session()
+
+
+def normalize_route(path: str) -> Optional[str]:
+	"""The canonical /api/... route for a decoded request path, or None if upstream could read it differently."""
+	if any(char in path for char in "?#\\"):
+		return None
+	if any(segment in (".", "..") for segment in path.split("/")):
+		return None
+	return posixpath.normpath(f"/api/{path}")
+
+
+def _upstream_headers() -> dict:
+	headers = {name: value for name, value in request.headers.items()
+			   if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != IDENTITY_HEADER.lower()}
+	forwarded_for = request.headers.get("X-Forwarded-For")
+	headers["X-Forwarded-For"] = f"{forwarded_for}, {request.remote_addr}" if forwarded_for else request.remote_addr
+
+	token = extract_token_from_header(request.headers.get("Authorization"))
+	if token:
+		payload = decode_jwt(token)
+		if payload and "sub" in payload:
+			headers[IDENTITY_HEADER] = sign_identity(payload["sub"], int(payload["exp"]))
+	return headers
+
+
+@app.route('/api/<path:path>', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+def proxy(path):
+	route = normalize_route(path)
+	if route is None:
+		return json.dumps({"status": 0, "error": "Bad request."}), 400
+	env_var_name = next((env for prefix, env in ROUTES.items() if route.startswith(prefix)), None)
+	if env_var_name is None or route in INTERNAL_ROUTES:
+		return json.dumps({"status": 0, "error": "Not found."}), 404
+
+	try:
+		upstream = get_session().request(
+			request.method,
+			# quoted, so upstream sees exactly the route checked above
+			get_service_base_url(env_var_name) + quote(route, safe="/"),
+			params=request.query_string,
+			data=request.get_data(),
+			headers=_upstream_headers(),
+			stream=True,
+			allow_redirects=False,
+			timeout=GATEWAY_TIMEOUT_SECONDS,
+		)
+	except requests.RequestException:
+		logger.exception("Error in proxy to %s", env_var_name)
+		return json.dumps({"status": 0, "error": "Service unavailable."}), 502
+
+	headers = [(name, value) for name, value in upstream.raw.headers.items()
+			   if name.lower() not in HOP_BY_HOP_HEADERS]
+
+	def body():
+		try:
+			# raw bytes, so a compressed body keeps matching its Content-Encoding
+			yield from upstream.raw.stream(STREAM_CHUNK_BYTES, decode_content=False)
+		finally:
+			upstream.close()
+
+	return Response(body(), status=upstream.status_code, headers=headers)
@@ -3,50 +3,106 @@ Payments and wallet microservice for the ridedemand project.
 
 This service tracks user balances in cents, supports deposits, and performs
 internal transfers between riders and drivers when a reservation is made.
+
+Money movements are appended to a double-entry `ledger` and never updated in
+place. A balance is the account's latest `balance_snapshots` row plus the
+postings made since, which the ledger_by_user index sums directly. A
+background thread rolls the snapshots forward every SNAPSHOT_EVERY_POSTINGS
+postings, reading only the postings made since its last run.
+
+Writes go through a group-commit writer: concurrent deposits and transfers
+are applied in small batches, one transaction and one sync per batch.
+
+Accounts are spread over PAYMENTS_SHARDS SQLite files by a stable hash of
+the username, each with its own writer, so write throughput grows with the
+shard count. A transfer between shards runs as one transaction over both
+files with ATTACH. scripts/reshard_payments.py changes the shard count
+offline.
 """
 
 import json
 import os
+import queue
+import secrets
 import sqlite3
+import threading
+import zlib
 
-import requests
-from flask import Flask, request
+from flask import Flask, Response, request
 
-from api.common.auth import decode_jwt, extract_token_from_header
+from api.common import storage
+from api.common.auth import identity_from_request
+from api.common.backup import backup_endpoint, restore_endpoint
+from api.common.group_commit import GroupCommitWriter
+from api.common.idempotency import IDEMPOTENCY_HEADER, Transient, run_idempotent
+from api.common.schema import install_schema
 
 app = Flask(__name__)
-db_name = "/tmp/payments.db"
+db_name = storage.location("payments.db")
 sql_file = "api/payments/payments.sql"
 db_flag = False
+# the demo account's wallet is created with the database only when asked for
+SEED_DEMO_DATA = os.getenv("SEED_DEMO_DATA", "false").lower() == "true"
+
+# contra account that deposits are drawn from, created by payments.sql
+EXTERNAL_ACCOUNT = "__external__"
+# roll balance snapshots forward every this many postings
+SNAPSHOT_EVERY_POSTINGS = int(os.getenv("PAYMENTS_SNAPSHOT_EVERY_POSTINGS", "10000"))
+# rows fetched from SQLite per chunk of a streamed statement
+STATEMENT_FETCH_ROWS = 500
+# number of database files accounts are hashed over; with more than one,
+# shard i lives next to db_name as payments.<i>.db
+PAYMENTS_SHARDS = int(os.getenv("PAYMENTS_SHARDS", "1"))
+# writes committed together, and how long the writer waits to fill a batch;
+# PAYMENTS_BATCH_MAX=1 commits each write inline in the request thread
+PAYMENTS_BATCH_MAX = int(os.getenv("PAYMENTS_BATCH_MAX", "64"))
+PAYMENTS_BATCH_WINDOW_MS = float(os.getenv("PAYMENTS_BATCH_WINDOW_MS", "2"))
+_writers = [
+	GroupCommitWriter(lambda shard=shard: get_db(shard), PAYMENTS_BATCH_MAX, PAYMENTS_BATCH_WINDOW_MS / 1000)
+	for shard in range(PAYMENTS_SHARDS)
+]
+# shards waiting for the snapshot thread, which is started on first use in each process
+_snapshot_queue = None
+_snapshot_pid = None
+_snapshot_pending = set()
+_snapshot_lock = threading.Lock()
+
+
+def shard_for(username):
+	"""Shard holding username's account; crc32 is stable across processes and releases."""
+	return zlib.crc32(username.encode("utf-8")) % PAYMENTS_SHARDS
+
+
+def shard_path(shard):
+	"""Storage location of a shard."""
+	if PAYMENTS_SHARDS == 1:
+		return db_name
+	return storage.variant(db_name, str(shard))
+
+
+def shard_paths():
+	"""Storage locations of all shards."""
+	return [shard_path(shard) for shard in range(PAYMENTS_SHARDS)]
 
 
 def create_db():
-	"""Create the SQLite database from the SQL schema file if it does not exist."""
-	conn = None
+	"""Create the SQLite databases from the schema template, or the SQL schema file."""
 	try:
-		conn = sqlite3.connect(db_name)
-		with open(sql_file, 'r') as sql_startup:
-			init_db = sql_startup.read()
-		cursor = conn.cursor()
-		cursor.executescript(init_db)
-		conn.commit()
+		for shard in range(PAYMENTS_SHARDS):
+			install_schema(shard_path(shard), sql_file)
 		global db_flag
 		db_flag = True
-		create_demo_user_balance()
-		return conn
+		if SEED_DEMO_DATA:
+			create_demo_user_balance()
 	except Exception as e:
 		print("Error in create_db:", e)
-		return
-	finally:
-		if conn is not None:
-			conn.close()
 
 
-def get_db():
-	"""Return a SQLite connection, creating the database on first use."""
+def get_db(shard=0):
+	"""Return a SQLite connection to a shard, creating the databases on first use."""
 	if not db_flag:
 		create_db()
-	conn = sqlite3.connect(db_name)
+	conn = storage.connect(shard_path(shard))
 	curr = conn.cursor()
 	curr.execute("PRAGMA foreign_keys = ON;")
 	return conn
@@ -66,29 +122,197 @@ def clear() -> tuple[str, int]:
 	if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
 		return "Forbidden", 403
 
-	if os.path.exists(db_name):
-		os.remove(db_name)
+	for shard in range(PAYMENTS_SHARDS):
+		storage.remove(shard_path(shard))
 	create_db()
-	create_demo_user_balance()
 	print("Database has been cleared and recreated")
 	return "The database has been cleared", 200
 
 
+@app.route('/api/payments/backup', methods=['POST'])
+def backup() -> tuple[str, int]:
+	"""
+	Copy the payments databases into a backup set without stopping traffic. Admin only.
+
+	Pass a valid X-Admin-Token header, and the set's `marker` as a form field
+	(a new one is made up without it). See api/common/backup.py.
+	"""
+	return backup_endpoint("payments", shard_paths())
+
+
+@app.route('/api/payments/restore', methods=['POST'])
+def restore() -> tuple[str, int]:
+	"""
+	Overwrite the payments databases with the copy in the backup set `marker`. Admin only.
+
+	Pass a valid X-Admin-Token header.
+	"""
+	return restore_endpoint("payments", shard_paths(), _restored)
+
+
+def _restored() -> None:
+	global db_flag
+	db_flag = True
+
+
+def _post(curr, kind, payer, payee, amount_cents, payer_db="main", payee_db="main"):
+	"""
+	Append one transaction to the ledger and return the payer's posting_id.
+
+	Both postings go into the caller's transaction; payer_db and payee_db
+	name the attached shard each account lives in. The foreign keys reject
+	an unknown payer or payee with an IntegrityError.
+	"""
+	# random rather than sequential so ids stay unique across shards and resharding
+	txn_id = secrets.randbits(62)
+	curr.execute(f"""
+		INSERT INTO {payer_db}.ledger (txn_id, username, counterparty, amount, kind)
+		VALUES (?,?,?,?,?);
+		""", (txn_id, payer, payee, -amount_cents, kind))
+	posting_id = curr.lastrowid
+	curr.execute(f"""
+		INSERT INTO {payee_db}.ledger (txn_id, username, counterparty, amount, kind)
+		VALUES (?,?,?,?,?);
+		""", (txn_id, payee, payer, amount_cents, kind))
+	return posting_id
+
+
+def _balance(curr, username, db="main"):
+	"""Balance in cents as snapshot plus later postings, or None for an unknown account."""
+	curr.execute(f"""
+		SELECT coalesce(snapshot.balance, 0) + coalesce((
+			SELECT sum(amount) FROM {db}.ledger AS ledger
+			WHERE ledger.username = accounts.username
+				AND ledger.posting_id > coalesce(snapshot.posting_id, 0)
+		), 0)
+		FROM {db}.accounts AS accounts LEFT JOIN {db}.balance_snapshots AS snapshot USING (username)
+		WHERE accounts.username = ?;
+		""", (username,))
+	result = curr.fetchone()
+	return result[0] if result else None
+
+
+def take_snapshots(conn):
+	"""
+	Roll snapshots forward to the latest posting; returns accounts updated.
+
+	Only postings after the newest snapshot are read, by posting_id range, so
+	the work grows with the postings made since the last run, not the ledger.
+	"""
+	curr = conn.cursor()
+	curr.execute("BEGIN IMMEDIATE;")
+	# every run covers the ledger up to its last posting, which is the newest snapshot's
+	since = curr.execute("SELECT coalesce(max(posting_id), 0) FROM balance_snapshots;").fetchone()[0]
+	curr.execute("""
+		INSERT INTO balance_snapshots (username, balance, posting_id)
+		SELECT recent.username, coalesce(snapshot.balance, 0) + recent.amount, recent.posting_id
+		FROM (
+			SELECT username, sum(amount) AS amount, max(posting_id) AS posting_id
+			FROM ledger WHERE posting_id > ? GROUP BY username
+		) AS recent LEFT JOIN balance_snapshots AS snapshot USING (username)
+		WHERE true
+		ON CONFLICT (username) DO UPDATE
+			SET balance = excluded.balance, posting_id = excluded.posting_id;
+		""", (since,))
+	updated = curr.rowcount
+	conn.commit()
+	return updated
+
+
+def _snapshot_shard(shard):
+	try:
+		conn = get_db(shard)
+		take_snapshots(conn)
+		conn.close()
+	except Exception as e:
+		print("Error in take_snapshots:", e)
+		try:
+			conn.close()
+		except:
+			pass
+
+
+def _run_snapshots(pending):
+	while True:
+		shard = pending.get()
+		with _snapshot_lock:
+			_snapshot_pending.discard(shard)
+		try:
+			_snapshot_shard(shard)
+		finally:
+			pending.task_done()
+
+
+def _after_commit(shard, posting_id):
+	"""Queue a shard's snapshots when its postings crossed a SNAPSHOT_EVERY_POSTINGS boundary."""
+	global _snapshot_queue, _snapshot_pid
+	# a transaction adds at most two postings per shard, posting_id and the next
+	if posting_id is None or (posting_id + 1) // SNAPSHOT_EVERY_POSTINGS == (posting_id - 1) // SNAPSHOT_EVERY_POSTINGS:
+		return
+	with _snapshot_lock:
+		if _snapshot_pid != os.getpid():
+			_snapshot_queue = queue.Queue()
+			_snapshot_pid = os.getpid()
+			_snapshot_pending.clear()
+			threading.Thread(target=_run_snapshots, args=(_snapshot_queue,),
+							 name="payments-snapshots", daemon=True).start()
+		if shard in _snapshot_pending:
+			return  # already queued; that run will cover this posting too
+		_snapshot_pending.add(shard)
+		_snapshot_queue.put(shard)
+
+
+def wait_for_snapshots():
+	"""Block until the snapshots queued in this process have been taken."""
+	with _snapshot_lock:
+		pending = _snapshot_queue if _snapshot_pid == os.getpid() else None
+	if pending is not None:
+		pending.join()
+
+
+def _transfer_across_shards(rider_username, driver_username, price_cents):
+	"""
+	Move funds between accounts on two shards in one transaction.
+
+	The lower numbered shard is opened and the other attached, and BEGIN
+	IMMEDIATE locks both in that order, so concurrent cross-shard transfers
+	cannot deadlock. Returns the rider's posting_id, or None if short of funds.
+	"""
+	rider_shard, driver_shard = shard_for(rider_username), shard_for(driver_username)
+	conn = get_db(min(rider_shard, driver_shard))
+	try:
+		curr = conn.cursor()
+		curr.execute("ATTACH DATABASE ? AS peer;", (shard_path(max(rider_shard, driver_shard)),))
+		rider_db, driver_db = ("main", "peer") if rider_shard < driver_shard else ("peer", "main")
+		curr.execute("BEGIN IMMEDIATE;")
+		try:
+			rider_balance = _balance(curr, rider_username, rider_db)
+			if rider_balance is None or rider_balance < price_cents:
+				conn.rollback()
+				return None
+			posting_id = _post(curr, "transfer", rider_username, driver_username, price_cents,
+							   rider_db, driver_db)
+			conn.commit()
+			return posting_id
+		except Exception:
+			conn.rollback()
+			raise
+	finally:
+		conn.close()
+
+
 def create_demo_user_balance():
 	"""Create a balance for the demo user."""
 	try:
-		conn = get_db()
+		conn = get_db(shard_for("demo"))
 		curr = conn.cursor()
 
 		# make sure user doesn't already exist
 		curr.execute("""
-			SELECT username FROM balances WHERE username = ?;
-			""","demo",))
-		result = curr.fetchone()
-		if not result:
-			curr.execute("""
-				INSERT INTO balances VALUES(?,?);
-				""","demo", 10000))
+			INSERT OR IGNORE INTO accounts (username) VALUES (?);
+			""",("demo",))
+		if curr.rowcount == 1:
+			_post(curr, "deposit", EXTERNAL_ACCOUNT, "demo", 10000)
 
 		conn.commit()
 		conn.close()
@@ -106,35 +330,23 @@ def init_balance():
 	username = request.form.get("username")
 	amount_cents_str = request.form.get("amount_cents")
 
-	try:
-		conn = get_db()
-		curr = conn.cursor()
-		amount_cents = int(amount_cents_str)
-
-		# make sure user doesn't already exist
+	def open_account(curr):
+		# the primary key makes sure the user doesn't already exist
 		curr.execute("""
-			SELECT username FROM balances WHERE username = ?;
+			INSERT INTO accounts (username) VALUES (?);
 			""",(username,))
-		result = curr.fetchone()
-		if result:  # username in database so fail
-			conn.close()
-			return json.dumps({"status": 2})
-
-		curr.execute("""
-			INSERT INTO balances VALUES(?,?);
-			""",(username, amount_cents))
+		if amount_cents:
+			return _post(curr, "deposit", EXTERNAL_ACCOUNT, username, amount_cents)
 
-		conn.commit()
-		conn.close()
+	try:
+		amount_cents = int(amount_cents_str)
+		shard = shard_for(username)
+		posting_id = _writers[shard].submit(open_account)
+		_after_commit(shard, posting_id)
 		return json.dumps({"status": 1})
 
 	except Exception as e:
 		print("Error in init_balance:", e)
-		try:
-			conn.close()
-		except:
-			pass
-
 		return json.dumps({"status": 2})
 
 
@@ -142,68 +354,54 @@ def init_balance():
 def add():
 	"""Add money to the authenticated user's account if they already exist."""
 	amount_str = request.form.get("amount")
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
 
-	payload = decode_jwt(token)
+	payload = identity_from_request(request.headers)
 	if not payload or "sub" not in payload:
 		return json.dumps({"status": 2})
 	username = payload["sub"]
+	shard = shard_for(username)
 
-	try:
-		conn = get_db()
-		curr = conn.cursor()
-		amount_cents = int(float(amount_str) * 100)
-
-		curr.execute("""
-			SELECT balance FROM balances WHERE username = ?;
-			""",(username,))
-		result = curr.fetchone()
-		if not result:  # username not in database so fail
-			conn.close()
-			return json.dumps({"status": 2})
-		new_balance = result[0] + amount_cents
-		curr.execute("""
-			UPDATE balances SET balance = ? WHERE username = ?;
-			""",(new_balance, username))
+	def deposit():
+		try:
+			amount_cents = int(float(amount_str) * 100)
 
-		conn.commit()
-		conn.close()
-		return json.dumps({"status": 1})
+			# a pure insert: the foreign key fails if username not in database
+			posting_id = _writers[shard].submit(
+				lambda curr: _post(curr, "deposit", EXTERNAL_ACCOUNT, username, amount_cents))
+			_after_commit(shard, posting_id)
+			return json.dumps({"status": 1})
 
-	except Exception as e:
-		print("Error in add:", e)
-		try:
-			conn.close()
-		except:
-			pass
+		except (TypeError, ValueError, sqlite3.IntegrityError):
+			# a bad amount or no such account: a retry fails the same way
+			return json.dumps({"status": 2})
+		except Exception as e:
+			print("Error in add:", e)
+			return Transient(json.dumps({"status": 2}))
 
-		return json.dumps({"status": 2})
+	# a retried deposit with the same Idempotency-Key is only credited once
+	return run_idempotent(
+		lambda: get_db(shard), f"add:{username}", request.headers.get(IDEMPOTENCY_HEADER),
+		{"amount": amount_str}, deposit)
 
 
 @app.route('/api/payments/view', methods=['GET'])
 def view():
 	"""Return the authenticated user's current balance in dollars."""
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
 
-	payload = decode_jwt(token)
+	payload = identity_from_request(request.headers)
 	if not payload or "sub" not in payload:
 		return json.dumps({"status": 2, "balance": "NULL"})
 	username = payload["sub"]
 
 	try:
-		conn = get_db()
+		conn = get_db(shard_for(username))
 		curr = conn.cursor()
 
-		curr.execute("""
-			SELECT balance FROM balances WHERE username = ?;
-			""",(username,))
-		result = curr.fetchone()
+		result = _balance(curr, username)
 		conn.close()
-		if not result:  # username not in database so fail
+		if result is None:  # username not in database so fail
 			return json.dumps({"status": 2, "balance": "NULL"})
-		balance = result[0] / 100
+		balance = result / 100
 		return json.dumps({"status": 1, "balance": f"{balance:.2f}"})
 
 	except Exception as e:
@@ -215,62 +413,127 @@ def view():
 		return json.dumps({"status": 2, "balance": "NULL"})
 
 
-@app.route('/api/payments/transfer', methods=['POST'])
-def transfer():
+@app.route('/api/payments/statement', methods=['GET'])
+def statement():
 	"""
-	Internal endpoint: transfer funds from rider to driver if rider has enough.
+	Stream the authenticated user's postings, oldest first, as NDJSON.
 
-	Form fields:
-	- price_cents: integer price of the ride
-	- rider_username
-	- driver_username
+	Pass after=<posting_id> (the last one already seen) to resume. Each line
+	is one posting with a signed amount in dollars and the counterparty.
+	Errors are a single JSON object with status 2, like the other endpoints.
 	"""
-	price_cents = int(request.form.get("price_cents"))
-	rider_username = request.form.get("rider_username")
-	driver_username = request.form.get("driver_username")
 
+	payload = identity_from_request(request.headers)
+	if not payload or "sub" not in payload:
+		return json.dumps({"status": 2, "error": "Not logged in."})
+	username = payload["sub"]
 	try:
-		conn = get_db()
-		curr = conn.cursor()
+		after = int(request.args.get("after", 0))
+	except ValueError:
+		return json.dumps({"status": 2, "error": "after must be a posting_id."})
 
-		# check that rider has enough funds
-		curr.execute("""
-			SELECT balance FROM balances WHERE username = ?;
-			""",(rider_username,))
-		rider_result = curr.fetchone()
-		if not rider_result or rider_result[0] < price_cents:
+	def postings():
+		conn = get_db(shard_for(username))
+		try:
+			curr = conn.cursor()
+			curr.execute("""
+				SELECT posting_id, txn_id, kind, amount, counterparty, created_at FROM ledger
+				WHERE username = ? AND posting_id > ?
+				ORDER BY posting_id;
+				""", (username, after))
+			while True:
+				rows = curr.fetchmany(STATEMENT_FETCH_ROWS)
+				if not rows:
+					break
+				yield "".join(json.dumps({
+					"posting_id": posting_id,
+					"txn_id": txn_id,
+					"kind": kind,
+					"amount": f"{amount / 100:.2f}",
+					"counterparty": counterparty,
+					"created_at": created_at,
+				}) + "\n" for posting_id, txn_id, kind, amount, counterparty, created_at in rows)
+		finally:
 			conn.close()
-			return json.dumps({"status": 2})
 
-		# get drivers balance
-		curr.execute("""
-					SELECT balance FROM balances WHERE username = ?;
-					""", (driver_username,))
-		driver_result = curr.fetchone()
-		if not driver_result:
-			conn.close()
-			return json.dumps({"status": 2})
+	return Response(postings(), mimetype="application/x-ndjson")
 
-		# subtract funds from rider
-		new_balance = rider_result[0] - price_cents
-		curr.execute("""
-			UPDATE balances SET balance = ? WHERE username = ?;
-			""",(new_balance, rider_username))
 
-		# add funds to driver
-		new_balance = driver_result[0] + price_cents
-		curr.execute("""
-				UPDATE balances SET balance = ? WHERE username = ?;
-				""", (new_balance, driver_username))
+@app.route('/api/payments/snapshot', methods=['POST'])
+def snapshot():
+	"""
+	Roll all balance snapshots forward now. Admin only.
 
-		conn.commit()
-		conn.close()
-		return json.dumps({"status": 1})
+	Snapshots are also taken every PAYMENTS_SNAPSHOT_EVERY_POSTINGS postings;
+	this is for maintenance windows and reconciliation. Pass a valid
+	X-Admin-Token header.
+	"""
+	admin_token = os.getenv("ADMIN_TOKEN")
+	if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
+		return "Forbidden", 403
+
+	try:
+		updated = 0
+		for shard in range(PAYMENTS_SHARDS):
+			conn = get_db(shard)
+			updated += take_snapshots(conn)
+			conn.close()
+		return json.dumps({"status": 1, "accounts": updated})
 
 	except Exception as e:
-		print("Error in transfer:", e)
+		print("Error in snapshot:", e)
 		try:
 			conn.close()
 		except:
 			pass
 		return json.dumps({"status": 2})
+
+
+@app.route('/api/payments/transfer', methods=['POST'])
+def transfer():
+	"""
+	Internal endpoint: transfer funds from rider to driver if rider has enough.
+
+	Form fields:
+	- price_cents: integer price of the ride
+	- rider_username
+	- driver_username
+
+	reserve() sends an Idempotency-Key so a retried reservation pays once.
+	"""
+	price_cents = int(request.form.get("price_cents"))
+	rider_username = request.form.get("rider_username")
+	driver_username = request.form.get("driver_username")
+
+	def pay(curr):
+		# the writer's transaction locks out other writers between the
+		# funds check and the postings, so check that rider has enough funds
+		rider_balance = _balance(curr, rider_username)
+		if rider_balance is None or rider_balance < price_cents:
+			return None
+
+		# move funds from rider to driver; fails if the driver has no account
+		return _post(curr, "transfer", rider_username, driver_username, price_cents)
+
+	rider_shard = shard_for(rider_username)
+
+	def move_funds():
+		try:
+			if rider_shard == shard_for(driver_username):
+				posting_id = _writers[rider_shard].submit(pay)
+			else:
+				posting_id = _transfer_across_shards(rider_username, driver_username, price_cents)
+			if posting_id is None:
+				return json.dumps({"status": 2})
+			_after_commit(rider_shard, posting_id)
+			return json.dumps({"status": 1})
+
+		except sqlite3.IntegrityError:
+			return json.dumps({"status": 2})  # the driver has no account
+		except Exception as e:
+			print("Error in transfer:", e)
+			return Transient(json.dumps({"status": 2}))
+
+	return run_idempotent(
+		lambda: get_db(rider_shard), "transfer", request.headers.get(IDEMPOTENCY_HEADER),
+		request.form.to_dict(), move_funds)
@@ -1,6 +1,62 @@
+DROP TABLE IF EXISTS idempotency_keys;
+DROP TABLE IF EXISTS balance_snapshots;
+DROP TABLE IF EXISTS ledger;
+DROP TABLE IF EXISTS accounts;
 DROP TABLE IF EXISTS balances;
 
-CREATE TABLE balances (
+-- One row per wallet. Balances are never stored here; they are derived
+-- from the ledger.
+CREATE TABLE accounts (
     username TEXT PRIMARY KEY,
-    balance INTEGER NOT NULL -- cents
-);
\ No newline at end of file
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+);
+
+-- Contra account for money entering the system (deposits), so every
+-- transaction balances: sum(amount) over the whole ledger is always 0.
+-- Every shard has its own.
+INSERT INTO accounts (username) VALUES ('__external__');
+
+-- Append-only double-entry postings. A transaction is two postings with
+-- the same random txn_id: -amount on the payer, +amount on the payee. When
+-- the service is sharded each posting lives in its own account's shard, so
+-- the counterparty may be an account of another shard. Rows are never
+-- updated or deleted.
+CREATE TABLE ledger (
+    posting_id INTEGER PRIMARY KEY,
+    txn_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    counterparty TEXT NOT NULL,
+    amount INTEGER NOT NULL, -- cents, negative for debits
+    kind TEXT NOT NULL, -- 'deposit' or 'transfer'
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now')),
+    FOREIGN KEY (username) REFERENCES accounts(username)
+);
+
+-- Covers the balance delta sum and pages a user's statement in order.
+CREATE INDEX ledger_by_user ON ledger (username, posting_id, amount);
+
+-- Balance of each account as of posting_id, rolled forward periodically so
+-- a balance is the snapshot plus the few postings made since.
+CREATE TABLE balance_snapshots (
+    username TEXT PRIMARY KEY,
+    balance INTEGER NOT NULL, -- cents
+    posting_id INTEGER NOT NULL,
+    FOREIGN KEY (username) REFERENCES accounts(username)
+);
+
+-- The newest snapshot's posting_id is where the next roll-forward starts.
+CREATE INDEX balance_snapshots_by_posting ON balance_snapshots (posting_id);
+
+-- Responses of requests sent with an Idempotency-Key, replayed for retries
+-- (see api/common/idempotency.py). status_code is NULL while in flight.
+CREATE TABLE idempotency_keys (
+    scope TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL, -- hash of the request, a reused key must match
+    status_code INTEGER,
+    response TEXT,
+    expires_at REAL NOT NULL, -- unix time
+    PRIMARY KEY (scope, idempotency_key)
+) WITHOUT ROWID;
+
+CREATE INDEX idempotency_keys_by_expiry ON idempotency_keys (expires_at);
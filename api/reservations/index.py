@@ -2,45 +2,70 @@ import json
 import logging
 import os
 import sqlite3
+import threading
+import time
 from typing import Optional
 
-import requests
 from flask import Flask, request
 
-from api.common.auth import decode_jwt, extract_token_from_header
-from api.common.clients import get_service_base_url
+from api.common import storage
+from api.common.auth import identity_from_request
+from api.common.backup import backup_endpoint, restore_endpoint
+from api.common.bloom import BloomFilter
+from api.common.clients import DependencyUnavailable, dependency
+from api.common.idempotency import IDEMPOTENCY_HEADER, Transient, derive_key, run_idempotent
+from api.common.ratelimit import rate_limited
+from api.common.schema import install_schema
 
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-db_name = "/tmp/reservations.db"
+db_name = storage.location("reservations.db")
 sql_file = "api/reservations/reservations.sql"
 db_flag = False
 
+# page sizes for /history
+DEFAULT_HISTORY_LIMIT = 20
+MAX_HISTORY_LIMIT = 100
+
+# In-memory Bloom filter over reservation pair keys, so check_reservation can
+# answer most negatives without opening the database. Rows written by other
+# processes are picked up at most PAIR_FILTER_REFRESH_SECONDS later.
+PAIR_FILTER_REFRESH_SECONDS = float(os.getenv("PAIR_FILTER_REFRESH_SECONDS", "1.0"))
+PAIR_FILTER_MIN_CAPACITY = 10000
+_pair_filter: Optional[BloomFilter] = None
+_pair_filter_watermark = 0  # highest order_id added to the filter
+_pair_filter_refreshed = 0.0
+_pair_filter_lock = threading.RLock()  # reentrant: creating the db on a refresh resets the filter
+
 
 def create_db() -> None:
-	conn: Optional[sqlite3.Connection] = None
 	try:
-		conn = sqlite3.connect(db_name)
-
-		with open(sql_file, 'r') as sql_startup:
-			init_db = sql_startup.read()
-		cursor = conn.cursor()
-		cursor.executescript(init_db)
-		conn.commit()
+		install_schema(db_name, sql_file)
 		global db_flag
 		db_flag = True
+		reset_caches()
 	except Exception:
 		logger.exception("Error in create_db")
-	finally:
-		if conn is not None:
-			conn.close()
+
+
+def reset_caches() -> None:
+	"""Drop in-memory state derived from the database, e.g. after it was recreated."""
+	global _pair_filter
+	with _pair_filter_lock:
+		_pair_filter = None
+
+
+def warmup() -> None:
+	"""Build in-memory state before the first request instead of during it."""
+	with _pair_filter_lock:
+		_refresh_pair_filter()
 
 
 def get_db() -> sqlite3.Connection:
 	if not db_flag:
 		create_db()
-	conn = sqlite3.connect(db_name)
+	conn = storage.connect(db_name)
 	curr = conn.cursor()
 	curr.execute("PRAGMA foreign_keys = ON;")
 	return conn
@@ -60,15 +85,78 @@ def clear() -> tuple[str, int]:
 	if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
 		return "Forbidden", 403
 
-	if os.path.exists(db_name):
-		os.remove(db_name)
+	storage.remove(db_name)
 	create_db()
 	logger.info("Database has been cleared and recreated")
 	return "The database has been cleared", 200
+
+
+@app.route('/api/reservations/backup', methods=['POST'])
+def backup() -> tuple[str, int]:
+	"""
+	Copy the reservations database into a backup set without stopping traffic. Admin only.
+
+	Pass a valid X-Admin-Token header, and the set's `marker` as a form field
+	(a new one is made up without it). See api/common/backup.py.
+	"""
+	return backup_endpoint("reservations", [db_name])
+
+
+@app.route('/api/reservations/restore', methods=['POST'])
+def restore() -> tuple[str, int]:
+	"""
+	Overwrite the reservations database with the copy in the backup set `marker`. Admin only.
+
+	Pass a valid X-Admin-Token header.
+	"""
+	return restore_endpoint("reservations", [db_name], _restored)
+
+
+def _restored() -> None:
+	global db_flag
+	db_flag = True
+	reset_caches()
 #
 # ALL OF THE ABOVE IS PRETTY MUCH THE SAME FOR EVERY MICRO SERVICE
 
 
+def _pair_key(username1: str, username2: str) -> str:
+	"""Python twin of the reservations.pair_key generated column."""
+	return "\x1f".join(sorted((username1, username2)))
+
+
+def _refresh_pair_filter() -> None:
+	"""Load the pair filter, or add the rows written since the last refresh."""
+	global _pair_filter, _pair_filter_watermark, _pair_filter_refreshed
+	conn = get_db()
+	try:
+		curr = conn.cursor()
+		if _pair_filter is None or _pair_filter.is_overfull():
+			curr.execute("SELECT count(*) FROM reservations;")
+			capacity = max(PAIR_FILTER_MIN_CAPACITY, 2 * curr.fetchone()[0])
+			_pair_filter = BloomFilter(capacity)
+			_pair_filter_watermark = 0
+		curr.execute("""
+			SELECT order_id, pair_key FROM reservations WHERE order_id > ?
+			ORDER BY order_id;
+			""", (_pair_filter_watermark,))
+		for order_id, pair_key in curr:
+			_pair_filter.add(pair_key)
+			_pair_filter_watermark = order_id
+		_pair_filter_refreshed = time.monotonic()
+	finally:
+		conn.close()
+
+
+def _pair_maybe_reserved(key: str) -> bool:
+	"""False when the Bloom filter proves the pair has no reservation."""
+	with _pair_filter_lock:
+		stale = time.monotonic() - _pair_filter_refreshed >= PAIR_FILTER_REFRESH_SECONDS
+		if _pair_filter is None or (stale and key not in _pair_filter):
+			_refresh_pair_filter()
+		return key in _pair_filter
+
+
 @app.route('/api/reservations/check_reservation', methods=['GET'])
 def check_reservation():
 	"""
@@ -77,16 +165,21 @@ def check_reservation():
 	"""
 	username1 = request.args.get("username1")
 	username2 = request.args.get("username2")
+	if not username1 or not username2:
+		return json.dumps({"status": 0})
 
+	conn = None
 	try:
+		key = _pair_key(username1, username2)
+		if not _pair_maybe_reserved(key):
+			return json.dumps({"status": 0})
+
 		conn = get_db()
 		curr = conn.cursor()
 
 		curr.execute("""
-			SELECT * FROM reservations 
-			WHERE (driver_username = ? AND rider_username = ?)
-			OR (driver_username = ? AND rider_username = ?);
-			""",(username1, username2, username2, username1))
+			SELECT 1 FROM reservations WHERE pair_key = ? LIMIT 1;
+			""", (key,))
 		result = curr.fetchone()
 		status = 1 if result else 0
 		conn.close()
@@ -103,55 +196,73 @@ def check_reservation():
 
 
 @app.route('/api/reservations/reserve', methods=['POST'])
+@rate_limited("reserve", rate=1, burst=5)
 def reserve():
 	""""""
 	listingid = request.form.get("listingid")
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
 
-	payload = decode_jwt(token)
+	payload = identity_from_request(request.headers)
 	if not payload or "sub" not in payload:
 		return json.dumps({"status": 2})
 	rider_username = payload["sub"]
 
+	# a retried request with the same Idempotency-Key replays the first outcome
+	idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+	return run_idempotent(
+		get_db, f"reserve:{rider_username}", idempotency_key, {"listingid": listingid},
+		lambda: _reserve(listingid, rider_username, idempotency_key))
+
+
+def _reserve(listingid, rider_username, idempotency_key=None):
+	"""Book listingid for rider_username: pay the driver, claim the listing and record it."""
 	try:
-		users_service_url = get_service_base_url("USERS_SERVICE_URL", default=request.host_url)
-		availability_service_url = get_service_base_url("AVAILABILITY_SERVICE_URL", default=request.host_url)
-		payments_service_url = get_service_base_url("PAYMENTS_SERVICE_URL", default=request.host_url)
+		users = dependency("USERS_SERVICE_URL")
+		availability = dependency("AVAILABILITY_SERVICE_URL")
+		payments = dependency("PAYMENTS_SERVICE_URL")
 
 		# check that the user is a rider
-		rider_result = requests.get(
-			f"{users_service_url}/api/users/get_driver_status",
-			params={"username": rider_username}
-		).json()
+		rider_result = users.get(
+			"/api/users/get_driver_status",
+			params={"username": rider_username},
+			default=request.host_url
+		)
 		if rider_result.get("driver") != 0:
 			return json.dumps({"status": 3})
 
 		# check availability and get driver_username, price, date, and time
-		availability_payload = requests.get(
-			f"{availability_service_url}/api/availability/get_driver_price",
-			params={"listingid": listingid}
-		).json()
+		availability_payload = availability.get(
+			"/api/availability/get_driver_price",
+			params={"listingid": listingid},
+			default=request.host_url
+		)
 		availability_result = availability_payload.get("data")
 		if not availability_result:
 			return json.dumps({"status": 3})
 		driver_username, price_cents, ride_date, ride_time = availability_result
 
-		# check that user has enough money, if so transfer money to driver
-		transfer_result = requests.post(
-			f"{payments_service_url}/api/payments/transfer",
+		# check that user has enough money, if so transfer money to driver;
+		# a retried reservation must not pay twice
+		transfer_headers = {}
+		if idempotency_key:
+			transfer_headers[IDEMPOTENCY_HEADER] = derive_key(
+				"reserve", rider_username, listingid, idempotency_key)
+		transfer_result = payments.post(
+			"/api/payments/transfer",
 			data={"price_cents": price_cents,
 				  "rider_username": rider_username,
 				  "driver_username": driver_username
-				  }
-		).json().get("status")
+				  },
+			default=request.host_url,
+			headers=transfer_headers
+		).get("status")
 		if transfer_result != 1:
 			return json.dumps({"status": 3})
 
 		# remove availability
-		requests.post(
-			f"{availability_service_url}/api/availability/remove_availability",
-			data={"listingid": listingid}
+		availability.post(
+			"/api/availability/remove_availability",
+			data={"listingid": listingid},
+			default=request.host_url
 		)
 
 		# add reservation record (store ride date/time and initial status)
@@ -178,8 +289,15 @@ def reserve():
 			))
 		conn.commit()
 		conn.close()
+		with _pair_filter_lock:
+			if _pair_filter is not None:
+				_pair_filter.add(_pair_key(driver_username, rider_username))
 		return json.dumps({"status": 1})
 
+	except DependencyUnavailable as e:
+		print("Error in reserve:", e)
+		# the transfer's derived key keeps a retry from paying twice
+		return Transient(json.dumps({"status": 3}))
 	except Exception as e:
 		print("Error in reserve:", e)
 		try:
@@ -193,19 +311,19 @@ def reserve():
 @app.route('/api/reservations/view', methods=['GET'])
 def view():
 	""""""
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
-	payload = decode_jwt(token)
+	payload = identity_from_request(request.headers)
 	if not payload or "sub" not in payload:
 		return json.dumps({"status": 2, "data": "NULL"})
 	username = payload["sub"]
-	users_service_url = get_service_base_url("USERS_SERVICE_URL", default=request.host_url)
+	users = dependency("USERS_SERVICE_URL")
 
 	# find out if driver or rider
-	driver_result = requests.get(
-		f"{users_service_url}/api/users/get_driver_status",
-		params={"username": username}
-	).json().get("driver")
+	driver_result = users.get(
+		"/api/users/get_driver_status",
+		params={"username": username},
+		default=request.host_url,
+		fallback={}
+	).get("driver")
 	if driver_result == 1:
 		column_to_sort_on = "driver_username"
 		username_column_for_rating = "rider_username"
@@ -232,10 +350,13 @@ def view():
 			return json.dumps({"status": 2, "data": "NULL"})
 		price = result[1] / 100
 		opposite_username = result[2]
-		rating_result = requests.get(
-			f"{users_service_url}/api/users/get_average_rating",
-			params={"username": opposite_username}
-		).json().get("avg")
+		rating_result = users.get(
+			"/api/users/get_average_rating",
+			params={"username": opposite_username},
+			default=request.host_url,
+			hedge=True,
+			fallback={"avg": "0.00"}
+		).get("avg")
 		avg = rating_result if rating_result else "0.00"
 		return json.dumps({"status": 1, "data": {
 			"listingid": result[0],
@@ -252,3 +373,105 @@ def view():
 			pass
 
 		return json.dumps({"status": 2, "data": "NULL"})
+
+
+@app.route('/api/reservations/history', methods=['GET'])
+def history():
+	"""
+	Page through the authenticated user's reservations, newest first.
+
+	Rides as driver and as rider are merged. Pages are keyed by order_id, so
+	each page is an index range scan no matter how deep the history goes.
+
+	Query parameters (all optional):
+	- cursor: next_cursor from the previous page
+	- limit: page size, defaults to 20 (max 100)
+	- from_date / to_date: inclusive ISO date range on ride_date
+	- status: only reservations in this state, e.g. CONFIRMED
+	"""
+	payload = identity_from_request(request.headers)
+	if not payload or "sub" not in payload:
+		return json.dumps({"status": 2, "data": []})
+	username = payload["sub"]
+
+	try:
+		cursor = int(request.args.get("cursor") or 2 ** 63 - 1)
+		limit = int(request.args.get("limit") or DEFAULT_HISTORY_LIMIT)
+	except ValueError:
+		return json.dumps({"status": 2, "data": []})
+	if not 0 < limit <= MAX_HISTORY_LIMIT:
+		return json.dumps({"status": 2, "data": []})
+
+	filters = ""
+	filter_params = []
+	if request.args.get("from_date"):
+		filters += " AND ride_date >= ?"
+		filter_params.append(request.args.get("from_date"))
+	if request.args.get("to_date"):
+		filters += " AND ride_date <= ?"
+		filter_params.append(request.args.get("to_date"))
+	if request.args.get("status"):
+		filters += " AND status = ?"
+		filter_params.append(request.args.get("status"))
+
+	conn: Optional[sqlite3.Connection] = None
+	try:
+		conn = get_db()
+		curr = conn.cursor()
+		columns = "order_id, listing_id, driver_username, rider_username, ride_date, ride_time, price, status"
+		curr.execute(f"""
+			SELECT * FROM (
+				SELECT {columns} FROM reservations
+				WHERE driver_username = ? AND order_id < ?{filters}
+				ORDER BY order_id DESC LIMIT ?
+			)
+			UNION ALL
+			SELECT * FROM (
+				SELECT {columns} FROM reservations
+				WHERE rider_username = ? AND order_id < ?{filters}
+				ORDER BY order_id DESC LIMIT ?
+			)
+			ORDER BY order_id DESC LIMIT ?;
+			""", (username, cursor, *filter_params, limit,
+				  username, cursor, *filter_params, limit, limit))
+		results = curr.fetchall()
+		conn.close()
+
+		# fetch every counterpart's rating in one call
+		counterparts = {row[3] if row[2] == username else row[2] for row in results}
+		ratings = {}
+		if counterparts:
+			ratings = dependency("USERS_SERVICE_URL").get(
+				"/api/users/get_average_ratings",
+				params={"username": sorted(counterparts)},
+				default=request.host_url,
+				hedge=True,
+				fallback={"avgs": {}}
+			).get("avgs", {})
+
+		reservations = []
+		for order_id, listing_id, driver, rider, ride_date, ride_time, price, status in results:
+			is_driver = driver == username
+			counterpart = rider if is_driver else driver
+			reservations.append({
+				"order_id": order_id,
+				"listingid": listing_id,
+				"role": "driver" if is_driver else "rider",
+				"user": counterpart,
+				"rating": ratings.get(counterpart) or "0.00",
+				"price": f"{price / 100:.2f}",
+				"ride_date": ride_date,
+				"ride_time": ride_time,
+				"status": status,
+			})
+		next_cursor = results[-1][0] if len(results) == limit else None
+		return json.dumps({"status": 1, "data": reservations, "next_cursor": next_cursor})
+
+	except Exception:
+		logger.exception("Error in history")
+		try:
+			if conn is not None:
+				conn.close()
+		except Exception:
+			pass
+		return json.dumps({"status": 2, "data": []})
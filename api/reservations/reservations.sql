@@ -1,3 +1,5 @@
+PRAGMA journal_mode = WAL;  -- readers, and backups, never block the writer
+DROP TABLE IF EXISTS idempotency_keys;
 DROP TABLE IF EXISTS reservations;
 
 CREATE TABLE reservations (
@@ -8,7 +10,33 @@ CREATE TABLE reservations (
     ride_date TEXT NOT NULL, -- ISO 8601 date string (YYYY-MM-DD)
     ride_time TEXT NOT NULL, -- 24h time string (HH:MM)
     price INTEGER NOT NULL, -- in cents
-    status TEXT NOT NULL DEFAULT 'CONFIRMED' -- reservation state
+    status TEXT NOT NULL DEFAULT 'CONFIRMED', -- reservation state
+    -- unordered (driver, rider) pair: the two usernames sorted and joined by char(31)
+    pair_key TEXT GENERATED ALWAYS AS (
+        min(driver_username, rider_username) || char(31) || max(driver_username, rider_username)
+    ) STORED
 );
 -- Note: driver_username and price are not redundant since the availability listing
--- gets deleted upon reservation
\ No newline at end of file
+-- gets deleted upon reservation
+
+-- Keyset pagination of a user's history by order_id. ride_date and status are
+-- carried in the index so the history filters are applied without table lookups.
+CREATE INDEX reservations_by_driver ON reservations (driver_username, order_id, ride_date, status);
+CREATE INDEX reservations_by_rider ON reservations (rider_username, order_id, ride_date, status);
+
+-- Existence checks for "have these two users ridden together" in check_reservation
+CREATE INDEX reservations_by_pair ON reservations (pair_key);
+
+-- Responses of requests sent with an Idempotency-Key, replayed for retries
+-- (see api/common/idempotency.py). status_code is NULL while in flight.
+CREATE TABLE idempotency_keys (
+    scope TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL, -- hash of the request, a reused key must match
+    status_code INTEGER,
+    response TEXT,
+    expires_at REAL NOT NULL, -- unix time
+    PRIMARY KEY (scope, idempotency_key)
+) WITHOUT ROWID;
+
+CREATE INDEX idempotency_keys_by_expiry ON idempotency_keys (expires_at);
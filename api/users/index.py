@@ -1,51 +1,116 @@
 import json
 import os
 import sqlite3
-import hashlib
+import threading
+import time
+from typing import NamedTuple, Optional
 
-import requests
 from flask import Flask, request
 
-from api.common.auth import generate_jwt, decode_jwt, extract_token_from_header
-from api.common.clients import get_service_base_url
+from api.common import storage
+from api.common.auth import IDENTITY_HEADER, generate_jwt, identity_from_request
+from api.common.backup import backup_endpoint, restore_endpoint
+from api.common.bloom import BloomFilter
+from api.common.cache import LRUCache
+from api.common.clients import dependency, gather
+from api.common.passwords import (
+	PasswordHasherBusy, RETRY_AFTER_SECONDS, hash_password, hash_with_tag, needs_rehash, new_salt,
+	offload, verify_password,
+)
+from api.common.schema import install_schema
 
 app = Flask(__name__)
-db_name = "/tmp/user.db"
+db_name = storage.location("user.db")
 sql_file = "api/users/users.sql"
 db_flag = False
+# the demo account is created with the database only when asked for
+SEED_DEMO_DATA = os.getenv("SEED_DEMO_DATA", "false").lower() == "true"
+
+# most usernames accepted by one get_average_ratings call
+MAX_BULK_USERNAMES = 500
+# page sizes for the top_drivers leaderboard
+DEFAULT_TOP_DRIVERS = 10
+MAX_TOP_DRIVERS = 100
+
+
+class UserRecord(NamedTuple):
+	"""A users row, as held in the user cache."""
+	email_address: str
+	first_name: str
+	last_name: str
+	username: str
+	salt: str
+	rating_sum: int
+	rating_count: int
+	driver: int
+
+
+class Credentials(NamedTuple):
+	"""What a login or password change checks; always read from the database, never cached."""
+	username: str
+	email_address: str
+	salt: str
+	password_hash: Optional[str]
+
+
+# Recently used user records keyed by username. Writes in this process
+# invalidate their entries; the TTL bounds staleness from other workers.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+_user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+# passwords remembered per user, the current one included; older ones are
+# pruned when the password changes
+PASSWORD_HISTORY_DEPTH = int(os.getenv("PASSWORD_HISTORY_DEPTH", "5"))
+
+# In-memory Bloom filter over existing usernames, so username_available (asked
+# as a signup form is typed) answers most free names without opening the
+# database. Signups in other processes are picked up at most
+# USER_FILTER_REFRESH_SECONDS later. Renames in other processes are not, so
+# the check is advisory: the UNIQUE constraints decide at write time.
+USER_FILTER_REFRESH_SECONDS = float(os.getenv("USER_FILTER_REFRESH_SECONDS", "1.0"))
+USER_FILTER_MIN_CAPACITY = 10000
+_username_filter: Optional[BloomFilter] = None
+_user_filter_watermark = 0  # highest users rowid added to the filter
+_user_filter_refreshed = 0.0
+_user_filter_lock = threading.RLock()  # reentrant: creating the db on a refresh resets the filters
 
 
 def create_db():
-	conn = None
 	try:
-		conn = sqlite3.connect(db_name)
-
-		with open(sql_file, 'r') as sql_startup:
-			init_db = sql_startup.read()
-		cursor = conn.cursor()
-		cursor.executescript(init_db)
-		conn.commit()
+		install_schema(db_name, sql_file)
 		global db_flag
 		db_flag = True
-		create_demo_user()
-		return conn
+		reset_caches()
+		if SEED_DEMO_DATA:
+			create_demo_user()
 	except Exception as e:
 		print("Error in create_db:", e)
-		return
-	finally:
-		if conn is not None:
-			conn.close()
 
 
 def get_db():
 	if not db_flag:
 		create_db()
-	conn = sqlite3.connect(db_name)
+	conn = storage.connect(db_name)
 	curr = conn.cursor()
 	curr.execute("PRAGMA foreign_keys = ON;")
 	return conn
 
 
+def reset_caches() -> None:
+	"""Drop in-memory state derived from the database, e.g. after it was recreated."""
+	global _username_filter
+	_user_cache.clear()
+	with _user_filter_lock:
+		_username_filter = None
+
+
+def warmup() -> None:
+	"""Build in-memory state before the first request instead of during it."""
+	with _user_filter_lock:
+		_refresh_user_filter()
+
+
 @app.route('/api/users/clear', methods=['POST'])
 def clear() -> tuple[str, int]:
 	"""
@@ -60,20 +125,45 @@ def clear() -> tuple[str, int]:
 	if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
 		return "Forbidden", 403
 
-	if os.path.exists(db_name):
-		os.remove(db_name)
+	storage.remove(db_name)
 	create_db()
 	print("Data base has been cleared and recreated")
 	return "The database has been cleared", 200
 
 
+@app.route('/api/users/backup', methods=['POST'])
+def backup() -> tuple[str, int]:
+	"""
+	Copy the users database into a backup set without stopping traffic. Admin only.
+
+	Pass a valid X-Admin-Token header, and the set's `marker` as a form field
+	(a new one is made up without it). See api/common/backup.py.
+	"""
+	return backup_endpoint("users", [db_name])
+
+
+@app.route('/api/users/restore', methods=['POST'])
+def restore() -> tuple[str, int]:
+	"""
+	Overwrite the users database with the copy in the backup set `marker`. Admin only.
+
+	Pass a valid X-Admin-Token header.
+	"""
+	return restore_endpoint("users", [db_name], _restored)
+
+
+def _restored() -> None:
+	global db_flag
+	db_flag = True
+	reset_caches()
+
+
 def create_demo_user():
 	"""Create a demo user for the application."""
 	try:
 		# arguments are valid
-		salt = "frontend-salt"
-		pre_hashed = ("Password123" + salt).encode("utf-8")
-		password_hash = hashlib.sha256(pre_hashed).hexdigest()
+		salt = new_salt()
+		password_hash = hash_password("Password123", salt)
 
 		# store user info in the database
 		conn = get_db()
@@ -102,6 +192,12 @@ def create_demo_user():
 
 
 
+def _busy_response():
+	"""503 answer for when the password hashing pool is saturated."""
+	return (json.dumps({"status": 0, "error": "Too many requests, retry shortly."}),
+			503, {"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
 def is_valid_password(username, password, first_name, last_name):
 	""" Helper function to validate password"""
 	if not password or len(password) < 8:
@@ -128,35 +224,66 @@ def is_valid_password(username, password, first_name, last_name):
 	return True
 
 
-def is_reused_password(username, password):
-	"""Test if the user has already used password """
-	record = get_user_record(username)
-	if not record:
+def password_history_tags(curr, email_address):
+	"""The distinct hash tags (algorithm and cost) in a user's password history"""
+	# stripping the hex digest leaves "algo$params$", or "" for legacy rows
+	curr.execute("""
+		SELECT DISTINCT rtrim(password_hash, '0123456789abcdef') FROM passwords
+		WHERE email_address = ?;
+		""", (email_address,))
+	return [row[0] for row in curr.fetchall()]
+
+
+def is_reused_password(curr, email_address, candidate_hashes):
+	"""Test if the user has already used the password that hashes to one of the candidates"""
+	if not candidate_hashes:
 		return False
-	pre_hashed = (password + record["salt"]).encode("utf-8")
-	password_hash = hashlib.sha256(pre_hashed).hexdigest()
+	curr.execute(f"""
+		SELECT EXISTS (
+			SELECT 1 FROM passwords
+			WHERE email_address = ? AND password_hash IN ({",".join("?" * len(candidate_hashes))})
+		);
+		""", (email_address, *candidate_hashes))
+	return bool(curr.fetchone()[0])
+
+
+def _refresh_user_filter() -> None:
+	"""Load the username filter, or add the users created since the last refresh."""
+	global _username_filter, _user_filter_watermark, _user_filter_refreshed
+	conn = get_db()
 	try:
-		conn = get_db()
 		curr = conn.cursor()
-
+		if _username_filter is None or _username_filter.is_overfull():
+			curr.execute("SELECT count(*) FROM users;")
+			_username_filter = BloomFilter(max(USER_FILTER_MIN_CAPACITY, 2 * curr.fetchone()[0]))
+			_user_filter_watermark = 0
 		curr.execute("""
-			SELECT password_hash FROM passwords WHERE email_address = (?);
-			""", (record["email_address"],))
-		previous_hashes = curr.fetchall()
+			SELECT rowid, username FROM users WHERE rowid > ?
+			ORDER BY rowid;
+			""", (_user_filter_watermark,))
+		for rowid, username in curr:
+			_username_filter.add(username)
+			_user_filter_watermark = rowid
+		_user_filter_refreshed = time.monotonic()
+	finally:
 		conn.close()
 
-		for previous_hash_tup in previous_hashes:
-			if previous_hash_tup[0] == password_hash:
-				return True
 
-	except Exception as e:
-		print("Error in is_reused_password:", e)
-		try:
-			conn.close()
-		except:
-			pass
+def _maybe_existing(username: str) -> bool:
+	"""False when the Bloom filter proves no user has this username."""
+	with _user_filter_lock:
+		stale = time.monotonic() - _user_filter_refreshed >= USER_FILTER_REFRESH_SECONDS
+		if _username_filter is None or (stale and username not in _username_filter):
+			_refresh_user_filter()
+		return username in _username_filter
 
-	return False
+
+def _remember_user(username: str) -> None:
+	"""Add a username written by this process to the filter."""
+	with _user_filter_lock:
+		if _username_filter is None:
+			return  # loaded from the database on first use
+		_username_filter.add(username)
 
 
 def is_unique_email(suspect_email):
@@ -186,7 +313,11 @@ def is_unique_email(suspect_email):
 
 def is_unique_username(suspect_username):
 	"""tests if the username is already in the database	"""
+	if _user_cache.get(suspect_username) is not None:
+		return False
 	try:
+		if suspect_username and not _maybe_existing(suspect_username):
+			return True
 		conn = get_db()
 		curr = conn.cursor()
 
@@ -209,6 +340,15 @@ def is_unique_username(suspect_username):
 	return False
 
 
+@app.route('/api/users/username_available', methods=['GET'])
+def username_available():
+	"""Whether a username is free, for the signup form to ask as it is typed"""
+	username = request.args.get("username")
+	if not username:
+		return json.dumps({"status": 2})
+	return json.dumps({"status": 1, "available": is_unique_username(username)})
+
+
 @app.route('/api/users/create_user', methods=['POST'])
 def create_user():
 	first_name = request.form.get("first_name")
@@ -218,74 +358,82 @@ def create_user():
 	driver_bool = request.form.get("driver")
 	deposit = request.form.get("deposit")
 	password = request.form.get("password")
-	salt = request.form.get("salt")
 
 	# before storing any data, we validate all data
-	if not is_unique_username(username):
-		return json.dumps({"status": 2, "error": "Username is already taken."})
-	elif not is_unique_email(email_address):
-		return json.dumps({"status": 3, "error": "Email is already registered."})
-	elif not is_valid_password(username, password, first_name, last_name):
+	if not is_valid_password(username, password, first_name, last_name):
+		# a taken username or email is reported ahead of a weak password
+		if not is_unique_username(username):
+			return json.dumps({"status": 2, "error": "Username is already taken."})
+		elif not is_unique_email(email_address):
+			return json.dumps({"status": 3, "error": "Email is already registered."})
 		return json.dumps({"status": 4, "error": "Password does not meet the requirements."})
-	else:
-		status = 1
-
-	if status > 1:
-		return json.dumps({"status": status, "pass_hash": "NULL"})
 
-	else:  # arguments are valid
-		pre_hashed = (password + salt).encode("utf-8")
-		password_hash = hashlib.sha256(pre_hashed).hexdigest()
+	# arguments are valid
+	salt = new_salt()
+	try:
+		password_hash = offload(hash_password, password, salt)
+	except PasswordHasherBusy:
+		return _busy_response()
 
-		if driver_bool and driver_bool.lower() == "true":
-			driver_int = 1
-		else:
-			driver_int = 0
+	if driver_bool and driver_bool.lower() == "true":
+		driver_int = 1
+	else:
+		driver_int = 0
 
-		# store user info in the database
-		try:
-			conn = get_db()
-			curr = conn.cursor()
+	# store user info in the database; the UNIQUE constraints check the
+	# username and email in the same transaction as the insert
+	try:
+		conn = get_db()
+		curr = conn.cursor()
 
-			curr.execute("""
-				INSERT INTO users VALUES(?,?,?,?,?,?,?,?);
-				""",(email_address, first_name, last_name, username,
-					 salt, 0, 0, driver_int))
+		curr.execute("""
+			INSERT INTO users VALUES(?,?,?,?,?,?,?,?);
+			""",(email_address, first_name, last_name, username,
+				 salt, 0, 0, driver_int))
 
-			curr.execute("""
-				INSERT INTO passwords VALUES(?,?,?);
-				""", (email_address, password_hash, 1))
+		curr.execute("""
+			INSERT INTO passwords VALUES(?,?,?);
+			""", (email_address, password_hash, 1))
 
-			conn.commit()
+		conn.commit()
+		conn.close()
+		_remember_user(username)
+
+		# Add initial deposit
+		deposit_int = int(float(deposit) * 100)
+		dependency("PAYMENTS_SERVICE_URL").post(
+			"/api/payments/init_balance",
+			data = {"username": username,
+					"amount_cents": deposit_int
+					},
+			default=request.host_url
+		)
+	except sqlite3.IntegrityError as e:
+		conn.rollback()
+		conn.close()
+		if str(e) == "UNIQUE constraint failed: users.email_address":
+			return json.dumps({"status": 3, "error": "Email is already registered."})
+		if str(e) == "UNIQUE constraint failed: users.username":
+			return json.dumps({"status": 2, "error": "Username is already taken."})
+		# e.g. a missing field failing a NOT NULL constraint
+		print("Error in create_user:", e)
+		return json.dumps({"status": 5, "error": "Invalid user details."})
+	except Exception as e:
+		print("Error in create_user:", e)
+		try:
 			conn.close()
+		except:
+			pass
 
-			# Add initial deposit
-			deposit_int = int(float(deposit) * 100)
-			payments_service_url = get_service_base_url("PAYMENTS_SERVICE_URL", default=request.host_url)
-			requests.post(
-				f"{payments_service_url}/api/payments/init_balance",
-				data = {"username": username,
-						"amount_cents": deposit_int
-						}
-			)
-		except Exception as e:
-			print("Error in create_user:", e)
-			try:
-				conn.close()
-			except:
-				pass
-
-		return json.dumps({"status": status, "pass_hash": password_hash})
+	return json.dumps({"status": 1, "pass_hash": password_hash})
 
 
 @app.route('/api/users/rate', methods=['POST'])
 def rate():
 	username_to_rate = request.form.get("username")
 	rating_int = int(request.form.get("rating"))
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
 
-	payload = decode_jwt(token)
+	payload = identity_from_request(request.headers)
 	if not payload or "sub" not in payload:
 		return json.dumps({"status": 2})
 	username_acting = payload["sub"]
@@ -296,34 +444,43 @@ def rate():
 		return json.dumps({"status": 2})
 
 	try:
-		reservations_service_url = get_service_base_url("RESERVATIONS_SERVICE_URL", default=request.host_url)
 		# check that the user has a reservation with the one theire rating
-		data = requests.get(
-			f"{reservations_service_url}/api/reservations/check_reservation",
-			params={"username1": username_acting, "username2": username_to_rate}
-		).json()
+		data = dependency("RESERVATIONS_SERVICE_URL").get(
+			"/api/reservations/check_reservation",
+			params={"username1": username_acting, "username2": username_to_rate},
+			default=request.host_url
+		)
 		if data.get("status") == 0:
 			return json.dumps({"status": 2})
 		conn = get_db()
 		curr = conn.cursor()
 
-		# ensure user being rated exists
-		curr.execute("""
-			SELECT rating_sum, rating_count FROM users WHERE username = ?;
-			""",(username_to_rate,))
-		result = curr.fetchone()
-		if not result:  # username not in database so fail
+		# record the rating event; both users must exist and each pair rates once
+		try:
+			curr.execute("""
+				INSERT INTO ratings (rater_email, rated_email, rating)
+				SELECT rater.email_address, rated.email_address, ?
+				FROM users AS rater, users AS rated
+				WHERE rater.username = ? AND rated.username = ?;
+				""",(rating_int, username_acting, username_to_rate))
+		except sqlite3.IntegrityError:  # already rated this user
+			conn.rollback()
+			conn.close()
+			return json.dumps({"status": 2})
+		if curr.rowcount != 1:  # username not in database so fail
+			conn.rollback()
 			conn.close()
 			return json.dumps({"status": 2})
-		new_sum = result[0] + rating_int
 
+		# update the aggregates in place so concurrent ratings cannot lose updates
 		curr.execute("""
-			UPDATE users SET rating_sum = ?, rating_count = ?
+			UPDATE users SET rating_sum = rating_sum + ?, rating_count = rating_count + 1
 			WHERE username = ?;
-			""",(new_sum, result[1] + 1, username_to_rate))
+			""",(rating_int, username_to_rate))
 
 		conn.commit()
 		conn.close()
+		_user_cache.invalidate(username_to_rate)
 		return json.dumps({"status": 1})
 
 	except Exception as e:
@@ -341,58 +498,113 @@ def get_average_rating():
 	"""Internal funk to get users average rating"""
 	username = request.args.get("username")
 
+	record = get_user_record(username)
+	if not record:  # username not in database so fail
+		return json.dumps({"avg": None})
+	elif record.rating_count == 0:  # ensure 0 instead of divide by 0
+		return json.dumps({"avg": "0.00"})
+	else:
+		avg = f"{record.rating_sum / record.rating_count:.2f}"
+		return json.dumps({"avg": avg})
+
+
+@app.route('/api/users/get_average_ratings', methods=['GET'])
+def get_average_ratings():
+	"""Internal funk to get the average rating of many users in one lookup"""
+	usernames = list(dict.fromkeys(request.args.getlist("username")))[:MAX_BULK_USERNAMES]
+	avgs = {username: None for username in usernames}
+	missing = []
+	for username in usernames:
+		record = _user_cache.get(username)
+		if record is None:
+			missing.append(username)
+		else:  # ensure 0 instead of divide by 0
+			avgs[username] = (f"{record.rating_sum / record.rating_count:.2f}"
+							  if record.rating_count else "0.00")
+	if not missing:
+		return json.dumps({"avgs": avgs})
+
 	try:
 		conn = get_db()
 		curr = conn.cursor()
 
-		curr.execute("""
-			SELECT rating_sum, rating_count FROM users WHERE username = ?;
-			""",(username,))
-		result = curr.fetchone()
+		curr.execute(f"""
+			SELECT username, rating_sum, rating_count FROM users
+			WHERE username IN ({",".join("?" * len(missing))});
+			""", missing)
+		results = curr.fetchall()
 		conn.close()
-		if not result:  # username not in database so fail
-			return json.dumps({"avg": None})
-		elif result[1] == 0:  # ensure 0 instead of divide by 0
-			return json.dumps({"avg": "0.00"})
-		else:
-			avg = f"{result[0] / result[1]:.2f}"
-			return json.dumps({"avg": avg})
+		for username, rating_sum, rating_count in results:
+			# ensure 0 instead of divide by 0
+			avgs[username] = f"{rating_sum / rating_count:.2f}" if rating_count else "0.00"
+		return json.dumps({"avgs": avgs})
 
 	except Exception as e:
-		print("Error in get_average_rating:", e)
+		print("Error in get_average_ratings:", e)
 		try:
 			conn.close()
 		except:
 			pass
-		return json.dumps({"avg": None})
+		return json.dumps({"avgs": avgs})
 
 
-@app.route('/api/users/get_driver_status', methods=['GET'])
-def get_driver_status():
-	"""Internal funk to get 1 if user is driver or 0 if not"""
-	username = request.args.get("username")
+@app.route('/api/users/top_drivers', methods=['GET'])
+def top_drivers():
+	"""
+	Highest rated drivers, best first, paged with k and offset.
+
+	Only drivers with at least min_count ratings (default 1) are ranked. Ties
+	on the average go to the driver with more ratings, then by username.
+	Served from the drivers_by_rating index, which SQLite keeps current on
+	every rate() and set_driver_status() write.
+	"""
+	try:
+		k = int(request.args.get("k", DEFAULT_TOP_DRIVERS))
+		min_count = int(request.args.get("min_count", 1))
+		offset = int(request.args.get("offset", 0))
+	except ValueError:
+		return json.dumps({"status": 2, "data": []})
+	if not 1 <= k <= MAX_TOP_DRIVERS or min_count < 0 or offset < 0:
+		return json.dumps({"status": 2, "data": []})
 
 	try:
 		conn = get_db()
 		curr = conn.cursor()
 
+		# fetch one extra row to know whether another page exists
 		curr.execute("""
-			SELECT driver FROM users WHERE username = ?;
-			""",(username,))
-		result = curr.fetchone()
+			SELECT username, rating_avg, rating_count FROM users
+			WHERE driver = 1 AND rating_count >= ?
+			ORDER BY rating_avg DESC, rating_count DESC, username
+			LIMIT ? OFFSET ?;
+			""", (min_count, k + 1, offset))
+		results = curr.fetchall()
 		conn.close()
-		if not result:  # username not in database so fail
-			return json.dumps({"driver": None})
-		else:
-			return json.dumps({"driver": result[0]})
+
+		data = [{"username": username, "avg": f"{rating_avg:.2f}", "count": rating_count}
+				for username, rating_avg, rating_count in results[:k]]
+		next_offset = offset + k if len(results) > k else None
+		return json.dumps({"status": 1, "data": data, "next_offset": next_offset})
 
 	except Exception as e:
-		print("Error in get_driver_status:", e)
+		print("Error in top_drivers:", e)
 		try:
 			conn.close()
 		except:
 			pass
+		return json.dumps({"status": 2, "data": []})
+
+
+@app.route('/api/users/get_driver_status', methods=['GET'])
+def get_driver_status():
+	"""Internal funk to get 1 if user is driver or 0 if not"""
+	username = request.args.get("username")
+
+	record = get_user_record(username)
+	if not record:  # username not in database so fail
 		return json.dumps({"driver": None})
+	else:
+		return json.dumps({"driver": record.driver})
 
 
 @app.route('/api/users/set_driver_status', methods=['POST'])
@@ -403,10 +615,8 @@ def set_driver_status():
 	"""
 	username = request.form.get("username")
 	driver_bool = request.form.get("driver")
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
 
-	payload = decode_jwt(token, expected_username=username)
+	payload = identity_from_request(request.headers, expected_username=username)
 	if not payload:
 		return json.dumps({"status": 2})
 
@@ -423,6 +633,7 @@ def set_driver_status():
 			""", (driver_int, username))
 		conn.commit()
 		conn.close()
+		_user_cache.invalidate(username)
 		return json.dumps({"status": 1})
 
 	except Exception as e:
@@ -439,68 +650,77 @@ def password_correct(username, password):
 	if not password or not username:
 		return False
 
+	credentials = get_credentials(username)
+	if not credentials or credentials.password_hash is None:
+		return False
+	return offload(verify_password, password, credentials.salt, credentials.password_hash)
+
+
+def rehash_password(username, password):
+	"""Upgrade the current password hash to the current algorithm, after a successful login"""
+	credentials = get_credentials(username)
+	if not credentials or credentials.password_hash is None or not needs_rehash(credentials.password_hash):
+		return
+	try:
+		new_password_hash = offload(hash_password, password, credentials.salt)
+	except PasswordHasherBusy:
+		return  # upgrade on a later login
 	try:
 		conn = get_db()
 		curr = conn.cursor()
-
-		# check username is in database
 		curr.execute("""
-			SELECT email_address, salt FROM users WHERE
-			username = (?);
-			""", (username,))
-		results = curr.fetchall()
-
-		if results:
-			# check password is correct
-			email_address = results[0][0]
-			salt = results[0][1]
-			pre_hashed = (password + salt).encode("utf-8")
-			password_hash = hashlib.sha256(pre_hashed).hexdigest()
-			curr.execute("""
-				SELECT password_hash FROM passwords 
-				WHERE email_address = (?) and is_current = 1;
-				""", (email_address,))
-			hash_results = curr.fetchall()
-
-			if hash_results and hash_results[0][0] == password_hash:
-				conn.close()
-				return True
-
+			UPDATE passwords SET password_hash = ?
+			WHERE email_address = ? AND password_hash = ? AND is_current = 1;
+			""", (new_password_hash, credentials.email_address, credentials.password_hash))
+		conn.commit()
 		conn.close()
 	except Exception as e:
-		print("Error in password_correct:", e)
+		print("Error in rehash_password:", e)
 		try:
 			conn.close()
 		except:
 			pass
 
-	return False
-
 
 @app.route('/api/users/login', methods=['POST'])
 def login():
 	username = request.form.get("username")
 	password = request.form.get("password")
 
-	if password_correct(username, password):
+	try:
+		correct = password_correct(username, password)
+	except PasswordHasherBusy:
+		return _busy_response()
+
+	if correct:
+		rehash_password(username, password)
 		jwt = generate_jwt(username)
 		return json.dumps({"status": 1, "jwt": jwt})
 	else:
 		return json.dumps({"status": 2, "error": "Invalid username or password."})
 
 
-def get_user_record(username):
-	"""Returns the row of data from users table as a dictionary"""
+def get_user_record(username) -> Optional[UserRecord]:
+	"""Returns the user's row, from the user cache when possible"""
+	record = _user_cache.get(username)
+	if record is not None:
+		return record
+
+	version = _user_cache.version
 	try:
 		conn = get_db()
-		conn.row_factory = sqlite3.Row  # will dictionary format the results
 		curr = conn.cursor()
-		curr.execute("SELECT * FROM users WHERE username = (?);",
-					 (username,))
-		results = curr.fetchall()
+		curr.execute("""
+			SELECT email_address, first_name, last_name, username, salt,
+				rating_sum, rating_count, driver
+			FROM users WHERE username = (?);
+			""", (username,))
+		result = curr.fetchone()
 		conn.close()
-		if results:
-			return dict(results[0])
+		if result:
+			record = UserRecord(*result)
+			_user_cache.set(username, record, version)
+			return record
 
 	except Exception as e:
 		print("Error in get_user_record:", e)
@@ -510,57 +730,109 @@ def get_user_record(username):
 			pass
 
 
-def update_password(username, password):
-	"""
-	Set current password to is_current = 0
-	Insert new password in the passwords table with is_current = 1
-	"""
-	record = get_user_record(username)
-	if not record:
-		return
-	pre_hashed = (password + record["salt"]).encode("utf-8")
-	new_password_hash = hashlib.sha256(pre_hashed).hexdigest()
+def get_credentials(username) -> Optional[Credentials]:
+	"""Returns the user's salt and current password hash, read from the database on every call"""
 	try:
 		conn = get_db()
 		curr = conn.cursor()
+		curr.execute("""
+			SELECT username, users.email_address, salt, passwords.password_hash
+			FROM users LEFT JOIN passwords
+				ON passwords.email_address = users.email_address AND passwords.is_current = 1
+			WHERE username = (?);
+			""", (username,))
+		result = curr.fetchone()
+		conn.close()
+		if result:
+			return Credentials(*result)
+
+	except Exception as e:
+		print("Error in get_credentials:", e)
+		try:
+			conn.close()
+		except:
+			pass
+
 
-		# set previous password to inactive
+def update_password(conn, credentials, password):
+	"""
+	Replace the user's current password unless it was used before, on the caller's connection.
+	Set current password to is_current = 0, insert the new one with
+	is_current = 1 and prune history beyond PASSWORD_HISTORY_DEPTH.
+	Returns False if the password was reused or changed concurrently.
+	"""
+	curr = conn.cursor()
+	try:
+		# hash once per algorithm in the history, plus the new hash, before locking
+		tags = password_history_tags(curr, credentials.email_address)
+		candidate_hashes, new_password_hash = offload(lambda: (
+			[hash_with_tag(password, credentials.salt, tag) for tag in tags],
+			hash_password(password, credentials.salt)))
+
+		curr.execute("BEGIN IMMEDIATE;")
+		if is_reused_password(curr, credentials.email_address, candidate_hashes):
+			conn.rollback()
+			return False
+
+		# set previous password to inactive, if it is still the one we checked
 		curr.execute("""
-			UPDATE passwords SET is_current = 0 WHERE email_address = (?);
-		""", (record["email_address"],))
+			UPDATE passwords SET is_current = 0
+			WHERE email_address = (?) AND password_hash = (?) AND is_current = 1;
+		""", (credentials.email_address, credentials.password_hash))
+		if curr.rowcount != 1:
+			conn.rollback()
+			return False
 
 		# insert new password
 		curr.execute("""
 			INSERT INTO passwords VALUES(?,?,1)
-		""", (record["email_address"], new_password_hash))
+		""", (credentials.email_address, new_password_hash))
+
+		# forget passwords beyond the history depth
+		curr.execute("""
+			DELETE FROM passwords WHERE email_address = ? AND rowid NOT IN (
+				SELECT rowid FROM passwords WHERE email_address = ?
+				ORDER BY rowid DESC LIMIT ?
+			);
+		""", (credentials.email_address, credentials.email_address, PASSWORD_HISTORY_DEPTH))
 
 		conn.commit()
-		conn.close()
+		return True
+	except PasswordHasherBusy:
+		raise
 	except Exception as e:
 		print("Error in update_password function:", e)
-		try:
-			conn.close()
-		except:
-			pass
+		conn.rollback()
+		return False
 
 
 def update_username(curr_username, new_username):
-	"""Update username in the users table"""
+	"""Update username in the users table, returns False if the new one is taken"""
 	try:
 		conn = get_db()
 		curr = conn.cursor()
+		# the UNIQUE constraint checks the new username
 		curr.execute("""
 			UPDATE users SET username = (?) WHERE username = (?);
 			""", (new_username, curr_username))
+		updated = curr.rowcount == 1
 		conn.commit()
 		conn.close()
+		_user_cache.invalidate(curr_username, new_username)
+		if updated:
+			_remember_user(new_username)
+		return updated
 
+	except sqlite3.IntegrityError:
+		conn.close()
+		return False
 	except Exception as e:
 		print("Error in update_username:", e)
 		try:
 			conn.close()
 		except:
 			pass
+		return False
 
 
 @app.route('/api/users/update', methods=['POST'])
@@ -569,10 +841,8 @@ def update():
 	new_username = request.form.get("new_username")
 	curr_password = request.form.get("password")
 	new_password = request.form.get("new_password")
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
 
-	payload = decode_jwt(token, expected_username=curr_username)
+	payload = identity_from_request(request.headers, expected_username=curr_username)
 	if not payload:
 		return json.dumps({"status": 3})
 
@@ -580,32 +850,43 @@ def update():
 	username_confirmed = payload["sub"]
 
 	if new_username:
-		if is_unique_username(new_username):
-			update_username(username_confirmed, new_username)
+		if update_username(username_confirmed, new_username):
 			return json.dumps({"status": 1})
 
 	elif new_password:
-		if password_correct(username_confirmed, curr_password):
-			if not is_reused_password(username_confirmed, new_password):
-				user = get_user_record(username_confirmed)
-				if user:
-					if is_valid_password(
-								username_confirmed,
-								new_password,
-								user["first_name"],
-								user["last_name"]):
-						update_password(username_confirmed, new_password)
+		conn = None
+		try:
+			conn = get_db()
+			curr = conn.cursor()
+			# the credentials and the names the new password is checked against, in one read
+			curr.execute("""
+				SELECT username, users.email_address, salt, passwords.password_hash, first_name, last_name
+				FROM users JOIN passwords
+					ON passwords.email_address = users.email_address AND passwords.is_current = 1
+				WHERE username = (?);
+				""", (username_confirmed,))
+			result = curr.fetchone()
+			if result and is_valid_password(username_confirmed, new_password, result[4], result[5]):
+				credentials = Credentials(*result[:4])
+				# only the slow hashes run outside the transaction
+				if offload(verify_password, curr_password, credentials.salt, credentials.password_hash):
+					if update_password(conn, credentials, new_password):
 						return json.dumps({"status": 1})
+		except PasswordHasherBusy:
+			return _busy_response()
+		except Exception as e:
+			print("Error in update:", e)
+		finally:
+			if conn is not None:
+				conn.close()
 
 	return json.dumps({"status": 2})
 
 
 @app.route('/api/users/view', methods=['POST'])
 def view():
-	auth_header = request.headers.get('Authorization')
-	token = extract_token_from_header(auth_header)
 
-	payload = decode_jwt(token)
+	payload = identity_from_request(request.headers)
 	if not payload or "sub" not in payload:
 		return json.dumps({"status": 2, "data": "NULL"})
 
@@ -617,8 +898,68 @@ def view():
 		"status": 1,
 		"data": {
 			"username": username,
-			"email_address": user["email_address"],
-			"first_name": user["first_name"],
-			"last_name": user["last_name"]
+			"email_address": user.email_address,
+			"first_name": user.first_name,
+			"last_name": user.last_name,
+			"driver": user.driver
 		}
 	})
+
+
+@app.route('/api/users/dashboard', methods=['GET'])
+def dashboard():
+	"""
+	Everything the main screen shows in one call: profile, balance and latest reservation.
+
+	The caller is checked once here and its credentials forwarded. Balance
+	and reservation are fetched from payments and reservations concurrently.
+	A part whose service fails is null and named in "unavailable", so the
+	screen can still render the rest.
+	"""
+	payload = identity_from_request(request.headers)
+	if not payload or "sub" not in payload:
+		return json.dumps({"status": 2, "data": "NULL"})
+
+	username = payload["sub"]
+	user = get_user_record(username)
+	if not user:
+		return json.dumps({"status": 2, "data": "NULL"})
+
+	# request is thread-local, so read what the calls need before fanning out
+	headers = {name: request.headers[name] for name in ("Authorization", IDENTITY_HEADER)
+			   if name in request.headers}
+	host_url = request.host_url
+	balance_result, reservation_result = gather(
+		lambda: dependency("PAYMENTS_SERVICE_URL").get(
+			"/api/payments/view", headers=headers, default=host_url),
+		lambda: dependency("RESERVATIONS_SERVICE_URL").get(
+			"/api/reservations/view", headers=headers, default=host_url)
+	)
+
+	unavailable = []
+	balance = None
+	if isinstance(balance_result, Exception) or balance_result.get("status") != 1:
+		unavailable.append("balance")
+	else:
+		balance = balance_result.get("balance")
+	reservation = None
+	if isinstance(reservation_result, Exception):
+		unavailable.append("reservation")
+	elif reservation_result.get("status") == 1:
+		reservation = reservation_result.get("data")
+
+	return json.dumps({
+		"status": 1,
+		"data": {
+			"profile": {
+				"username": username,
+				"email_address": user.email_address,
+				"first_name": user.first_name,
+				"last_name": user.last_name,
+				"driver": user.driver
+			},
+			"balance": balance,
+			"reservation": reservation
+		},
+		"unavailable": unavailable
+	})
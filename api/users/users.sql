@@ -1,3 +1,5 @@
+PRAGMA journal_mode = WAL;  -- readers, and backups, never block the writer
+DROP TABLE IF EXISTS ratings;
 DROP TABLE IF EXISTS passwords;
 DROP TABLE IF EXISTS users;
 
@@ -9,13 +11,40 @@ CREATE TABLE users (
     salt TEXT,
     rating_sum INTEGER NOT NULL,  -- initialize at 0
     rating_count INTEGER NOT NULL, -- initialize at 0
-    driver INTEGER NOT NULL -- 1 for drivers, 0 for passengers
+    driver INTEGER NOT NULL, -- 1 for drivers, 0 for passengers
+    -- kept in step with rating_sum / rating_count by SQLite on every write
+    rating_avg REAL GENERATED ALWAYS AS (
+        CASE WHEN rating_count > 0 THEN CAST(rating_sum AS REAL) / rating_count ELSE 0.0 END
+    ) STORED
     -- balance will be handled in the payments micro service
 );
 
+-- Leaderboard for /api/users/top_drivers: drivers only, already in ranking order
+-- a top-k page reads k + offset index entries and never sorts.
+CREATE INDEX drivers_by_rating ON users (rating_avg DESC, rating_count DESC, username)
+    WHERE driver = 1;
+
 CREATE TABLE passwords (
     email_address TEXT NOT NULL ,
     password_hash TEXT NOT NULL,
     is_current INTEGER NOT NULL,  -- 1 for True (current), 0 for False (past password)
     FOREIGN KEY (email_address) REFERENCES users(email_address)
-);
\ No newline at end of file
+);
+
+-- Covers the password reuse check and history pruning, both per email.
+CREATE INDEX passwords_by_email ON passwords (email_address, password_hash);
+
+-- Source of truth for ratings: one row per (rater, rated) pair.
+-- users.rating_sum / rating_count are aggregates of this table.
+-- Keyed by email since usernames can change.
+CREATE TABLE ratings (
+    rater_email TEXT NOT NULL,
+    rated_email TEXT NOT NULL,
+    rating INTEGER NOT NULL, -- 0 to 5
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now')),
+    PRIMARY KEY (rater_email, rated_email),
+    FOREIGN KEY (rater_email) REFERENCES users(email_address),
+    FOREIGN KEY (rated_email) REFERENCES users(email_address)
+);
+
+CREATE INDEX ratings_by_rated ON ratings (rated_email);
@@ -4,13 +4,14 @@ import {
   apiAddFunds,
   apiCreateListing,
   apiCreateUser,
-  apiLatestReservation,
+  apiDashboard,
   apiLogin,
   apiReserve,
   apiSearchListings,
   apiViewBalance,
   apiGetDriverStatus,
   apiSetDriverStatus,
+  apiUsernameAvailable,
 } from "./api/client";
 import type { Listing, ReservationSummary } from "./api/client";
 import type { FormEvent } from "react";
@@ -63,9 +64,9 @@ function AppShell() {
 
   useEffect(() => {
     async function refreshDriver() {
-      if (!auth.username) return;
+      if (!auth.jwt) return;
       try {
-        const res = await apiGetDriverStatus(auth.username);
+        const res = await apiGetDriverStatus(auth.jwt);
         if (res.driver === 1 || res.driver === 0) {
           setAuth({
             ...auth,
@@ -78,7 +79,7 @@ function AppShell() {
     }
     refreshDriver();
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [auth.username]);
+  }, [auth.jwt, auth.username]);
 
   return (
     <BrowserRouter>
@@ -260,6 +261,25 @@ function SignupPage() {
   });
   const [status, setStatus] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
+  const [usernameTaken, setUsernameTaken] = useState(false);
+
+  // ask once typing pauses; signup still reports a name taken in the meantime
+  useEffect(() => {
+    setUsernameTaken(false);
+    if (!form.username) return;
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      apiUsernameAvailable(form.username)
+        .then((available) => {
+          if (!cancelled) setUsernameTaken(available === false);
+        })
+        .catch(() => {});
+    }, 300);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [form.username]);
 
   async function handleSubmit(e: FormEvent) {
     e.preventDefault();
@@ -315,6 +335,7 @@ function SignupPage() {
             value={form.username}
             onChange={(e) => setForm({ ...form, username: e.target.value })}
           />
+          {usernameTaken && <small>That username is already taken.</small>}
         </label>
         <label>
           Email
@@ -368,15 +389,13 @@ function DashboardPage({ auth }: { auth: AuthState }) {
       setLoading(true);
       setError(null);
       try {
-        const [resv, bal] = await Promise.all([
-          apiLatestReservation(auth.jwt),
-          apiViewBalance(auth.jwt),
-        ]);
-        if (resv.status === 1 && resv.data) {
-          setReservation(resv.data);
-        }
-        if (bal.status === 1) {
-          setBalance(bal.balance);
+        const res = await apiDashboard(auth.jwt);
+        if (res.status === 1 && res.data) {
+          setReservation(res.data.reservation);
+          setBalance(res.data.balance);
+          if (res.unavailable && res.unavailable.length > 0) {
+            setError(`Some details are unavailable: ${res.unavailable.join(", ")}`);
+          }
         }
       } catch {
         setError("Unable to load summary");
@@ -586,9 +605,9 @@ function SettingsPage({
 
   useEffect(() => {
     async function load() {
-      if (!auth.username) return;
+      if (!auth.jwt) return;
       try {
-        const res = await apiGetDriverStatus(auth.username);
+        const res = await apiGetDriverStatus(auth.jwt);
         if (res.driver === 1 || res.driver === 0) {
           const isDriver = res.driver === 1;
           setDriver(isDriver);
@@ -600,7 +619,7 @@ function SettingsPage({
     }
     load();
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [auth.username]);
+  }, [auth.jwt, auth.username]);
 
   async function handleSubmit(e: FormEvent) {
     e.preventDefault();
@@ -67,7 +67,6 @@ export async function apiCreateUser(params: {
     driver: params.driver ? "true" : "false",
     deposit: params.deposit.toString(),
     password: params.password,
-    salt: "frontend-salt",
   });
   const res = await fetch(`${USER_BASE}/create_user`, {
     method: "POST",
@@ -76,17 +75,28 @@ export async function apiCreateUser(params: {
   return (await res.json()) as ApiResponse<unknown>;
 }
 
+export async function apiUsernameAvailable(username: string): Promise<boolean | null> {
+  const res = await fetch(
+    `${USER_BASE}/username_available?username=${encodeURIComponent(username)}`,
+  );
+  const body = (await res.json()) as { status: number; available?: boolean };
+  return body.status === 1 ? body.available ?? null : null;
+}
+
 export type DriverStatusResponse = {
   driver: number | null;
 };
 
+// get_driver_status is internal to the services; the caller's own profile carries the flag
 export async function apiGetDriverStatus(
-  username: string,
+  jwt: string,
 ): Promise<DriverStatusResponse> {
-  const url = new URL(`${USER_BASE}/get_driver_status`, window.location.origin);
-  url.searchParams.set("username", username);
-  const res = await fetch(url.toString().replace(window.location.origin, ""));
-  return (await res.json()) as DriverStatusResponse;
+  const res = await fetch(`${USER_BASE}/view`, {
+    method: "POST",
+    headers: authHeaders(jwt),
+  });
+  const body = (await res.json()) as ApiResponse<{ driver?: number }>;
+  return { driver: body.status === 1 ? body.data?.driver ?? null : null };
 }
 
 export async function apiSetDriverStatus(
@@ -191,4 +201,72 @@ export async function apiLatestReservation(
   return (await res.json()) as ApiResponse<ReservationSummary>;
 }
 
+export type Dashboard = {
+  profile: {
+    username: string;
+    email_address: string;
+    first_name: string;
+    last_name: string;
+    driver: number;
+  };
+  balance: string | null;
+  reservation: ReservationSummary | null;
+};
+
+export type DashboardResponse = ApiResponse<Dashboard> & {
+  // parts that could not be loaded, e.g. ["balance"]
+  unavailable?: string[];
+};
+
+export async function apiDashboard(jwt: string): Promise<DashboardResponse> {
+  const res = await fetch(`${USER_BASE}/dashboard`, {
+    headers: authHeaders(jwt),
+  });
+  return (await res.json()) as DashboardResponse;
+}
 
+export type ReservationHistoryEntry = {
+  order_id: number;
+  listingid: number;
+  role: "driver" | "rider";
+  user: string;
+  rating: string;
+  price: string;
+  ride_date: string;
+  ride_time: string;
+  status: string;
+};
+
+export type ReservationHistoryPage = ApiResponse<ReservationHistoryEntry[]> & {
+  next_cursor?: number | null;
+};
+
+export async function apiReservationHistory(params: {
+  jwt: string;
+  cursor?: number;
+  limit?: number;
+  from_date?: string;
+  to_date?: string;
+  status?: string;
+}): Promise<ReservationHistoryPage> {
+  const url = new URL(`${RES_BASE}/history`, window.location.origin);
+  if (params.cursor !== undefined) {
+    url.searchParams.set("cursor", params.cursor.toString());
+  }
+  if (params.limit !== undefined) {
+    url.searchParams.set("limit", params.limit.toString());
+  }
+  if (params.from_date) {
+    url.searchParams.set("from_date", params.from_date);
+  }
+  if (params.to_date) {
+    url.searchParams.set("to_date", params.to_date);
+  }
+  if (params.status) {
+    url.searchParams.set("status", params.status);
+  }
+  const res = await fetch(url.toString().replace(window.location.origin, ""), {
+    headers: authHeaders(params.jwt),
+  });
+  return (await res.json()) as ReservationHistoryPage;
+}
@@ -0,0 +1,45 @@
+"""
+Gunicorn settings for running one ridedemand service in production.
+
+    SERVICE=users gunicorn -c gunicorn.conf.py
+
+The app is preloaded, and the database schema is created once in the master
+before it forks the workers. Each worker warms up before it accepts requests
+(see api/common/serving.py). On SIGTERM gunicorn stops accepting connections
+and gives in-flight requests GUNICORN_GRACEFUL_TIMEOUT seconds to finish
+before the workers are killed.
+
+Workers are threaded (gthread) by default. Set GUNICORN_WORKER_CLASS=gevent
+(and install gevent) to serve many slow downstream calls per worker with
+greenlets instead.
+"""
+import os
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gevent":
+	# must happen before anything imports socket or ssl, the preloaded app included
+	from gevent import monkey
+	monkey.patch_all()
+
+from api.common import serving  # noqa: E402
+
+SERVICE = os.getenv("SERVICE", "users")
+
+wsgi_app = f"api.{SERVICE}.index:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(2 * (os.cpu_count() or 1) + 1, 8))))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))  # per gthread worker
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))  # per gevent worker
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+accesslog = "-"
+
+
+def on_starting(server):
+	serving.migrate(serving.load_service(SERVICE))
+
+
+def post_fork(server, worker):
+	serving.warmup(serving.load_service(SERVICE))
@@ -0,0 +1,102 @@
+"""
+Back up or restore the four service databases as one set.
+
+Every service copies its databases online (see api/common/backup.py) into
+BACKUP_DIR/<marker>, all at the same time under one shared marker. Each
+waits for the others to pin their snapshots, so the set is one snapshot. This
+script and the services must see the same BACKUP_DIR (compose.yaml mounts a
+shared volume). It needs ADMIN_TOKEN and the services' *_SERVICE_URL.
+
+Examples:
+    python scripts/backup_services.py backup
+    python scripts/backup_services.py backup --every 3600 --keep 24   # scheduled
+    python scripts/backup_services.py list
+    python scripts/backup_services.py restore 20261019T120000Z-3fa2c1
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+	sys.path.insert(0, str(PROJECT_ROOT))
+
+from api.common import backup  # noqa: E402
+from api.common.clients import get_service_base_url  # noqa: E402
+
+SERVICE_URLS = {
+	"users": "USERS_SERVICE_URL",
+	"availability": "AVAILABILITY_SERVICE_URL",
+	"reservations": "RESERVATIONS_SERVICE_URL",
+	"payments": "PAYMENTS_SERVICE_URL",
+}
+# a copy is paced to keep latency flat, so a large database takes a while
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("BACKUP_REQUEST_TIMEOUT_SECONDS", "600"))
+
+
+def call_all(action: str, marker: str, admin_token: str) -> dict:
+	"""POST /api/<service>/<action> to every service at once; service -> error, or None if it succeeded."""
+	def call(service):
+		url = f"{get_service_base_url(SERVICE_URLS[service], default='http://localhost:5000')}/api/{service}/{action}"
+		try:
+			resp = requests.post(url, data={"marker": marker, "services": ",".join(SERVICE_URLS)},
+								 headers={"X-Admin-Token": admin_token},
+								 timeout=REQUEST_TIMEOUT_SECONDS)
+		except requests.RequestException as e:
+			return str(e)
+		return None if resp.status_code == 200 else f"{resp.status_code} {resp.text[:200]}"
+
+	with ThreadPoolExecutor(len(SERVICE_URLS)) as pool:
+		return dict(zip(SERVICE_URLS, pool.map(call, SERVICE_URLS)))
+
+
+def _report(action: str, marker: str, errors: dict) -> bool:
+	for service, error in errors.items():
+		print(f"{action} {marker} {service}: {error or 'ok'}")
+	return not any(errors.values())
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	commands = parser.add_subparsers(dest="command", required=True)
+	backup_parser = commands.add_parser("backup", help="take a backup set")
+	backup_parser.add_argument("--every", type=float, help="keep taking one every this many seconds")
+	backup_parser.add_argument("--keep", type=int, help="then delete all but the newest this many complete sets")
+	commands.add_parser("list", help="list backup sets")
+	restore_parser = commands.add_parser("restore", help="restore every service from a complete set")
+	restore_parser.add_argument("marker")
+	args = parser.parse_args()
+
+	if args.command == "list":
+		for entry in backup.list_sets():
+			print(entry["marker"], "complete" if entry["complete"] else "incomplete: " + ",".join(entry["services"]))
+		return
+
+	admin_token = os.getenv("ADMIN_TOKEN")
+	if not admin_token:
+		sys.exit("ADMIN_TOKEN is not set")
+
+	if args.command == "restore":
+		if not any(entry["marker"] == args.marker and entry["complete"] for entry in backup.list_sets()):
+			sys.exit(f"{args.marker} is not a complete backup set in {backup.BACKUP_DIR}")
+		sys.exit(0 if _report("restore", args.marker, call_all("restore", args.marker, admin_token)) else 1)
+
+	while True:
+		marker = backup.new_marker()
+		ok = _report("backup", marker, call_all("backup", marker, admin_token))
+		if ok and args.keep:
+			for removed in backup.prune(args.keep):
+				print("pruned", removed)
+		if args.every is None:
+			sys.exit(0 if ok else 1)
+		time.sleep(args.every)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,92 @@
+"""
+Measure the cold start of each service: import to first response.
+
+Every run is a fresh Python process, like a new serverless instance. It
+imports the service, points it at a database path that does not exist yet
+(an empty /tmp), and answers one request through the Flask test client. The
+time from the import to that first response is reported per service.
+
+Example:
+    python scripts/bench_cold_start.py --runs 30
+    python scripts/bench_cold_start.py --no-templates --seed-demo   # the old path
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+# a cheap request per service that still has to open (and so create) the database
+FIRST_REQUESTS = {
+	"users": "/api/users/get_driver_status?username=demo",
+	"availability": "/api/availability/get_driver_price?listingid=1",
+	"reservations": "/api/reservations/check_reservation?username1=demo&username2=driver",
+	"payments": "/api/payments/view",
+}
+
+CHILD = r"""
+import importlib, json, os, sys, tempfile, time
+service, path = sys.argv[1], sys.argv[2]
+started = time.perf_counter()
+module = importlib.import_module(f"api.{service}.index")
+imported = time.perf_counter()
+module.db_name = os.path.join(tempfile.mkdtemp(), f"{service}.db")
+module.db_flag = False
+headers = {"Authorization": f"Bearer {os.environ['BENCH_JWT']}"}
+response = module.app.test_client().get(path, headers=headers)
+assert response.status_code == 200, response.status_code
+answered = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "total_ms": (answered - started) * 1000}))
+"""
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(service: str, runs: int, env: dict) -> dict:
+	samples = []
+	for _ in range(runs):
+		output = subprocess.run([sys.executable, "-c", CHILD, service, FIRST_REQUESTS[service]],
+								cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True, timeout=60)
+		samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+	totals = [sample["total_ms"] for sample in samples]
+	return {
+		"import_p50_ms": statistics.median(sample["import_ms"] for sample in samples),
+		"total_p50_ms": statistics.median(totals),
+		"total_p99_ms": _percentile(totals, 0.99),
+	}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--runs", type=int, default=20, help="cold starts per service")
+	parser.add_argument("--services", default=",".join(FIRST_REQUESTS), help="comma separated services")
+	parser.add_argument("--no-templates", action="store_true", help="create databases from the .sql scripts")
+	parser.add_argument("--seed-demo", action="store_true", help="seed the demo account (SEED_DEMO_DATA=true)")
+	args = parser.parse_args()
+
+	env = dict(os.environ, PYTHONPATH=str(PROJECT_ROOT))
+	env.setdefault("JWT_SECRET", "cold-start-benchmark-secret-key!")
+	env["DB_TEMPLATES"] = "false" if args.no_templates else "true"
+	env["SEED_DEMO_DATA"] = "true" if args.seed_demo else "false"
+	sys.path.insert(0, str(PROJECT_ROOT))
+	os.environ["JWT_SECRET"] = env["JWT_SECRET"]
+	from api.common.auth import generate_jwt
+	env["BENCH_JWT"] = generate_jwt("demo")
+
+	print(f"{'service':<14}{'import p50':>12}{'first response p50':>20}{'p99':>10}")
+	for service in args.services.split(","):
+		result = measure(service, args.runs, env)
+		print(f"{service:<14}{result['import_p50_ms']:>10.1f}ms{result['total_p50_ms']:>18.1f}ms"
+			  f"{result['total_p99_ms']:>8.1f}ms")
+
+
+if __name__ == "__main__":
+	main()
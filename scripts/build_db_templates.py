@@ -0,0 +1,37 @@
+"""
+Rebuild the prebuilt SQLite schema templates of the services.
+
+Each service copies api/<service>/<service>.template.db into /tmp instead of
+running its .sql script when it creates its database (see
+api/common/schema.py). Run this after changing a .sql file and commit the
+templates with it.
+
+Example:
+    python scripts/build_db_templates.py
+"""
+
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+	sys.path.insert(0, str(PROJECT_ROOT))
+
+from api.common.schema import build_template  # noqa: E402
+
+SQL_FILES = [
+	"api/users/users.sql",
+	"api/availability/availability.sql",
+	"api/reservations/reservations.sql",
+	"api/payments/payments.sql",
+]
+
+
+def main() -> None:
+	for sql_file in SQL_FILES:
+		template = build_template(str(PROJECT_ROOT / sql_file))
+		print(f"built {Path(template).relative_to(PROJECT_ROOT)}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,292 @@
+"""
+Synthetic dataset generator for scale testing the ridedemand microservices.
+
+Fills the users, availability, reservations and payments SQLite databases with
+consistent data at a configurable scale, so production-sized query plans can
+be reproduced locally. Every table is created from the service's own schema
+file; CREATE INDEX statements are deferred until after the bulk load, and rows
+are written with `executemany` inside large transactions.
+
+Cross-database invariants:
+- every user has a current password row, and a payments account opened with
+  one deposit from the external contra account, already snapshotted;
+- listings and reservations only ever name drivers as the driver;
+- reservation riders are never drivers, and a reserved listing no longer
+  appears in `listings` (mirroring what `reserve()` does);
+- a driver's listings never overlap: each driver gets at most one hourly
+  slot between 05:00 and 22:00 per listing on a given day;
+- rating events only come from riders rating a driver they rode with, and
+  users.rating_sum / rating_count are the aggregates of those events.
+
+Every generated user can log in with the password "Password123".
+
+Example:
+    python scripts/generate_dataset.py --users 1000000 --days 730 --listings-per-day 5000
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterator
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+PASSWORD = "Password123"
+# hourly listing slots per driver and day, starting at 05:00
+SLOTS_PER_DAY = 18
+# payments contra account that deposits come from, created by payments.sql
+EXTERNAL_ACCOUNT = "__external__"
+
+# service name -> (schema file, database file name used by the service)
+DATABASES = {
+	"users": ("api/users/users.sql", "user.db"),
+	"availability": ("api/availability/availability.sql", "availability.db"),
+	"reservations": ("api/reservations/reservations.sql", "reservations.db"),
+	"payments": ("api/payments/payments.sql", "payments.db"),
+}
+
+_INDEX_STATEMENT = re.compile(r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\b", re.IGNORECASE)
+_PRAGMA_STATEMENT = re.compile(r"^\s*PRAGMA\b", re.IGNORECASE)
+
+
+@dataclass
+class DatasetConfig:
+	users: int = 10000
+	driver_ratio: float = 0.25
+	days: int = 365
+	start_date: date = date(2026, 1, 1)
+	listings_per_day: int = 100
+	reserved_fraction: float = 0.3
+	rated_fraction: float = 0.5
+	max_balance_cents: int = 50000
+	batch_size: int = 50000
+	seed: int = 1
+
+
+def username_for(i: int) -> str:
+	return f"user{i:07d}"
+
+
+def split_schema(sql: str) -> tuple[list[str], list[str]]:
+	"""Split a schema script into (table statements, deferred index and PRAGMA statements)."""
+	statements, deferred = [], []
+	pending = ""
+	for line in sql.splitlines(keepends=True):
+		pending += line
+		if sqlite3.complete_statement(pending):
+			is_deferred = _INDEX_STATEMENT.match(pending) or _PRAGMA_STATEMENT.match(pending)
+			target = deferred if is_deferred else statements
+			target.append(pending.strip())
+			pending = ""
+	if pending.strip():
+		statements.append(pending.strip())
+	return statements, deferred
+
+
+def open_database(path: Path, sql_file: str) -> tuple[sqlite3.Connection, list[str]]:
+	"""Create a fresh database from its schema, returning the deferred index DDL."""
+	if path.exists():
+		path.unlink()
+	with open(PROJECT_ROOT / sql_file, 'r') as sql_startup:
+		statements, deferred = split_schema(sql_startup.read())
+	conn = sqlite3.connect(path, isolation_level=None)
+	conn.execute("PRAGMA journal_mode = OFF;")
+	conn.execute("PRAGMA synchronous = OFF;")
+	conn.executescript("\n".join(statements))
+	return conn, deferred
+
+
+def finish_database(conn: sqlite3.Connection, deferred: list[str]) -> None:
+	"""Build the deferred indexes, refresh planner statistics, apply the schema's PRAGMAs and close."""
+	pragmas = [statement for statement in deferred if _PRAGMA_STATEMENT.match(statement)]
+	for statement in deferred:
+		if statement not in pragmas:
+			conn.execute(statement)
+	conn.execute("ANALYZE;")
+	conn.execute("PRAGMA journal_mode = DELETE;")
+	for statement in pragmas:  # e.g. the schema's journal mode, which the bulk load turned off
+		conn.execute(statement)
+	conn.close()
+
+
+def bulk_insert(conn: sqlite3.Connection, sql: str, rows: Iterator[tuple], batch_size: int) -> int:
+	"""Insert rows with executemany, committing one transaction per batch."""
+	count = 0
+	batch = []
+	for row in rows:
+		batch.append(row)
+		if len(batch) >= batch_size:
+			count += _flush(conn, sql, batch)
+	if batch:
+		count += _flush(conn, sql, batch)
+	return count
+
+
+def _flush(conn: sqlite3.Connection, sql: str, batch: list[tuple]) -> int:
+	conn.execute("BEGIN;")
+	conn.executemany(sql, batch)
+	conn.execute("COMMIT;")
+	size = len(batch)
+	batch.clear()
+	return size
+
+
+def generate(out_dir: Path, config: DatasetConfig) -> dict[str, int]:
+	"""Generate all four databases into `out_dir` and return row counts per table."""
+	out_dir.mkdir(parents=True, exist_ok=True)
+	rng = random.Random(config.seed)
+	is_driver = [rng.random() < config.driver_ratio for _ in range(config.users)]
+	drivers = [i for i, flag in enumerate(is_driver) if flag]
+	riders = [i for i, flag in enumerate(is_driver) if not flag]
+	if not drivers or not riders:
+		raise ValueError("dataset needs at least one driver and one rider")
+	if config.listings_per_day > len(drivers) * SLOTS_PER_DAY:
+		raise ValueError("not enough drivers for listings-per-day without overlapping listings")
+	counts = {}
+
+	# users and passwords; rating aggregates are filled in from the events below
+	users_conn, users_deferred = open_database(
+		out_dir / DATABASES["users"][1], DATABASES["users"][0])
+	def user_rows():
+		for i in range(config.users):
+			yield (f"{username_for(i)}@example.com", "First", "Last", username_for(i),
+				   f"salt{i}", 0, 0, int(is_driver[i]))
+	def password_rows():
+		for i in range(config.users):
+			password_hash = hashlib.sha256((PASSWORD + f"salt{i}").encode("utf-8")).hexdigest()
+			yield (f"{username_for(i)}@example.com", password_hash, 1)
+	counts["users"] = bulk_insert(
+		users_conn, "INSERT INTO users VALUES(?,?,?,?,?,?,?,?);", user_rows(), config.batch_size)
+	counts["passwords"] = bulk_insert(
+		users_conn, "INSERT INTO passwords VALUES(?,?,?);", password_rows(), config.batch_size)
+
+	# payments: one account per user, opened with a deposit transaction
+	conn, deferred = open_database(out_dir / DATABASES["payments"][1], DATABASES["payments"][0])
+	def deposit_rows():
+		for i in range(config.users):
+			amount = rng.randint(0, config.max_balance_cents)
+			txn_id = 2 * i + 1
+			yield (txn_id, txn_id, EXTERNAL_ACCOUNT, username_for(i), -amount, "deposit")
+			yield (txn_id + 1, txn_id, username_for(i), EXTERNAL_ACCOUNT, amount, "deposit")
+	counts["accounts"] = bulk_insert(
+		conn, "INSERT INTO accounts (username) VALUES (?);",
+		((username_for(i),) for i in range(config.users)), config.batch_size)
+	counts["ledger"] = bulk_insert(
+		conn, """
+		INSERT INTO ledger (posting_id, txn_id, username, counterparty, amount, kind)
+		VALUES (?,?,?,?,?,?);
+		""", deposit_rows(), config.batch_size)
+	conn.execute("""
+		INSERT INTO balance_snapshots (username, balance, posting_id)
+		SELECT username, sum(amount), max(posting_id) FROM ledger GROUP BY username;
+		""")
+	conn.commit()
+	finish_database(conn, deferred)
+
+	# listings, split between open listings and reservations that claimed them
+	avail_conn, avail_deferred = open_database(
+		out_dir / DATABASES["availability"][1], DATABASES["availability"][0])
+	res_conn, res_deferred = open_database(
+		out_dir / DATABASES["reservations"][1], DATABASES["reservations"][0])
+	listing_sql = """
+		INSERT INTO listings (listing_id, username, ride_date, ride_time, price)
+		VALUES (?,?,?,?,?);
+		"""
+	reservation_sql = """
+		INSERT INTO reservations (
+			listing_id, driver_username, rider_username, ride_date, ride_time, price, status
+		) VALUES (?,?,?,?,?,?,?);
+		"""
+	# a rider rates each driver at most once, so repeat pairs are ignored
+	rating_sql = """
+		INSERT OR IGNORE INTO ratings (rater_email, rated_email, rating) VALUES (?,?,?);
+		"""
+	listings, claimed, ratings = [], [], []
+	counts["listings"] = counts["reservations"] = counts["ratings"] = 0
+	listing_id = 0
+	for day in range(config.days):
+		ride_date = (config.start_date + timedelta(days=day)).isoformat()
+		first_driver = rng.randrange(len(drivers))
+		for n in range(config.listings_per_day):
+			listing_id += 1
+			slot, position = divmod(first_driver + n, len(drivers))
+			driver = username_for(drivers[position])
+			ride_time = f"{5 + slot % SLOTS_PER_DAY:02d}:00"
+			price_cents = rng.randint(500, 6000)
+			if rng.random() < config.reserved_fraction:
+				rider = username_for(rng.choice(riders))
+				claimed.append((listing_id, driver, rider, ride_date, ride_time, price_cents, "CONFIRMED"))
+				if len(claimed) >= config.batch_size:
+					counts["reservations"] += _flush(res_conn, reservation_sql, claimed)
+				if rng.random() < config.rated_fraction:
+					ratings.append((f"{rider}@example.com", f"{driver}@example.com", rng.randint(2, 5)))
+					if len(ratings) >= config.batch_size:
+						_flush(users_conn, rating_sql, ratings)
+			else:
+				listings.append((listing_id, driver, ride_date, ride_time, price_cents))
+				if len(listings) >= config.batch_size:
+					counts["listings"] += _flush(avail_conn, listing_sql, listings)
+	if listings:
+		counts["listings"] += _flush(avail_conn, listing_sql, listings)
+	if claimed:
+		counts["reservations"] += _flush(res_conn, reservation_sql, claimed)
+	if ratings:
+		_flush(users_conn, rating_sql, ratings)
+	finish_database(avail_conn, avail_deferred)
+	finish_database(res_conn, res_deferred)
+
+	users_conn.execute("""
+		UPDATE users SET rating_sum = agg.rating_sum, rating_count = agg.rating_count
+		FROM (
+			SELECT rated_email, sum(rating) AS rating_sum, count(*) AS rating_count
+			FROM ratings GROUP BY rated_email
+		) AS agg
+		WHERE users.email_address = agg.rated_email;
+		""")
+	counts["ratings"] = users_conn.execute("SELECT count(*) FROM ratings;").fetchone()[0]
+	finish_database(users_conn, users_deferred)
+	return counts
+
+
+def main() -> None:
+	defaults = DatasetConfig()
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--out-dir", type=Path, default=Path(os.getenv("DATASET_DIR", "/tmp")),
+						help="directory for the .db files (default: /tmp, where the services look)")
+	parser.add_argument("--users", type=int, default=defaults.users)
+	parser.add_argument("--driver-ratio", type=float, default=defaults.driver_ratio)
+	parser.add_argument("--days", type=int, default=defaults.days)
+	parser.add_argument("--start-date", type=date.fromisoformat, default=defaults.start_date)
+	parser.add_argument("--listings-per-day", type=int, default=defaults.listings_per_day)
+	parser.add_argument("--reserved-fraction", type=float, default=defaults.reserved_fraction)
+	parser.add_argument("--rated-fraction", type=float, default=defaults.rated_fraction)
+	parser.add_argument("--batch-size", type=int, default=defaults.batch_size)
+	parser.add_argument("--seed", type=int, default=defaults.seed)
+	args = parser.parse_args()
+
+	config = DatasetConfig(
+		users=args.users,
+		driver_ratio=args.driver_ratio,
+		days=args.days,
+		start_date=args.start_date,
+		listings_per_day=args.listings_per_day,
+		reserved_fraction=args.reserved_fraction,
+		rated_fraction=args.rated_fraction,
+		batch_size=args.batch_size,
+		seed=args.seed,
+	)
+	started = time.perf_counter()
+	counts = generate(args.out_dir, config)
+	for table, count in counts.items():
+		print(f"{table}: {count} rows")
+	print(f"generated in {time.perf_counter() - started:.1f}s into {args.out_dir}")
+
+
+if __name__ == "__main__":
+	main()
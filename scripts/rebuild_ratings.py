@@ -0,0 +1,75 @@
+"""
+Rebuild every user's rating aggregates from the `ratings` event table.
+
+`rate()` keeps users.rating_sum and users.rating_count up to date with atomic
+increments; this batch job recomputes them from the event table, e.g. after
+a bug, a manual data fix or a restore. Events are streamed in chunks and
+reduced with NumPy bincount group-bys keyed by the users rowid, so millions of
+events take seconds. The whole rebuild runs in one BEGIN IMMEDIATE
+transaction, so concurrent ratings wait rather than being lost.
+
+Requires numpy.
+
+Example:
+    python scripts/rebuild_ratings.py --db /tmp/user.db
+"""
+
+import argparse
+import sqlite3
+import time
+
+import numpy as np
+
+CHUNK_ROWS = 500000
+
+
+def rebuild_rating_aggregates(conn: sqlite3.Connection) -> int:
+	"""Recompute rating_sum and rating_count for all users and return the number of users."""
+	curr = conn.cursor()
+	curr.execute("BEGIN IMMEDIATE;")
+	try:
+		curr.execute("SELECT coalesce(max(rowid), 0) FROM users;")
+		size = curr.fetchone()[0] + 1
+		sums = np.zeros(size, dtype=np.int64)
+		counts = np.zeros(size, dtype=np.int64)
+
+		curr.execute("""
+			SELECT users.rowid, ratings.rating FROM ratings
+			JOIN users ON users.email_address = ratings.rated_email;
+			""")
+		while True:
+			rows = curr.fetchmany(CHUNK_ROWS)
+			if not rows:
+				break
+			events = np.array(rows, dtype=np.int64)
+			sums += np.bincount(events[:, 0], weights=events[:, 1], minlength=size).astype(np.int64)
+			counts += np.bincount(events[:, 0], minlength=size)
+
+		curr.execute("SELECT rowid FROM users;")
+		rowids = np.array([row[0] for row in curr.fetchall()], dtype=np.int64)
+		curr.executemany("""
+			UPDATE users SET rating_sum = ?, rating_count = ? WHERE rowid = ?;
+			""", zip(sums[rowids].tolist(), counts[rowids].tolist(), rowids.tolist()))
+		conn.commit()
+	except Exception:
+		conn.rollback()
+		raise
+	return len(rowids)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--db", default="/tmp/user.db", help="users service database")
+	args = parser.parse_args()
+
+	started = time.perf_counter()
+	conn = sqlite3.connect(args.db)
+	try:
+		users = rebuild_rating_aggregates(conn)
+	finally:
+		conn.close()
+	print(f"rebuilt rating aggregates for {users} users in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+	main()
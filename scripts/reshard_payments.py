@@ -0,0 +1,141 @@
+"""
+Offline resharding of the payments databases.
+
+The payments service spreads accounts over PAYMENTS_SHARDS SQLite files by
+crc32(username) % shards. This script rewrites the files for a new shard
+count: every account and its postings move to their new shard (postings of
+the __external__ contra account follow the other leg), balances are
+snapshotted afresh, and per-account balances are checked against the old
+files before the new ones replace them.
+
+Stop the payments service first, and restart it with the new PAYMENTS_SHARDS.
+
+Example:
+    python scripts/reshard_payments.py --db /tmp/payments.db --from 1 --to 4
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SCHEMA = PROJECT_ROOT / "api/payments/payments.sql"
+EXTERNAL_ACCOUNT = "__external__"
+BATCH_ROWS = 50000
+
+
+def shard_for(username: str, shards: int) -> int:
+	"""Twin of api.payments.index.shard_for."""
+	return zlib.crc32(username.encode("utf-8")) % shards
+
+
+def shard_path(db: str, shard: int, shards: int) -> str:
+	"""Twin of api.payments.index.shard_path."""
+	if shards == 1:
+		return db
+	root, ext = os.path.splitext(db)
+	return f"{root}.{shard}{ext}"
+
+
+def _balances(paths: list[str]) -> Counter:
+	balances = Counter()
+	for path in paths:
+		conn = sqlite3.connect(path)
+		for username, balance in conn.execute("SELECT username, sum(amount) FROM ledger GROUP BY username;"):
+			balances[username] += balance
+		conn.close()
+	return balances
+
+
+def reshard(db: str, old_shards: int, new_shards: int) -> dict[str, int]:
+	"""Rewrite the shards of db from old_shards to new_shards files and return row counts."""
+	old_paths = [shard_path(db, shard, old_shards) for shard in range(old_shards)]
+	new_paths = [shard_path(db, shard, new_shards) for shard in range(new_shards)]
+	staged = [path + ".resharding" for path in new_paths]
+
+	schema = SCHEMA.read_text()
+	targets = []
+	for path in staged:
+		if os.path.exists(path):
+			os.remove(path)
+		conn = sqlite3.connect(path)
+		conn.execute("PRAGMA journal_mode = OFF;")
+		conn.execute("PRAGMA synchronous = OFF;")
+		conn.executescript(schema)
+		targets.append(conn)
+
+	counts = Counter()
+	for path in old_paths:
+		source = sqlite3.connect(path)
+		for (username, created_at) in source.execute(
+				"SELECT username, created_at FROM accounts WHERE username != ?;", (EXTERNAL_ACCOUNT,)):
+			targets[shard_for(username, new_shards)].execute(
+				"INSERT INTO accounts (username, created_at) VALUES (?,?);", (username, created_at))
+			counts["accounts"] += 1
+
+		# postings keep their order per account, and their txn_id
+		rows = source.execute("""
+			SELECT txn_id, username, counterparty, amount, kind, created_at FROM ledger
+			ORDER BY posting_id;
+			""")
+		while True:
+			batch = rows.fetchmany(BATCH_ROWS)
+			if not batch:
+				break
+			by_shard = [[] for _ in range(new_shards)]
+			for row in batch:
+				owner = row[2] if row[1] == EXTERNAL_ACCOUNT else row[1]
+				by_shard[shard_for(owner, new_shards)].append(row)
+			for target, shard_rows in zip(targets, by_shard):
+				target.executemany("""
+					INSERT INTO ledger (txn_id, username, counterparty, amount, kind, created_at)
+					VALUES (?,?,?,?,?,?);
+					""", shard_rows)
+			counts["ledger"] += len(batch)
+		source.close()
+
+	for target in targets:
+		target.execute("""
+			INSERT INTO balance_snapshots (username, balance, posting_id)
+			SELECT username, sum(amount), max(posting_id) FROM ledger GROUP BY username;
+			""")
+		target.commit()
+		target.execute("PRAGMA journal_mode = DELETE;")
+		target.close()
+
+	before = _balances(old_paths)
+	after = _balances(staged)
+	before.pop(EXTERNAL_ACCOUNT, None)
+	after.pop(EXTERNAL_ACCOUNT, None)
+	if before != after:  # Counter equality treats missing accounts as 0
+		for path in staged:
+			os.remove(path)
+		raise RuntimeError("balances differ after resharding; old shards left untouched")
+
+	for path in old_paths:
+		if path not in new_paths:
+			os.remove(path)
+	for path, new_path in zip(staged, new_paths):
+		os.replace(path, new_path)
+	return dict(counts)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--db", default="/tmp/payments.db", help="payments db_name the service uses")
+	parser.add_argument("--from", dest="old_shards", type=int, required=True, help="current PAYMENTS_SHARDS")
+	parser.add_argument("--to", dest="new_shards", type=int, required=True, help="new PAYMENTS_SHARDS")
+	args = parser.parse_args()
+
+	started = time.perf_counter()
+	counts = reshard(args.db, args.old_shards, args.new_shards)
+	print(f"moved {counts.get('accounts', 0)} accounts and {counts.get('ledger', 0)} postings "
+		  f"onto {args.new_shards} shards in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+	main()
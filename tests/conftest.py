@@ -0,0 +1,65 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Ensure project root is on the path so the `api` package can be imported when
+# tests are run from different working directories.
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+	sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class FakeResponse:
+	"""Stands in for a requests.Response in tests that patch clients.requests."""
+
+	def __init__(self, data, status_code=200):
+		self._data = data
+		self.status_code = status_code
+
+	def json(self):
+		return self._data
+
+
+@pytest.fixture(autouse=True)
+def project_cwd(monkeypatch):
+	"""Services open their schema files relative to the project root."""
+	monkeypatch.chdir(PROJECT_ROOT)
+	monkeypatch.setenv("JWT_SECRET", os.getenv("JWT_SECRET", "test-secret-key-for-the-test-suite"))
+
+
+# TEST_STORAGE=file runs the suite against files in tmp_path instead
+TEST_STORAGE = os.getenv("TEST_STORAGE", "memory")
+
+
+@pytest.fixture
+def db_location(request):
+	"""Return a helper naming a fresh database for this test, in memory unless TEST_STORAGE=file."""
+	from api.common import storage
+
+	def _location(filename):
+		if TEST_STORAGE == "file":
+			return str(request.getfixturevalue("tmp_path") / filename)
+		return storage.memory_location(f"{request.node.nodeid}/{filename}")
+	return _location
+
+
+@pytest.fixture
+def use_database(monkeypatch):
+	"""Return a helper that points a service module at an initialized SQLite file."""
+	def _use(module, path):
+		monkeypatch.setattr(module, "db_name", str(path))
+		monkeypatch.setattr(module, "db_flag", True)
+		if hasattr(module, "reset_caches"):
+			module.reset_caches()
+	return _use
+
+
+@pytest.fixture(autouse=True)
+def fresh_shared_state():
+	"""Rate-limit buckets, circuit breakers and in-memory databases are process-wide; start every test afresh."""
+	from api.common import clients, ratelimit, storage
+	ratelimit.reset()
+	clients.reset()
+	storage.reset()
@@ -8,7 +8,10 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
 	sys.path.insert(0, str(PROJECT_ROOT))
 
-from common.auth import generate_jwt, get_username_from_jwt, is_valid_jwt
+import time
+
+from api.common.auth import (IDENTITY_HEADER, decode_jwt, generate_jwt, get_username_from_jwt,
+							 identity_from_request, sign_identity)
 
 
 def test_generate_and_validate_jwt_round_trip(monkeypatch):
@@ -18,8 +21,8 @@ def test_generate_and_validate_jwt_round_trip(monkeypatch):
 
 	token = generate_jwt(username)
 
-	assert is_valid_jwt(token)
-	assert is_valid_jwt(token, login_username=username)
+	assert decode_jwt(token) is not None
+	assert decode_jwt(token, expected_username=username) is not None
 	assert get_username_from_jwt(token) == username
 
 
@@ -34,6 +37,25 @@ def test_invalid_jwt_fails_validation(monkeypatch):
 	tampered = f"{header}.{payload}.deadbeef"
 
 	# Signature should no longer validate
-	assert not is_valid_jwt(tampered)
+	assert decode_jwt(tampered) is None
 
 
+def test_identity_header_is_trusted_only_when_signed_and_fresh(monkeypatch):
+	"""Gateway-signed identities replace the JWT; forged or expired ones are refused."""
+	monkeypatch.setenv("JWT_SECRET", "test-secret-key")
+	expires = int(time.time()) + 60
+	signed = sign_identity("carol.smith", expires)
+
+	assert identity_from_request({IDENTITY_HEADER: signed}) == {"sub": "carol.smith", "exp": expires}
+	assert identity_from_request({IDENTITY_HEADER: signed}, expected_username="carol.smith") is not None
+	assert identity_from_request({IDENTITY_HEADER: signed}, expected_username="dave") is None
+
+	forged = signed.replace("carol.smith", "dave")
+	assert identity_from_request({IDENTITY_HEADER: forged}) is None
+	assert identity_from_request({IDENTITY_HEADER: sign_identity("carol", int(time.time()) - 1)}) is None
+	assert identity_from_request({IDENTITY_HEADER: "garbage"}) is None
+
+	# a valid token does not rescue a bad identity header
+	headers = {"Authorization": f"Bearer {generate_jwt('dave')}"}
+	assert identity_from_request(headers)["sub"] == "dave"
+	assert identity_from_request({**headers, IDENTITY_HEADER: forged}) is None
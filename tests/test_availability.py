@@ -0,0 +1,165 @@
+import json
+
+import pytest
+
+from api.availability import index as availability
+from api.common import clients, storage
+from api.common.auth import generate_jwt
+from conftest import FakeResponse
+
+
+@pytest.fixture
+def client(db_location, monkeypatch):
+	"""Availability test client backed by a fresh database, with every user a driver."""
+	monkeypatch.setattr(availability, "db_name", db_location("availability.db"))
+	monkeypatch.setattr(availability, "db_flag", False)
+	monkeypatch.setattr(clients.requests, "get",
+						lambda *args, **kwargs: FakeResponse({"driver": 1, "avg": "4.50"}))
+	return availability.app.test_client()
+
+
+def _auth(username="driver1"):
+	return {"Authorization": f"Bearer {generate_jwt(username)}"}
+
+
+def test_bulk_listing_accepts_json_array_and_reports_conflicts(client):
+	"""Rows are inserted together; duplicate and existing ids come back as conflicts."""
+	client.post("/api/availability/listing", headers=_auth(), data={
+		"ride_date": "2026-11-02", "ride_time": "08:00", "price": "12.50", "listingid": "1"})
+
+	rows = [
+		{"listingid": 1, "ride_date": "2026-11-03", "ride_time": "08:00", "price": 12.5},
+		{"listingid": 2, "ride_date": "2026-11-03", "ride_time": "08:00", "price": 12.5},
+		{"listingid": 2, "ride_date": "2026-11-04", "ride_time": "08:00", "price": 12.5},
+		{"listingid": 3, "ride_date": "not-a-date", "ride_time": "08:00", "price": 12.5},
+	]
+	resp = json.loads(client.post("/api/availability/bulk_listing", headers=_auth(), json=rows).data)
+
+	assert resp["status"] == 1
+	assert resp["inserted"] == 1
+	assert [(row["listingid"], row["status"], row.get("error")) for row in resp["data"]] == [
+		(1, 2, "CONFLICT"), (2, 1, None), (2, 2, "CONFLICT"), (3, 2, "INVALID_INPUT")]
+
+	conn = storage.connect(availability.db_name)
+	stored = conn.execute("SELECT listing_id, price FROM listings ORDER BY listing_id;").fetchall()
+	conn.close()
+	assert stored == [(1, 1250), (2, 1250)]
+
+
+def test_bulk_listing_accepts_ndjson_stream(client):
+	body = "\n".join(json.dumps({"listingid": i, "ride_date": "2026-11-03",
+								 "ride_time": f"{i:02d}:00", "price": "9.99"}) for i in range(1, 6))
+	resp = json.loads(client.post("/api/availability/bulk_listing", headers=_auth(), data=body,
+								  content_type="application/x-ndjson").data)
+
+	assert resp["status"] == 1
+	assert resp["inserted"] == 5
+
+
+def test_bulk_listing_rejects_non_drivers(client, monkeypatch):
+	monkeypatch.setattr(clients.requests, "get",
+						lambda *args, **kwargs: FakeResponse({"driver": 0}))
+	resp = json.loads(client.post("/api/availability/bulk_listing", headers=_auth(), json=[]).data)
+
+	assert resp == {"status": 2, "error": "NOT_DRIVER", "data": []}
+
+
+def test_listing_rule_expands_at_search_time_and_claims_instances(client):
+	"""A weekday rule shows up on matching dates only, until its instance is claimed."""
+	resp = json.loads(client.post("/api/availability/listing_rule", headers=_auth(), data={
+		"weekdays": "weekdays", "ride_time": "08:00", "price": "12.50",
+		"start_date": "2026-11-01", "end_date": "2026-12-31"}).data)
+	assert resp["status"] == 1
+
+	monday = json.loads(client.get("/api/availability/search?ride_date=2026-11-02",
+								   headers=_auth("rider1")).data)["data"]
+	saturday = json.loads(client.get("/api/availability/search?ride_date=2026-11-07",
+									 headers=_auth("rider1")).data)["data"]
+	assert saturday == []
+	assert len(monday) == 1
+	assert monday[0]["price"] == "12.50"
+	listing_id = monday[0]["listingid"]
+	assert listing_id < 0
+
+	price = json.loads(client.get(f"/api/availability/get_driver_price?listingid={listing_id}").data)
+	assert price["data"] == ["driver1", 1250, "2026-11-02", "08:00"]
+
+	client.post("/api/availability/remove_availability", data={"listingid": listing_id})
+	monday = json.loads(client.get("/api/availability/search?ride_date=2026-11-02",
+								   headers=_auth("rider1")).data)["data"]
+	tuesday = json.loads(client.get("/api/availability/search?ride_date=2026-11-03",
+									headers=_auth("rider1")).data)["data"]
+	assert monday == []
+	assert len(tuesday) == 1
+
+
+def test_overlapping_listings_are_rejected(client):
+	"""Windows clashing with stored listings, rules or rows in the same batch are rejected."""
+	first = json.loads(client.post("/api/availability/listing", headers=_auth(), data={
+		"ride_date": "2026-11-02", "ride_time": "08:00", "price": "10", "listingid": "1"}).data)
+	again = json.loads(client.post("/api/availability/listing", headers=_auth(), data={
+		"ride_date": "2026-11-02", "ride_time": "08:30", "price": "10", "listingid": "2"}).data)
+	other_driver = json.loads(client.post("/api/availability/listing", headers=_auth("driver2"), data={
+		"ride_date": "2026-11-02", "ride_time": "08:30", "price": "10", "listingid": "3"}).data)
+	assert first == {"status": 1}
+	assert again == {"status": 2, "error": "OVERLAP", "conflicts_with": 1}
+	assert other_driver == {"status": 1}
+
+	rows = [
+		{"listingid": 10, "ride_date": "2026-11-02", "ride_time": "09:00", "price": 10},
+		{"listingid": 11, "ride_date": "2026-11-02", "ride_time": "09:30", "price": 10},
+		{"listingid": 12, "ride_date": "2026-11-02", "ride_time": "07:30", "price": 10, "duration": 30},
+	]
+	resp = json.loads(client.post("/api/availability/bulk_listing", headers=_auth(), json=rows).data)
+	assert [(row["listingid"], row["status"], row.get("conflicts_with")) for row in resp["data"]] == [
+		(10, 1, None), (11, 2, 10), (12, 1, None)]
+
+	rule = json.loads(client.post("/api/availability/listing_rule", headers=_auth(), data={
+		"weekdays": "mon", "ride_time": "08:15", "price": "10",
+		"start_date": "2026-10-26", "end_date": "2026-11-30"}).data)
+	assert rule["status"] == 2
+	assert rule["error"] == "OVERLAP"
+
+
+def test_dates_at_the_end_of_the_calendar_are_invalid_input(client):
+	invalid = {"status": 2, "error": "INVALID_INPUT"}
+	listing = json.loads(client.post("/api/availability/listing", headers=_auth(), data={
+		"ride_date": "9999-12-31", "ride_time": "23:30", "price": "10", "listingid": "1"}).data)
+	assert listing == invalid
+	rule = json.loads(client.post("/api/availability/listing_rule", headers=_auth(), data={
+		"weekdays": "daily", "ride_time": "23:30", "price": "10",
+		"start_date": "9999-12-01", "end_date": "9999-12-31"}).data)
+	assert rule == invalid
+	schedule = json.loads(client.get("/api/availability/schedule?from_date=9999-12-25&days=14",
+									 headers=_auth()).data)
+	assert schedule["error"] == "INVALID_INPUT"
+
+
+def test_schedule_lists_upcoming_listings_and_rule_instances(client):
+	client.post("/api/availability/listing", headers=_auth(), data={
+		"ride_date": "2026-11-03", "ride_time": "18:00", "price": "10", "listingid": "1"})
+	client.post("/api/availability/listing_rule", headers=_auth(), data={
+		"weekdays": "mon,tue", "ride_time": "08:00", "price": "12.50",
+		"start_date": "2026-11-01", "end_date": "2026-11-30"})
+
+	resp = json.loads(client.get("/api/availability/schedule?from_date=2026-11-02&days=2",
+								 headers=_auth()).data)
+
+	assert resp["status"] == 1
+	assert [(entry["ride_date"], entry["ride_time"]) for entry in resp["data"]] == [
+		("2026-11-02", "08:00"), ("2026-11-03", "08:00"), ("2026-11-03", "18:00")]
+
+
+def test_search_shows_default_ratings_while_ratings_are_failing(client, monkeypatch):
+	client.post("/api/availability/listing", headers=_auth(), data={
+		"ride_date": "2026-11-02", "ride_time": "08:00", "price": "10", "listingid": "1"})
+
+	def flaky_get(url, **kwargs):
+		if url.endswith("/get_average_rating"):
+			raise ConnectionError("users is overloaded")
+		return FakeResponse({"driver": 1})
+
+	monkeypatch.setattr(clients.requests, "get", flaky_get)
+	resp = json.loads(client.get("/api/availability/search?ride_date=2026-11-02", headers=_auth("rider1")).data)
+	assert resp["status"] == 1
+	assert [row["rating"] for row in resp["data"]] == ["0.00"]
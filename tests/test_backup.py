@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from api.common import backup, clients, storage
+from api.users import index as users
+from conftest import FakeResponse
+
+ADMIN = {"X-Admin-Token": "admin-secret"}
+
+
+@pytest.fixture(autouse=True)
+def backup_dir(tmp_path, monkeypatch):
+	monkeypatch.setattr(backup, "BACKUP_DIR", str(tmp_path / "backups"))
+	monkeypatch.setenv("ADMIN_TOKEN", ADMIN["X-Admin-Token"])
+	return tmp_path / "backups"
+
+
+def _rows(location):
+	conn = storage.connect(location)
+	try:
+		return conn.execute("SELECT count(*) FROM t;").fetchone()[0]
+	finally:
+		conn.close()
+
+
+def test_copy_in_small_steps_falls_back_to_one_step_when_writes_keep_restarting_it(db_location, tmp_path, monkeypatch):
+	location = db_location("busy.db")
+	conn = storage.connect(location)
+	conn.execute("CREATE TABLE t (x BLOB);")
+	conn.executemany("INSERT INTO t VALUES (zeroblob(4000));", [()] * 200)
+	conn.commit()
+	monkeypatch.setattr(backup, "BACKUP_STEP_PAGES", 8)
+
+	def write_between_steps(seconds):
+		# another connection writing while the copy pauses restarts it
+		conn.execute("INSERT INTO t VALUES (zeroblob(4000));")
+		conn.commit()
+
+	monkeypatch.setattr(backup.time, "sleep", write_between_steps)
+	stats = backup.copy_database(location, str(tmp_path / "copy.db"))
+	conn.close()
+
+	assert stats["restarts"] == backup.BACKUP_MAX_RESTARTS + 1
+	copy = sqlite3.connect(tmp_path / "copy.db")
+	assert copy.execute("PRAGMA integrity_check;").fetchone() == ("ok",)
+	assert copy.execute("SELECT count(*) FROM t;").fetchone()[0] == _rows(location)
+	copy.close()
+
+
+def test_copy_of_a_wal_database_is_the_snapshot_it_started_from(tmp_path, monkeypatch):
+	location = str(tmp_path / "wal.db")
+	conn = storage.connect(location)
+	conn.execute("PRAGMA journal_mode = WAL;")
+	conn.execute("CREATE TABLE t (x BLOB);")
+	conn.executemany("INSERT INTO t VALUES (zeroblob(4000));", [()] * 200)
+	conn.commit()
+	monkeypatch.setattr(backup, "BACKUP_STEP_PAGES", 8)
+	writes = []
+
+	def write_between_steps(seconds):
+		conn.execute("INSERT INTO t VALUES (zeroblob(4000));")
+		conn.commit()  # never waits for the copy
+		writes.append(1)
+
+	monkeypatch.setattr(backup.time, "sleep", write_between_steps)
+	stats = backup.copy_database(location, str(tmp_path / "copy.db"))
+	conn.close()
+
+	assert stats["restarts"] == 0 and len(writes) > backup.BACKUP_MAX_RESTARTS
+	copy = sqlite3.connect(tmp_path / "copy.db")
+	assert copy.execute("SELECT count(*) FROM t;").fetchone()[0] == 200
+	copy.close()
+
+
+def test_backup_and_restore_endpoints_round_trip_the_users_database(db_location, monkeypatch):
+	monkeypatch.setattr(users, "db_name", db_location("user.db"))
+	monkeypatch.setattr(users, "db_flag", False)
+	users.reset_caches()
+	monkeypatch.setattr(clients.requests, "post", lambda *args, **kwargs: FakeResponse({"status": 1}))
+	client = users.app.test_client()
+	client.post("/api/users/create_user", data={
+		"first_name": "A", "last_name": "B", "username": "rider1", "email_address": "rider1@example.com",
+		"password": "Secret123x", "driver": "false", "deposit": "0"})
+
+	assert client.post("/api/users/backup", data={"marker": "m1"}).status_code == 403
+	assert client.post("/api/users/backup", data={"marker": "../m1"}, headers=ADMIN).status_code == 400
+	resp = client.post("/api/users/backup", data={"marker": "m1"}, headers=ADMIN)
+	assert resp.status_code == 200
+	assert json.loads(resp.data)["data"]["files"][0]["file"] == "users.0.db"
+
+	conn = users.get_db()
+	conn.execute("UPDATE users SET first_name = 'Changed';")
+	conn.commit()
+	conn.close()
+	assert users.get_user_record("rider1").first_name == "Changed"
+
+	assert client.post("/api/users/restore", data={"marker": "m2"}, headers=ADMIN).status_code == 400
+	assert client.post("/api/users/restore", data={"marker": "m1"}, headers=ADMIN).status_code == 200
+	# the restoring process drops its cached copy of the row
+	assert users.get_user_record("rider1").first_name == "A"
+
+
+def test_sets_are_complete_once_every_service_has_written_its_manifest(db_location):
+	location = db_location("t.db")
+	conn = storage.connect(location)
+	conn.execute("CREATE TABLE t (x INTEGER);")
+	conn.commit()
+	conn.close()
+
+	for marker in ("20260101T000000Z-a", "20260102T000000Z-b", "20260103T000000Z-c"):
+		for service in backup.SERVICES:
+			backup.back_up(service, [location], marker)
+	backup.back_up("users", [location], "20260104T000000Z-d")  # still being taken
+
+	assert [(entry["marker"], entry["complete"]) for entry in backup.list_sets()] == [
+		("20260101T000000Z-a", True), ("20260102T000000Z-b", True),
+		("20260103T000000Z-c", True), ("20260104T000000Z-d", False)]
+	assert backup.prune(2) == ["20260101T000000Z-a"]
+	assert [entry["marker"] for entry in backup.list_sets()][0] == "20260102T000000Z-b"
+
+
+def _wal_database(path):
+	conn = sqlite3.connect(path)
+	conn.execute("PRAGMA journal_mode = WAL;")
+	conn.execute("CREATE TABLE t (x INTEGER);")
+	conn.commit()
+	conn.close()
+	return str(path)
+
+
+def _write(location):
+	conn = storage.connect(location, timeout=0)
+	try:
+		conn.execute("INSERT INTO t VALUES (1);")
+		conn.commit()
+	finally:
+		conn.close()
+
+
+def test_services_backing_up_under_one_marker_hold_writes_until_all_have_pinned(db_location, tmp_path):
+	users_db = _wal_database(tmp_path / "user.db")
+	payments_db = db_location("payments.db")
+	conn = storage.connect(payments_db)
+	conn.execute("CREATE TABLE t (x INTEGER);")
+	conn.commit()
+	conn.close()
+	both = ("users", "payments")
+
+	manifests = []
+	waiting = threading.Thread(target=lambda: manifests.append(backup.back_up("users", [users_db], "m1", both)))
+	waiting.start()
+	time.sleep(0.2)
+	assert waiting.is_alive()  # waits for payments, and holds the users writers meanwhile
+	with pytest.raises(sqlite3.OperationalError, match="locked"):
+		_write(users_db)
+
+	manifests.append(backup.back_up("payments", [payments_db], "m1", both))
+	waiting.join(5)
+	assert sorted(manifest["service"] for manifest in manifests) == ["payments", "users"]
+	assert not any(name.endswith(".pinned") for name in os.listdir(backup._marker_dir("m1")))
+	_write(users_db)
+	_write(payments_db)
+
+
+def test_a_service_that_never_pins_fails_the_backup_and_releases_writes(tmp_path, monkeypatch):
+	monkeypatch.setattr(backup, "BACKUP_BARRIER_SECONDS", 0.05)
+	users_db = _wal_database(tmp_path / "user.db")
+
+	with pytest.raises(backup.BackupError, match="payments"):
+		backup.back_up("users", [users_db], "m1", ("users", "payments"))
+	assert os.listdir(backup._marker_dir("m1")) == []
+	_write(users_db)
+	assert backup.list_sets() == [{"marker": "m1", "services": [], "complete": False}]
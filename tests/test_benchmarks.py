@@ -0,0 +1,212 @@
+"""
+Micro-benchmarks for the helpers that run on every request.
+
+Each benchmark times a helper against SQLite databases seeded with the row
+counts listed in BENCH_ROWS (default "10000"; for example
+BENCH_ROWS=10000,100000,1000000) and fails when the median time per call
+exceeds the threshold stored in benchmark_thresholds.json. Thresholds are in
+microseconds and keyed by row count, with "default" as the fallback.
+
+They are marked `benchmark` and deselected by default (see pytest.ini); run
+them with `pytest -m benchmark` or `make backend-bench`.
+"""
+import json
+import os
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+
+import pytest
+
+from api.availability import index as availability
+from api.common import clients
+from api.common.auth import decode_jwt, extract_token_from_header, generate_jwt
+from api.payments import index as payments
+from api.reservations import index as reservations
+from api.users import index as users
+from scripts.generate_dataset import DATABASES, PASSWORD, DatasetConfig, generate
+
+THRESHOLDS_FILE = Path(__file__).with_name("benchmark_thresholds.json")
+BENCH_ROWS = [int(n) for n in os.getenv("BENCH_ROWS", "10000").split(",") if n]
+
+pytestmark = pytest.mark.benchmark
+
+
+def _median_call_us(fn, rounds=5, min_round_seconds=0.02):
+	"""Return the median time per call of `fn` in microseconds."""
+	iterations = 1
+	while True:
+		start = time.perf_counter()
+		for _ in range(iterations):
+			fn()
+		elapsed = time.perf_counter() - start
+		if elapsed >= min_round_seconds or iterations >= 10000:
+			break
+		iterations *= 2
+
+	samples = [elapsed / iterations]
+	for _ in range(rounds - 1):
+		start = time.perf_counter()
+		for _ in range(iterations):
+			fn()
+		samples.append((time.perf_counter() - start) / iterations)
+	return statistics.median(samples) * 1e6
+
+
+def _assert_within_threshold(name, fn, rows=None):
+	thresholds = json.loads(THRESHOLDS_FILE.read_text())
+	if name not in thresholds:
+		pytest.fail(f"No stored threshold for benchmark {name!r}")
+	limits = thresholds[name]
+	limit = limits.get(str(rows), limits.get("default"))
+	if limit is None:
+		pytest.fail(f"No stored threshold for benchmark {name!r} at {rows} rows")
+
+	measured = _median_call_us(fn)
+	print(f"{name} rows={rows}: {measured:.1f}us (threshold {limit}us)")
+	assert measured <= limit, f"{name} regressed: {measured:.1f}us > {limit}us"
+
+
+def _seed(directory, rows):
+	"""Generate one database per service with roughly `rows` rows in each table."""
+	config = DatasetConfig(users=rows, driver_ratio=0.5, days=365,
+						   listings_per_day=max(rows * 2 // 365, 1), reserved_fraction=0.5)
+	generate(directory, config)
+	paths = {name: str(directory / file_name) for name, (_sql, file_name) in DATABASES.items()}
+
+	conn = sqlite3.connect(paths["reservations"])
+	driver, rider = conn.execute(
+		"SELECT driver_username, rider_username FROM reservations LIMIT 1;").fetchone()
+	conn.close()
+	conn = sqlite3.connect(paths["availability"])
+	listing_id = conn.execute(
+		"SELECT listing_id FROM listings ORDER BY listing_id LIMIT 1 OFFSET ?;",
+		(rows // 4,)).fetchone()[0]
+	conn.close()
+	conn = sqlite3.connect(paths["users"])
+	other_rider = conn.execute(
+		"SELECT username FROM users WHERE driver = 0 AND username != ? LIMIT 1;",
+		(rider,)).fetchone()[0]
+	conn.close()
+	conn = sqlite3.connect(paths["payments"])
+	curr = conn.cursor()
+	payments._post(curr, "deposit", payments.EXTERNAL_ACCOUNT, rider, 10 ** 12)
+	conn.commit()
+	conn.close()
+
+	keys = {"driver": driver, "rider": rider, "other_rider": other_rider, "listing_id": listing_id}
+	return paths, keys
+
+
+@pytest.fixture(scope="session", params=BENCH_ROWS, ids=lambda rows: f"{rows}rows")
+def seeded(request, tmp_path_factory):
+	rows = request.param
+	paths, keys = _seed(tmp_path_factory.mktemp(f"bench{rows}"), rows)
+	return rows, paths, keys
+
+
+@pytest.fixture
+def services(seeded, use_database):
+	rows, paths, keys = seeded
+	use_database(users, paths["users"])
+	use_database(availability, paths["availability"])
+	use_database(reservations, paths["reservations"])
+	use_database(payments, paths["payments"])
+	return rows, keys
+
+
+def test_bench_generate_jwt():
+	_assert_within_threshold("auth.generate_jwt", lambda: generate_jwt("u1"))
+
+
+def test_bench_decode_jwt():
+	token = generate_jwt("u1")
+	_assert_within_threshold("auth.decode_jwt", lambda: decode_jwt(token, expected_username="u1"))
+
+
+def test_bench_extract_token_from_header():
+	header = f"Bearer {generate_jwt('u1')}"
+	_assert_within_threshold("auth.extract_token_from_header",
+							 lambda: extract_token_from_header(header))
+
+
+def test_bench_users_password_correct(services):
+	rows, keys = services
+	_assert_within_threshold("users.password_correct",
+							 lambda: users.password_correct(keys["rider"], PASSWORD), rows)
+
+
+def test_bench_users_create_user(services, monkeypatch):
+	rows, _keys = services
+	monkeypatch.setattr(clients.Dependency, "post", lambda *args, **kwargs: {"status": 1})
+	counter = iter(range(10 ** 9))
+
+	def create():
+		n = next(counter)
+		form = {"first_name": "Bench", "last_name": "Mark", "username": f"new{n}",
+				"email_address": f"new{n}@example.com", "driver": "false",
+				"deposit": "0", "password": "Secret123x"}
+		with users.app.test_request_context("/api/users/create_user", method="POST", data=form):
+			users.create_user()
+
+	_assert_within_threshold("users.create_user", create, rows)
+
+
+@pytest.mark.parametrize("helper, key, suffix", [
+	("get_user_record", "rider", ""),
+	("is_unique_username", "rider", ""),
+	("is_unique_email", "rider", "@example.com"),
+])
+def test_bench_users_helpers(services, helper, key, suffix):
+	rows, keys = services
+	fn = getattr(users, helper)
+	argument = keys[key] + suffix
+	_assert_within_threshold(f"users.{helper}", lambda: fn(argument), rows)
+
+
+@pytest.mark.parametrize("endpoint", ["get_average_rating", "get_driver_status"])
+def test_bench_users_internal_endpoints(services, endpoint):
+	rows, keys = services
+	with users.app.test_request_context(f"/api/users/{endpoint}?username={keys['driver']}"):
+		_assert_within_threshold(f"users.{endpoint}", getattr(users, endpoint), rows)
+
+
+def test_bench_users_top_drivers(services):
+	rows, _ = services
+	with users.app.test_request_context("/api/users/top_drivers?k=20&min_count=1&offset=100"):
+		_assert_within_threshold("users.top_drivers", users.top_drivers, rows)
+
+
+def test_bench_availability_get_driver_price(services):
+	rows, keys = services
+	with availability.app.test_request_context(
+			f"/api/availability/get_driver_price?listingid={keys['listing_id']}"):
+		_assert_within_threshold("availability.get_driver_price",
+								 availability.get_driver_price, rows)
+
+
+@pytest.mark.parametrize("pair, name", [
+	(("driver", "rider"), "reservations.check_reservation_hit"),
+	(("rider", "other_rider"), "reservations.check_reservation_miss"),
+])
+def test_bench_reservations_check_reservation(services, pair, name):
+	rows, keys = services
+	url = (f"/api/reservations/check_reservation"
+		   f"?username1={keys[pair[0]]}&username2={keys[pair[1]]}")
+	with reservations.app.test_request_context(url):
+		_assert_within_threshold(name, reservations.check_reservation, rows)
+
+
+def test_bench_payments_view(services):
+	rows, keys = services
+	headers = {"Authorization": f"Bearer {generate_jwt(keys['rider'])}"}
+	with payments.app.test_request_context("/api/payments/view", headers=headers):
+		_assert_within_threshold("payments.view", payments.view, rows)
+
+
+def test_bench_payments_transfer(services):
+	rows, keys = services
+	form = {"price_cents": "1", "rider_username": keys["rider"], "driver_username": keys["driver"]}
+	with payments.app.test_request_context("/api/payments/transfer", method="POST", data=form):
+		_assert_within_threshold("payments.transfer", payments.transfer, rows)
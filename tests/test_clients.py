@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from api.common import clients
+from conftest import FakeResponse
+
+
+@pytest.fixture
+def users_dependency(monkeypatch):
+	monkeypatch.setenv("USERS_SERVICE_URL", "http://users-1:5000,http://users-2:5000")
+	return clients.dependency("USERS_SERVICE_URL")
+
+
+def test_service_url_lists_replicas_and_keeps_the_first_as_the_base_url(monkeypatch):
+	monkeypatch.setenv("USERS_SERVICE_URL", "http://users-1:5000/, http://users-2:5000")
+	assert clients.get_service_base_urls("USERS_SERVICE_URL") == ["http://users-1:5000", "http://users-2:5000"]
+	assert clients.get_service_base_url("USERS_SERVICE_URL") == "http://users-1:5000"
+	monkeypatch.delenv("USERS_SERVICE_URL")
+	assert clients.get_service_base_url("USERS_SERVICE_URL", default="http://localhost/") == "http://localhost"
+
+
+def test_breaker_opens_after_failures_and_serves_the_fallback_without_calling(users_dependency, monkeypatch):
+	calls = []
+
+	def failing_get(url, **kwargs):
+		calls.append(url)
+		return FakeResponse({}, status_code=503)
+
+	monkeypatch.setattr(clients.requests, "get", failing_get)
+	for _ in range(clients.BREAKER_FAILURE_THRESHOLD):
+		with pytest.raises(clients.DependencyUnavailable):
+			users_dependency.get("/api/users/get_driver_status")
+	assert users_dependency.breaker.state == "open"
+
+	assert users_dependency.get("/api/users/get_average_rating", fallback={"avg": "0.00"}) == {"avg": "0.00"}
+	with pytest.raises(clients.DependencyUnavailable):
+		users_dependency.get("/api/users/get_driver_status")
+	assert len(calls) == clients.BREAKER_FAILURE_THRESHOLD
+
+
+def test_half_open_probe_closes_or_reopens_the_breaker(monkeypatch):
+	now = [100.0]
+	monkeypatch.setattr(clients.time, "monotonic", lambda: now[0])
+	breaker = clients.CircuitBreaker(failure_threshold=2, slow_call_seconds=1.0, reset_seconds=5.0)
+
+	breaker.record(True, 1.5)  # slow calls count as failures
+	breaker.record(False, 0.1)
+	assert breaker.state == "open" and not breaker.allow()
+
+	now[0] += 5.0
+	assert breaker.allow()
+	assert not breaker.allow()  # one probe at a time
+	breaker.record(False, 0.1)
+	assert breaker.state == "open"
+
+	now[0] += 5.0
+	assert breaker.allow()
+	breaker.record(True, 0.1)
+	assert breaker.state == "closed" and breaker.allow()
+
+
+def test_slow_primary_is_hedged_to_the_next_replica(users_dependency, monkeypatch):
+	release = threading.Event()
+	urls = []
+
+	def fake_get(url, **kwargs):
+		urls.append(url)
+		if url.startswith("http://users-1"):
+			release.wait(5)
+			return FakeResponse({"avg": "1.00"})
+		return FakeResponse({"avg": "4.50"})
+
+	monkeypatch.setattr(clients.requests, "get", fake_get)
+	try:
+		data = users_dependency.get("/api/users/get_average_rating", params={"username": "alice"}, hedge=True)
+	finally:
+		release.set()
+	assert data == {"avg": "4.50"}
+	assert urls == ["http://users-1:5000/api/users/get_average_rating",
+					"http://users-2:5000/api/users/get_average_rating"]
+
+
+def test_hedge_delay_follows_recent_p95_latency(users_dependency):
+	assert users_dependency.hedge_delay() == clients.HEDGE_DEFAULT_DELAY_SECONDS
+	users_dependency._latencies.extend([0.01] * 95 + [0.5] * 5)
+	assert users_dependency.hedge_delay() == pytest.approx(0.01)
+	users_dependency._latencies.extend([0.5] * 10)
+	assert users_dependency.hedge_delay() == pytest.approx(0.5)
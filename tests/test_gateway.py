@@ -0,0 +1,113 @@
+import json
+import time
+
+import pytest
+
+from api.common.auth import IDENTITY_HEADER, generate_jwt, identity_from_request, sign_identity
+from api.gateway import index as gateway
+
+
+class _FakeRaw:
+	def __init__(self, body, headers):
+		self._body = body
+		self.headers = headers
+
+	def stream(self, amount, decode_content=True):
+		yield self._body
+
+
+class _FakeUpstream:
+	def __init__(self, body, status_code=200, headers=None):
+		self.status_code = status_code
+		self.raw = _FakeRaw(body, headers or {"Content-Type": "application/json"})
+		self.closed = False
+
+	def close(self):
+		self.closed = True
+
+
+class _FakeSession:
+	def __init__(self):
+		self.calls = []
+		self.responses = []
+
+	def request(self, method, url, **kwargs):
+		self.calls.append((method, url, kwargs))
+		return self.responses.pop(0) if self.responses else _FakeUpstream(b'{"status": 1}')
+
+
+@pytest.fixture
+def session(monkeypatch):
+	monkeypatch.setenv("USERS_SERVICE_URL", "http://users:5000")
+	monkeypatch.setenv("PAYMENTS_SERVICE_URL", "http://payments:5000")
+	fake = _FakeSession()
+	monkeypatch.setattr(gateway, "get_session", lambda: fake)
+	return fake
+
+
+def test_gateway_forwards_by_prefix_with_a_signed_identity(session):
+	client = gateway.app.test_client()
+	forged = sign_identity("mallory", int(time.time()) + 60).replace("mallory", "admin")
+	resp = client.get("/api/payments/view?x=1", headers={
+		"Authorization": f"Bearer {generate_jwt('alice')}", IDENTITY_HEADER: forged})
+
+	assert resp.status_code == 200
+	assert json.loads(resp.data) == {"status": 1}
+	method, url, kwargs = session.calls[0]
+	assert (method, url, kwargs["params"]) == ("GET", "http://payments:5000/api/payments/view", b"x=1")
+	# the client's identity header is replaced by the gateway's own
+	assert identity_from_request(kwargs["headers"])["sub"] == "alice"
+	assert kwargs["headers"]["X-Forwarded-For"] == "127.0.0.1"
+
+
+def test_gateway_sends_no_identity_for_a_bad_token(session):
+	client = gateway.app.test_client()
+	client.post("/api/users/login", data={"username": "alice"},
+				headers={"Authorization": "Bearer not-a-jwt", IDENTITY_HEADER: "1.sig.alice"})
+
+	method, url, kwargs = session.calls[0]
+	assert (method, url) == ("POST", "http://users:5000/api/users/login")
+	assert IDENTITY_HEADER not in kwargs["headers"]
+	assert kwargs["data"] == b"username=alice"
+
+
+def test_gateway_blocks_internal_and_unknown_routes(session):
+	client = gateway.app.test_client()
+	for path in ("/api/payments/transfer", "/api/payments/init_balance", "/api/availability/get_driver_price",
+				 "/api/users/clear/", "/api/users/get_driver_status", "/api/other/thing"):
+		assert client.post(path).status_code == 404
+	assert session.calls == []
+
+
+@pytest.mark.parametrize("path", [
+	"/api/payments/./transfer",
+	"/api/payments/x/../transfer",
+	"/api/payments/transfer%3F",
+	"/api/payments/transfer%23",
+	"/api/payments/transfer%5C",
+	"/api/users/..%2F..%2Fapi/payments/transfer",
+])
+def test_gateway_refuses_paths_upstream_could_read_as_another_route(session, path):
+	assert gateway.app.test_client().post(path).status_code == 400
+	assert session.calls == []
+
+
+def test_gateway_checks_and_forwards_the_normalized_quoted_route(session):
+	client = gateway.app.test_client()
+	assert client.post("/api/payments//transfer").status_code == 404
+	assert client.get("/api/users/view/").status_code == 200
+	assert client.get("/api/users/a%20b").status_code == 200
+	assert [url for _, url, _ in session.calls] == [
+		"http://users:5000/api/users/view", "http://users:5000/api/users/a%20b"]
+
+
+def test_gateway_passes_status_and_streams_the_body(session):
+	upstream = _FakeUpstream(b'{"status": 0}', status_code=429, headers={"Retry-After": "2", "Connection": "close"})
+	session.responses.append(upstream)
+	resp = gateway.app.test_client().get("/api/users/view")
+
+	assert resp.status_code == 429
+	assert resp.headers["Retry-After"] == "2"
+	assert resp.headers.get("Connection") != "close"
+	assert resp.data == b'{"status": 0}'
+	assert upstream.closed
@@ -0,0 +1,34 @@
+import hashlib
+
+import pytest
+
+from api.common import passwords
+
+
+def test_tagged_hashes_verify_and_name_their_algorithm():
+	for algorithm in ("scrypt", "pbkdf2_sha256"):
+		stored = passwords.hash_password("Secret123x", "salt", algorithm)
+		assert stored.startswith(f"{algorithm}$")
+		assert passwords.verify_password("Secret123x", "salt", stored)
+		assert not passwords.verify_password("Secret123y", "salt", stored)
+		assert not passwords.verify_password("Secret123x", "pepper", stored)
+
+
+def test_legacy_hashes_verify_and_need_rehash(monkeypatch):
+	legacy = hashlib.sha256(b"Secret123xsalt").hexdigest()
+	assert passwords.verify_password("Secret123x", "salt", legacy)
+	assert passwords.needs_rehash(legacy)
+
+	current = passwords.hash_password("Secret123x", "salt")
+	assert not passwords.needs_rehash(current)
+	monkeypatch.setattr(passwords, "SCRYPT_N", 2 * passwords.SCRYPT_N)
+	assert passwords.needs_rehash(current)
+
+
+def test_offload_refuses_work_beyond_the_queue_limit(monkeypatch):
+	monkeypatch.setattr(passwords, "_slots", passwords.threading.BoundedSemaphore(1))
+	assert passwords.offload(lambda x: x + 1, 1) == 2
+
+	passwords._slots.acquire()
+	with pytest.raises(passwords.PasswordHasherBusy):
+		passwords.offload(lambda: None)
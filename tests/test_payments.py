@@ -0,0 +1,199 @@
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api.common.auth import generate_jwt
+from api.common.group_commit import GroupCommitWriter
+from api.payments import index as payments
+
+
+@pytest.fixture
+def client(db_location, monkeypatch):
+	"""Payments test client backed by a fresh database."""
+	monkeypatch.setattr(payments, "db_name", db_location("payments.db"))
+	monkeypatch.setattr(payments, "db_flag", False)
+	return payments.app.test_client()
+
+
+def _auth(username):
+	return {"Authorization": f"Bearer {generate_jwt(username)}"}
+
+
+def _balance(client, username):
+	return json.loads(client.get("/api/payments/view", headers=_auth(username)).data)["balance"]
+
+
+def _transfer(client, rider, driver, price_cents):
+	return json.loads(client.post("/api/payments/transfer", data={
+		"price_cents": str(price_cents), "rider_username": rider, "driver_username": driver}).data)["status"]
+
+
+def test_ledger_balances_follow_postings_across_snapshots(client, monkeypatch):
+	monkeypatch.setattr(payments, "SNAPSHOT_EVERY_POSTINGS", 4)
+	for username, cents in (("rider1", 5000), ("driver1", 0)):
+		assert json.loads(client.post("/api/payments/init_balance",
+			data={"username": username, "amount_cents": str(cents)}).data)["status"] == 1
+	assert json.loads(client.post("/api/payments/init_balance",
+		data={"username": "rider1", "amount_cents": "1"}).data)["status"] == 2
+
+	assert _transfer(client, "rider1", "driver1", 3000) == 1
+	assert _transfer(client, "rider1", "driver1", 3000) == 2  # insufficient funds
+	assert _transfer(client, "rider1", "nobody", 100) == 2
+	assert json.loads(client.post("/api/payments/add", data={"amount": "12.50"},
+		headers=_auth("rider1")).data)["status"] == 1
+	assert json.loads(client.post("/api/payments/add", data={"amount": "1"},
+		headers=_auth("nobody")).data)["status"] == 2
+
+	assert _balance(client, "rider1") == "32.50"
+	assert _balance(client, "driver1") == "30.00"
+	payments.wait_for_snapshots()  # taken off the request path
+	conn = payments.get_db()
+	total, snapshots = conn.execute(
+		"SELECT (SELECT sum(amount) FROM ledger), (SELECT count(*) FROM balance_snapshots);").fetchone()
+	assert total == 0
+	assert snapshots > 0
+
+	# each run adds only the postings since the last one
+	payments.take_snapshots(conn)
+	assert payments.take_snapshots(conn) == 0
+	snapshotted = dict(conn.execute("SELECT username, balance FROM balance_snapshots;").fetchall())
+	conn.close()
+	assert snapshotted["rider1"] == 3250 and snapshotted["driver1"] == 3000
+	assert _balance(client, "rider1") == "32.50"
+
+
+def test_statement_streams_postings_as_ndjson(client):
+	client.post("/api/payments/init_balance", data={"username": "rider1", "amount_cents": "5000"})
+	client.post("/api/payments/init_balance", data={"username": "driver1", "amount_cents": "0"})
+	_transfer(client, "rider1", "driver1", 1250)
+
+	resp = client.get("/api/payments/statement", headers=_auth("rider1"))
+	assert resp.mimetype == "application/x-ndjson"
+	postings = [json.loads(line) for line in resp.data.decode().splitlines()]
+	assert [(p["kind"], p["amount"], p["counterparty"]) for p in postings] == [
+		("deposit", "50.00", "__external__"), ("transfer", "-12.50", "driver1")]
+
+	resumed = client.get(f"/api/payments/statement?after={postings[0]['posting_id']}", headers=_auth("rider1"))
+	assert [json.loads(line)["kind"] for line in resumed.data.decode().splitlines()] == ["transfer"]
+	unauthenticated = client.get("/api/payments/statement")
+	assert unauthenticated.status_code == 200 and json.loads(unauthenticated.data)["status"] == 2
+	bad_cursor = client.get("/api/payments/statement?after=x", headers=_auth("rider1"))
+	assert bad_cursor.status_code == 200 and json.loads(bad_cursor.data)["status"] == 2
+
+
+def test_transfers_commit_in_batches_with_separate_outcomes(client, monkeypatch):
+	client.post("/api/payments/init_balance", data={"username": "rider1", "amount_cents": "5000"})
+	client.post("/api/payments/init_balance", data={"username": "driver1", "amount_cents": "0"})
+
+	batches = []
+	writer = GroupCommitWriter(lambda: payments.get_db(), max_batch=16, window=0.2)
+	apply_batch = writer._apply_batch
+	monkeypatch.setattr(writer, "_apply_batch", lambda batch: (batches.append(len(batch)), apply_batch(batch)))
+	monkeypatch.setattr(payments, "_writers", [writer])
+
+	# 1000 cents each: five fit the balance, one overdraws, one pays a missing driver
+	requests = [("rider1", "driver1", 1000)] * 6 + [("rider1", "nobody", 100)]
+	with ThreadPoolExecutor(len(requests)) as pool:
+		statuses = list(pool.map(lambda args: _transfer(client, *args), requests))
+
+	assert sorted(statuses) == [1] * 5 + [2] * 2
+	assert sum(batches) == len(requests) and len(batches) < len(requests)
+	assert _balance(client, "rider1") == "0.00"
+	assert _balance(client, "driver1") == "50.00"
+
+
+def test_sharded_transfers_and_offline_reshard(tmp_path, monkeypatch):
+	from scripts.reshard_payments import reshard
+
+	def use_shards(shards, created):
+		monkeypatch.setattr(payments, "db_name", str(tmp_path / "payments.db"))
+		monkeypatch.setattr(payments, "db_flag", created)
+		monkeypatch.setattr(payments, "PAYMENTS_SHARDS", shards)
+		monkeypatch.setattr(payments, "_writers", [
+			GroupCommitWriter(lambda shard=shard: payments.get_db(shard), 1, 0) for shard in range(shards)])
+
+	use_shards(3, created=False)
+	client = payments.app.test_client()
+	names = [f"user{i}" for i in range(12)]
+	assert len({payments.shard_for(name) for name in names}) == 3
+	for name in names:
+		client.post("/api/payments/init_balance", data={"username": name, "amount_cents": "1000"})
+
+	# every ordered pair, so most transfers cross shards
+	for payer in names[:4]:
+		for payee in names[4:8]:
+			assert _transfer(client, payer, payee, 250) == 1
+	assert _transfer(client, names[0], names[8], 1) == 2  # drained
+	assert [_balance(client, name) for name in names[:9]] == ["0.00"] * 4 + ["20.00"] * 4 + ["10.00"]
+
+	reshard(str(tmp_path / "payments.db"), 3, 2)
+	use_shards(2, created=True)
+	assert [_balance(client, name) for name in names[:9]] == ["0.00"] * 4 + ["20.00"] * 4 + ["10.00"]
+	assert _transfer(client, names[4], names[0], 500) == 1
+	assert _balance(client, names[0]) == "5.00"
+	assert not (tmp_path / "payments.2.db").exists()
+
+
+def test_cross_shard_transfer_attaches_in_memory_shards(db_location, monkeypatch):
+	monkeypatch.setattr(payments, "db_name", db_location("payments.db"))
+	monkeypatch.setattr(payments, "db_flag", False)
+	monkeypatch.setattr(payments, "PAYMENTS_SHARDS", 2)
+	monkeypatch.setattr(payments, "_writers", [
+		GroupCommitWriter(lambda shard=shard: payments.get_db(shard), 1, 0) for shard in range(2)])
+	client = payments.app.test_client()
+	payer = "user0"
+	payee = next(f"user{i}" for i in range(1, 20) if payments.shard_for(f"user{i}") != payments.shard_for(payer))
+	for name in (payer, payee):
+		client.post("/api/payments/init_balance", data={"username": name, "amount_cents": "1000"})
+
+	assert _transfer(client, payer, payee, 250) == 1
+	assert [_balance(client, payer), _balance(client, payee)] == ["7.50", "12.50"]
+
+
+def test_add_with_idempotency_key_credits_once(client, monkeypatch):
+	client.post("/api/payments/init_balance", data={"username": "rider1", "amount_cents": "0"})
+	calls = []
+	submit = payments._writers[0].submit
+	monkeypatch.setattr(payments._writers[0], "submit", lambda write: (calls.append(1), submit(write))[1])
+
+	def add(amount, key):
+		headers = {**_auth("rider1"), "Idempotency-Key": key}
+		return client.post("/api/payments/add", data={"amount": amount}, headers=headers)
+
+	# concurrent duplicates wait for the first and get its response
+	with ThreadPoolExecutor(4) as pool:
+		responses = list(pool.map(lambda _: add("10", "key-1"), range(4)))
+	assert [json.loads(resp.data)["status"] for resp in responses] == [1] * 4
+	assert sum(resp.headers.get("Idempotent-Replayed") == "true" for resp in responses) == 3
+	assert len(calls) == 1
+	assert _balance(client, "rider1") == "10.00"
+
+	assert add("25", "key-1").status_code == 422  # same key, different request
+	assert json.loads(add("10", "key-2").data)["status"] == 1
+	assert _balance(client, "rider1") == "20.00"
+
+
+def test_add_releases_its_key_after_a_transient_failure(client, monkeypatch):
+	client.post("/api/payments/init_balance", data={"username": "rider1", "amount_cents": "0"})
+	submit = payments._writers[0].submit
+	failures = [sqlite3.OperationalError("database is locked")]
+
+	def flaky_submit(write):
+		if failures:
+			raise failures.pop()
+		return submit(write)
+
+	monkeypatch.setattr(payments._writers[0], "submit", flaky_submit)
+	headers = {**_auth("rider1"), "Idempotency-Key": "key-1"}
+
+	assert json.loads(client.post("/api/payments/add", data={"amount": "10"}, headers=headers).data)["status"] == 2
+	retry = client.post("/api/payments/add", data={"amount": "10"}, headers=headers)
+	assert json.loads(retry.data)["status"] == 1
+	assert "Idempotent-Replayed" not in retry.headers
+	assert _balance(client, "rider1") == "10.00"
+	# the unknown account is a final answer, replayed to a retry
+	headers = {**_auth("nobody"), "Idempotency-Key": "key-2"}
+	client.post("/api/payments/add", data={"amount": "10"}, headers=headers)
+	assert client.post("/api/payments/add", data={"amount": "10"}, headers=headers).headers["Idempotent-Replayed"] == "true"
@@ -0,0 +1,97 @@
+import json
+import threading
+
+import pytest
+from flask import Flask
+
+from api.common import ratelimit
+from api.common.auth import generate_jwt
+
+
+@pytest.fixture
+def app():
+	app = Flask(__name__)
+
+	@app.route("/expensive")
+	@ratelimit.rate_limited("expensive", rate=1, burst=2)
+	def expensive():
+		return json.dumps({"status": 1})
+
+	return app
+
+
+def _auth(username):
+	return {"Authorization": f"Bearer {generate_jwt(username)}"}
+
+
+def test_bucket_admits_a_burst_then_answers_429_until_refilled(app, monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr(ratelimit.time, "time", lambda: now[0])
+	client = app.test_client()
+
+	assert [client.get("/expensive", headers=_auth("alice")).status_code for _ in range(3)] == [200, 200, 429]
+	rejected = client.get("/expensive", headers=_auth("alice"))
+	assert rejected.status_code == 429
+	assert rejected.headers["Retry-After"] == "1"
+	assert json.loads(rejected.data)["status"] == 0
+
+	# other users have their own bucket, up to the shared IP budget
+	assert client.get("/expensive", headers=_auth("bob")).status_code == 200
+
+	now[0] += 1.0
+	assert client.get("/expensive", headers=_auth("alice")).status_code == 200
+	assert client.get("/expensive", headers=_auth("alice")).status_code == 429
+
+
+def test_anonymous_callers_share_the_ip_budget(app, monkeypatch):
+	monkeypatch.setattr(ratelimit.time, "time", lambda: 1000.0)
+	client = app.test_client()
+	statuses = [client.get("/expensive").status_code for _ in range(2 * ratelimit.IP_BUDGET_FACTOR + 1)]
+	assert statuses.count(200) == 2 * ratelimit.IP_BUDGET_FACTOR
+	assert statuses[-1] == 429
+
+
+def test_sqlite_backend_shares_buckets_through_the_database(app, monkeypatch, db_location):
+	monkeypatch.setattr(ratelimit, "RATE_LIMIT_BACKEND", "sqlite")
+	monkeypatch.setattr(ratelimit, "RATE_LIMIT_DB", db_location("ratelimit.db"))
+	monkeypatch.setattr(ratelimit.time, "time", lambda: 1000.0)
+	client = app.test_client()
+
+	assert [client.get("/expensive", headers=_auth("alice")).status_code for _ in range(3)] == [200, 200, 429]
+	# another worker has no memory state, but sees the same bucket
+	ratelimit._buckets.clear()
+	assert client.get("/expensive", headers=_auth("alice")).status_code == 429
+	assert ratelimit.take("expensive:user:alice", 1, 2) == pytest.approx(1.0)
+
+
+def test_requests_past_the_concurrency_limit_are_shed_with_503(monkeypatch):
+	monkeypatch.setattr(ratelimit, "_slots", threading.BoundedSemaphore(1))
+	app = Flask(__name__)
+	entered, release = threading.Event(), threading.Event()
+
+	@app.route("/slow")
+	@ratelimit.rate_limited("slow", rate=100, burst=100)
+	def slow():
+		entered.set()
+		release.wait(5)
+		return json.dumps({"status": 1})
+
+	results = []
+	worker = threading.Thread(target=lambda: results.append(app.test_client().get("/slow").status_code))
+	worker.start()
+	assert entered.wait(5)
+
+	shed = app.test_client().get("/slow")
+	assert shed.status_code == 503
+	assert shed.headers["Retry-After"] == "1"
+
+	release.set()
+	worker.join(5)
+	assert results == [200]
+	assert app.test_client().get("/slow").status_code == 200
+
+
+def test_budget_can_be_overridden_from_the_environment(monkeypatch):
+	monkeypatch.setenv("RATE_LIMIT_SEARCH", "2/8")
+	assert ratelimit._budget("search", 5, 20) == (2.0, 8.0)
+	assert ratelimit._budget("reserve", 1, 5) == (1, 5)
@@ -0,0 +1,156 @@
+import json
+import threading
+
+import pytest
+
+from api.common import clients
+from api.common.auth import generate_jwt
+from api.reservations import index as reservations
+from conftest import FakeResponse
+
+
+@pytest.fixture
+def client(db_location, monkeypatch):
+	"""Reservations test client backed by a fresh database."""
+	monkeypatch.setattr(reservations, "db_name", db_location("reservations.db"))
+	monkeypatch.setattr(reservations, "db_flag", False)
+	return reservations.app.test_client()
+
+
+def _insert(listing_id, driver, rider, ride_date, status="CONFIRMED"):
+	conn = reservations.get_db()
+	conn.execute("""
+		INSERT INTO reservations (
+			listing_id, driver_username, rider_username, ride_date, ride_time, price, status
+		) VALUES (?,?,?,?,?,?,?);
+		""", (listing_id, driver, rider, ride_date, "08:00", 1000, status))
+	conn.commit()
+	conn.close()
+
+
+def test_history_pages_by_cursor_and_fetches_ratings_in_one_call(client, monkeypatch):
+	"""Rides as driver and rider are merged newest first, with one bulk rating lookup per page."""
+	calls = []
+
+	def fake_get(url, params=None, **kwargs):
+		calls.append((url, params))
+		return FakeResponse({"avgs": {name: "4.00" for name in params["username"]}})
+
+	monkeypatch.setattr(clients.requests, "get", fake_get)
+	_insert(1, "alice", "bob", "2026-11-01")
+	_insert(2, "carol", "alice", "2026-11-02")
+	_insert(3, "alice", "dave", "2026-11-03", status="CANCELLED")
+	_insert(4, "erin", "frank", "2026-11-04")
+	headers = {"Authorization": f"Bearer {generate_jwt('alice')}"}
+
+	first = json.loads(client.get("/api/reservations/history?limit=2", headers=headers).data)
+	assert [(row["listingid"], row["role"], row["user"]) for row in first["data"]] == [
+		(3, "driver", "dave"), (2, "rider", "carol")]
+	assert first["data"][0]["rating"] == "4.00"
+	assert len(calls) == 1
+	assert calls[0][0].endswith("/api/users/get_average_ratings")
+
+	second = json.loads(client.get(
+		f"/api/reservations/history?limit=2&cursor={first['next_cursor']}", headers=headers).data)
+	assert [row["listingid"] for row in second["data"]] == [1]
+	assert second["next_cursor"] is None
+
+	confirmed = json.loads(client.get(
+		"/api/reservations/history?status=CONFIRMED&from_date=2026-11-02", headers=headers).data)
+	assert [row["listingid"] for row in confirmed["data"]] == [2]
+
+
+def test_check_reservation_is_order_insensitive_and_sees_other_writers(client, monkeypatch):
+	_insert(1, "alice", "bob", "2026-11-01")
+
+	def check(a, b):
+		return json.loads(client.get(
+			f"/api/reservations/check_reservation?username1={a}&username2={b}").data)["status"]
+
+	assert check("alice", "bob") == 1
+	assert check("bob", "alice") == 1
+	assert check("alice", "carol") == 0
+
+	# a row written behind the filter's back shows up once the refresh window passes
+	_insert(2, "carol", "alice", "2026-11-02")
+	monkeypatch.setattr(reservations, "PAIR_FILTER_REFRESH_SECONDS", 0.0)
+	assert check("alice", "carol") == 1
+
+
+def test_check_reservation_creates_the_database_on_a_cold_start(client):
+	"""The first request may create the database while the pair filter lock is held."""
+	reservations.reset_caches()
+	statuses = []
+	worker = threading.Thread(target=lambda: statuses.append(json.loads(client.get(
+		"/api/reservations/check_reservation?username1=alice&username2=bob").data)["status"]), daemon=True)
+	worker.start()
+	worker.join(5)
+	assert statuses == [0]
+
+
+def test_reserve_replays_retries_and_pays_once(client, monkeypatch):
+	posts = []
+
+	def fake_get(url, params=None, **kwargs):
+		if url.endswith("/get_driver_status"):
+			return FakeResponse({"driver": 0})
+		return FakeResponse({"data": ["carol", 1500, "2026-11-05", "09:00"]})
+
+	def fake_post(url, data=None, headers=None, **kwargs):
+		posts.append((url, headers))
+		return FakeResponse({"status": 1})
+
+	monkeypatch.setattr(clients.requests, "get", fake_get)
+	monkeypatch.setattr(clients.requests, "post", fake_post)
+	headers = {"Authorization": f"Bearer {generate_jwt('alice')}", "Idempotency-Key": "tap-1"}
+
+	first = client.post("/api/reservations/reserve", data={"listingid": "7"}, headers=headers)
+	retry = client.post("/api/reservations/reserve", data={"listingid": "7"}, headers=headers)
+	assert json.loads(first.data)["status"] == json.loads(retry.data)["status"] == 1
+	assert retry.headers["Idempotent-Replayed"] == "true"
+
+	transfers = [post_headers for url, post_headers in posts if url.endswith("/api/payments/transfer")]
+	assert len(transfers) == 1
+	assert transfers[0]["Idempotency-Key"] not in ("", "tap-1")
+
+
+def test_reserve_releases_its_key_when_a_dependency_is_down_so_the_retry_runs(client, monkeypatch):
+	payments_down = [True]
+
+	def fake_get(url, params=None, **kwargs):
+		if url.endswith("/get_driver_status"):
+			return FakeResponse({"driver": 0})
+		return FakeResponse({"data": ["carol", 1500, "2026-11-05", "09:00"]})
+
+	def fake_post(url, data=None, headers=None, **kwargs):
+		if url.endswith("/api/payments/transfer") and payments_down[0]:
+			raise ConnectionError("payments is restarting")
+		return FakeResponse({"status": 1})
+
+	monkeypatch.setattr(clients.requests, "get", fake_get)
+	monkeypatch.setattr(clients.requests, "post", fake_post)
+	headers = {"Authorization": f"Bearer {generate_jwt('alice')}", "Idempotency-Key": "tap-1"}
+
+	first = client.post("/api/reservations/reserve", data={"listingid": "7"}, headers=headers)
+	assert json.loads(first.data)["status"] == 3
+	payments_down[0] = False
+	retry = client.post("/api/reservations/reserve", data={"listingid": "7"}, headers=headers)
+	assert json.loads(retry.data)["status"] == 1
+	assert "Idempotent-Replayed" not in retry.headers
+
+
+def test_reserve_sheds_a_flood_before_calling_other_services(client, monkeypatch):
+	calls = []
+
+	def fake_get(url, params=None, **kwargs):
+		calls.append(url)
+		return FakeResponse({"driver": 1})
+
+	monkeypatch.setattr(clients.requests, "get", fake_get)
+	headers = {"Authorization": f"Bearer {generate_jwt('alice')}"}
+
+	statuses = [client.post("/api/reservations/reserve", data={"listingid": str(i)}, headers=headers).status_code
+				for i in range(10)]
+	assert statuses.count(429) >= 4
+	# rejected requests never reached the users service
+	assert len(calls) == statuses.count(200)
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from api.common import schema
+from scripts.build_db_templates import SQL_FILES
+
+
+def _describe(path):
+	"""Schema objects and row counts of a database, which a template must reproduce."""
+	conn = sqlite3.connect(path)
+	try:
+		objects = conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY type, name;").fetchall()
+		counts = {name: conn.execute(f'SELECT count(*) FROM "{name}";').fetchone()[0]
+				  for kind, name, _, _ in objects if kind == "table"}
+	finally:
+		conn.close()
+	return objects, counts
+
+
+@pytest.mark.parametrize("sql_file", SQL_FILES)
+def test_templates_match_their_sql_schema(sql_file, tmp_path, monkeypatch):
+	"""Fails when a .sql file changed without `python scripts/build_db_templates.py`."""
+	monkeypatch.setattr(schema, "DB_TEMPLATES", False)
+	schema.install_schema(str(tmp_path / "from_sql.db"), sql_file)
+	assert _describe(schema.template_path(sql_file)) == _describe(tmp_path / "from_sql.db")
+
+
+def test_install_schema_replaces_the_database_and_its_stale_journal(tmp_path):
+	sql_file = "api/reservations/reservations.sql"
+	db_path = str(tmp_path / "reservations.db")
+	conn = sqlite3.connect(db_path)
+	conn.execute("CREATE TABLE leftover (x);")
+	conn.commit()
+	conn.close()
+	(tmp_path / "reservations.db-journal").write_bytes(b"stale")
+
+	schema.install_schema(db_path, sql_file)
+
+	assert not (tmp_path / "reservations.db-journal").exists()
+	assert _describe(db_path) == _describe(schema.template_path(sql_file))
+
+
+def test_install_schema_runs_the_script_without_a_template(tmp_path):
+	sql_file = tmp_path / "tiny.sql"
+	sql_file.write_text("CREATE TABLE things (id INTEGER PRIMARY KEY);")
+	schema.install_schema(str(tmp_path / "tiny.db"), str(sql_file))
+
+	objects, counts = _describe(tmp_path / "tiny.db")
+	assert counts == {"things": 0}
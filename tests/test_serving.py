@@ -0,0 +1,47 @@
+import pytest
+
+from api.common import serving, storage
+from api.reservations import index as reservations
+from api.users import index as users
+
+
+@pytest.fixture
+def users_db(db_location, monkeypatch):
+	monkeypatch.setattr(users, "db_name", db_location("user.db"))
+	monkeypatch.setattr(users, "db_flag", False)
+	users.reset_caches()
+	return users.db_name
+
+
+def test_migrate_creates_the_schema_once_and_keeps_existing_data(users_db, monkeypatch):
+	monkeypatch.setattr(users, "SEED_DEMO_DATA", True)
+	serving.migrate(users)
+	assert users.db_flag
+	conn = storage.connect(users_db)
+	conn.execute("UPDATE users SET first_name = 'Kept' WHERE username = 'demo';")
+	conn.commit()
+	conn.close()
+
+	# a restarted master must not drop what the previous one served
+	users.db_flag = False
+	serving.migrate(users)
+	assert users.db_flag
+	conn = storage.connect(users_db)
+	assert conn.execute("SELECT first_name FROM users WHERE username = 'demo';").fetchone() == ("Kept",)
+	conn.close()
+
+
+def test_warmup_builds_filters_before_the_first_request(users_db, db_location, monkeypatch, use_database):
+	monkeypatch.setattr(users, "SEED_DEMO_DATA", True)
+	serving.migrate(users)
+	serving.warmup(users)
+	assert users._username_filter is not None and "demo" in users._username_filter
+
+	use_database(reservations, db_location("reservations.db"))
+	reservations.create_db()
+	serving.warmup(reservations)
+	assert reservations._pair_filter is not None
+
+
+def test_load_service_imports_the_service_module():
+	assert serving.load_service("users") is users
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from api.common import schema, storage
+
+
+def test_location_follows_the_configured_backend(monkeypatch):
+	monkeypatch.setattr(storage, "STORAGE_DIR", "/srv/data")
+	assert storage.location("user.db") == "/srv/data/user.db"
+	monkeypatch.setattr(storage, "STORAGE_READ_ONLY", True)
+	assert storage.location("user.db") == "file:/srv/data/user.db?mode=ro"
+	assert storage.location("ratelimit.db", read_only=False) == "/srv/data/ratelimit.db"
+	monkeypatch.setattr(storage, "STORAGE_BACKEND", "memory")
+	assert storage.location("user.db") == "file:user?mode=memory&cache=shared"
+
+	assert storage.variant("/srv/data/payments.db", "1") == "/srv/data/payments.1.db"
+	assert storage.variant("file:payments?mode=memory&cache=shared", "1") == "file:payments.1?mode=memory&cache=shared"
+
+
+def test_memory_database_is_shared_until_removed():
+	location = storage.memory_location("shared")
+	writer = storage.connect(location)
+	writer.execute("CREATE TABLE t (x INTEGER);")
+	writer.execute("INSERT INTO t VALUES (1);")
+	writer.commit()
+	writer.close()
+
+	# no connection of the caller's is open, yet the data is still there
+	assert storage.exists(location)
+	reader = storage.connect(location)
+	assert reader.execute("SELECT x FROM t;").fetchall() == [(1,)]
+	reader.close()
+	assert not storage.exists(storage.memory_location("other"))
+
+	storage.remove(location)
+	assert not storage.exists(location)
+	conn = storage.connect(location)
+	assert conn.execute("SELECT count(*) FROM sqlite_master;").fetchone() == (0,)
+	conn.close()
+
+
+def test_install_schema_overwrites_an_open_memory_database():
+	location = storage.memory_location("reservations")
+	holder = storage.connect(location)
+	holder.execute("CREATE TABLE stale (x INTEGER);")
+	holder.commit()
+
+	schema.install_schema(location, "api/reservations/reservations.sql")
+	tables = {name for (name,) in holder.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+	holder.close()
+	assert "reservations" in tables and "stale" not in tables
+
+
+def test_read_only_replica_is_never_written(tmp_path):
+	path = tmp_path / "user.db"
+	schema.install_schema(str(path), "api/users/users.sql")
+	replica = f"file:{path}?mode=ro"
+
+	schema.install_schema(replica, "api/users/users.sql")
+	storage.remove(replica)
+	assert storage.exists(replica)
+	conn = storage.connect(replica)
+	try:
+		assert conn.execute("SELECT count(*) FROM users;").fetchone() == (0,)
+		with pytest.raises(sqlite3.OperationalError, match="readonly"):
+			conn.execute("INSERT INTO users (username) VALUES ('x');")
+	finally:
+		conn.close()
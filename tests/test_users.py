@@ -0,0 +1,310 @@
+import hashlib
+import json
+
+import pytest
+
+from api.common import clients
+from api.common.auth import generate_jwt
+from api.common.passwords import PasswordHasherBusy
+from api.users import index as users
+from conftest import FakeResponse
+
+
+@pytest.fixture
+def client(db_location, monkeypatch):
+	"""Users test client backed by a fresh database; every pair of users has ridden together."""
+	monkeypatch.setattr(users, "db_name", db_location("user.db"))
+	monkeypatch.setattr(users, "db_flag", False)
+	users.reset_caches()
+	monkeypatch.setattr(clients.requests, "get", lambda *args, **kwargs: FakeResponse({"status": 1}))
+	monkeypatch.setattr(clients.requests, "post", lambda *args, **kwargs: FakeResponse({"status": 1}))
+	return users.app.test_client()
+
+
+def _create(client, username, driver=False):
+	resp = json.loads(client.post("/api/users/create_user", data={
+		"first_name": "Test", "last_name": "User", "username": username,
+		"email_address": f"{username}@example.com", "driver": str(driver).lower(),
+		"deposit": "0", "password": "Secret123x"}).data)
+	assert resp["status"] == 1
+
+
+def _rate(client, rater, rated, rating):
+	return json.loads(client.post(
+		"/api/users/rate", data={"username": rated, "rating": str(rating)},
+		headers={"Authorization": f"Bearer {generate_jwt(rater)}"}).data)["status"]
+
+
+def _average(client, username):
+	return json.loads(client.get(f"/api/users/get_average_rating?username={username}").data)["avg"]
+
+
+def test_rate_records_one_event_per_pair(client):
+	_create(client, "driver1", driver=True)
+	_create(client, "rider1")
+	_create(client, "rider2")
+
+	assert _rate(client, "rider1", "driver1", 5) == 1
+	assert _rate(client, "rider1", "driver1", 1) == 2  # second rating of the same user
+	assert _rate(client, "rider2", "driver1", 4) == 1
+	assert _rate(client, "rider2", "nobody", 4) == 2
+
+	assert _average(client, "driver1") == "4.50"
+	conn = users.get_db()
+	events = conn.execute("SELECT rater_email, rating FROM ratings ORDER BY rater_email;").fetchall()
+	conn.close()
+	assert events == [("rider1@example.com", 5), ("rider2@example.com", 4)]
+
+
+def test_rebuild_rating_aggregates_matches_events(client):
+	pytest.importorskip("numpy")
+	from scripts.rebuild_ratings import rebuild_rating_aggregates
+
+	_create(client, "driver1", driver=True)
+	_create(client, "rider1")
+	_create(client, "rider2")
+	_rate(client, "rider1", "driver1", 5)
+	_rate(client, "rider2", "driver1", 2)
+	_rate(client, "driver1", "rider1", 3)
+
+	conn = users.get_db()
+	conn.execute("UPDATE users SET rating_sum = 99, rating_count = 1;")
+	conn.commit()
+	assert rebuild_rating_aggregates(conn) == 3
+	aggregates = conn.execute("SELECT username, rating_sum, rating_count FROM users ORDER BY username;").fetchall()
+	conn.close()
+
+	assert aggregates == [("driver1", 7, 2), ("rider1", 3, 1), ("rider2", 0, 0)]
+
+
+def test_top_drivers_ranks_drivers_by_stored_average(client):
+	for name in ("driver1", "driver2", "driver3"):
+		_create(client, name, driver=True)
+	for name in ("rider1", "rider2"):
+		_create(client, name)
+	_rate(client, "rider1", "driver1", 4)
+	_rate(client, "rider1", "driver2", 5)
+	_rate(client, "rider2", "driver2", 2)
+	_rate(client, "rider1", "driver3", 5)
+	_rate(client, "driver1", "rider2", 5)  # riders are never ranked
+
+	def top(query):
+		return json.loads(client.get(f"/api/users/top_drivers?{query}").data)
+
+	first = top("k=2")
+	assert [(row["username"], row["avg"], row["count"]) for row in first["data"]] == [
+		("driver3", "5.00", 1), ("driver1", "4.00", 1)]
+	assert first["next_offset"] == 2
+	second = top("k=2&offset=2")
+	assert [row["username"] for row in second["data"]] == ["driver2"]
+	assert second["next_offset"] is None
+
+	assert [row["username"] for row in top("min_count=2")["data"]] == ["driver2"]
+
+	# a driver who switches to riding leaves the leaderboard on the next read
+	headers = {"Authorization": f"Bearer {generate_jwt('driver3')}"}
+	client.post("/api/users/set_driver_status", data={"username": "driver3", "driver": "false"}, headers=headers)
+	assert [row["username"] for row in top("k=1")["data"]] == ["driver1"]
+
+	assert top("k=0")["status"] == 2
+
+
+def test_user_cache_is_invalidated_by_writes(client):
+	_create(client, "driver1", driver=True)
+	_create(client, "rider1")
+	headers = {"Authorization": f"Bearer {generate_jwt('driver1')}"}
+
+	def driver_status(username):
+		return json.loads(client.get(f"/api/users/get_driver_status?username={username}").data)["driver"]
+
+	def login(username, password):
+		return json.loads(client.post(
+			"/api/users/login", data={"username": username, "password": password}).data)["status"]
+
+	assert driver_status("driver1") == 1  # now cached
+	client.post("/api/users/set_driver_status", data={"username": "driver1", "driver": "false"}, headers=headers)
+	assert driver_status("driver1") == 0
+	# what the frontend reads, now that get_driver_status is internal to the gateway
+	assert json.loads(client.post("/api/users/view", headers=headers).data)["data"]["driver"] == 0
+
+	assert _average(client, "driver1") == "0.00"
+	_rate(client, "rider1", "driver1", 3)
+	assert _average(client, "driver1") == "3.00"
+
+	assert login("driver1", "Secret123x") == 1
+	assert json.loads(client.post("/api/users/update", data={
+		"username": "driver1", "password": "Secret123x", "new_password": "Another456y"},
+		headers=headers).data)["status"] == 1
+	assert login("driver1", "Secret123x") == 2
+	assert login("driver1", "Another456y") == 1
+
+	assert json.loads(client.post("/api/users/update", data={
+		"username": "driver1", "new_username": "driver9"}, headers=headers).data)["status"] == 1
+	assert driver_status("driver1") is None
+	assert driver_status("driver9") == 0
+
+
+def test_signup_relies_on_unique_constraints(client, monkeypatch):
+	_create(client, "rider1")
+
+	def signup(username, email, password="Secret123x"):
+		return json.loads(client.post("/api/users/create_user", data={
+			"first_name": "Test", "last_name": "User", "username": username,
+			"email_address": email, "driver": "false", "deposit": "0",
+			"password": password}).data)["status"]
+
+	assert signup("rider1", "fresh@example.com") == 2
+	assert signup("rider2", "rider1@example.com") == 3
+	assert signup("rider1", "fresh@example.com", password="weak") == 2
+	assert signup("rider2", "fresh@example.com", password="weak") == 4
+	assert signup("rider2", "fresh@example.com") == 1
+
+	# any other constraint failure is not reported as a taken username
+	monkeypatch.setattr(users, "is_valid_password", lambda *args: True)
+	assert json.loads(client.post("/api/users/create_user", data={
+		"email_address": "nameless@example.com", "driver": "false", "deposit": "0",
+		"password": "Secret123x"}).data)["status"] == 5
+
+
+def test_username_available_is_answered_by_the_filter(client, monkeypatch):
+	_create(client, "rider1")
+
+	def available(username):
+		return json.loads(client.get(f"/api/users/username_available?username={username}").data)
+
+	assert available("rider1") == {"status": 1, "available": False}
+	assert available("rider2") == {"status": 1, "available": True}
+	assert client.get("/api/users/username_available").status_code == 200
+
+	# fresh names never reach the database; other writers show up once the filter is stale
+	opened = []
+	get_db = users.get_db
+	monkeypatch.setattr(users, "get_db", lambda: (opened.append(1), get_db())[1])
+	assert available("rider3")["available"]
+	assert opened == []
+	conn = get_db()
+	conn.execute("INSERT INTO users VALUES (?,?,?,?,?,?,?,?);",
+				 ("rider3@example.com", "Test", "User", "rider3", "salt", 0, 0, 0))
+	conn.commit()
+	conn.close()
+	monkeypatch.setattr(users, "USER_FILTER_REFRESH_SECONDS", 0.0)
+	assert not available("rider3")["available"]
+	assert not users.is_unique_email("rider3@example.com")
+
+
+def test_login_upgrades_legacy_hashes_and_sheds_load_when_busy(client, monkeypatch):
+	_create(client, "rider1")
+	conn = users.get_db()
+	conn.execute("UPDATE passwords SET password_hash = ? WHERE email_address = 'rider1@example.com';",
+				 (hashlib.sha256(b"Secret123xlegacy").hexdigest(),))
+	conn.execute("UPDATE users SET salt = 'legacy' WHERE username = 'rider1';")
+	conn.commit()
+	conn.close()
+	users.reset_caches()
+
+	def login(password):
+		return client.post("/api/users/login", data={"username": "rider1", "password": password})
+
+	assert json.loads(login("Secret123x").data)["status"] == 1
+	assert users.get_credentials("rider1").password_hash.startswith("scrypt$")
+	assert json.loads(login("Secret123x").data)["status"] == 1
+
+	def busy(*args):
+		raise PasswordHasherBusy()
+
+	monkeypatch.setattr(users, "offload", busy)
+	resp = login("Secret123x")
+	assert resp.status_code == 503
+	assert resp.headers["Retry-After"] == "1"
+
+
+def test_login_checks_the_current_password_even_when_the_user_is_cached(client):
+	_create(client, "rider1")
+	assert users.get_user_record("rider1") is not None  # cached
+	# another worker changes the password; this worker's cache never hears of it
+	salt = users.get_user_record("rider1").salt
+	conn = users.get_db()
+	conn.execute("UPDATE passwords SET password_hash = ? WHERE email_address = 'rider1@example.com';",
+				 (users.hash_password("Changed123x", salt),))
+	conn.commit()
+	conn.close()
+
+	def login(password):
+		return json.loads(client.post("/api/users/login", data={"username": "rider1", "password": password}).data)
+
+	assert login("Secret123x")["status"] == 2
+	assert login("Changed123x")["status"] == 1
+
+
+def test_password_history_is_checked_in_sql_and_pruned(client, monkeypatch):
+	monkeypatch.setattr(users, "PASSWORD_HISTORY_DEPTH", 3)
+	_create(client, "rider1")
+	headers = {"Authorization": f"Bearer {generate_jwt('rider1')}"}
+
+	def change(current, new):
+		return json.loads(client.post("/api/users/update", data={
+			"username": "rider1", "password": current, "new_password": new},
+			headers=headers).data)["status"]
+
+	# a legacy hash in the history is still recognised
+	salt = users.get_user_record("rider1").salt
+	conn = users.get_db()
+	conn.execute("UPDATE passwords SET is_current = 0;")
+	conn.execute("INSERT INTO passwords VALUES (?,?,1);", (
+		"rider1@example.com", hashlib.sha256(("Legacy123x" + salt).encode("utf-8")).hexdigest()))
+	conn.commit()
+	conn.close()
+	users.reset_caches()
+
+	assert change("Legacy123x", "Secret123x") == 2  # used before, as a scrypt hash
+	assert change("Legacy123x", "Third123x") == 1
+	assert change("Third123x", "Legacy123x") == 2  # used before, as a legacy hash
+	assert change("Third123x", "Fourth123x") == 1
+
+	conn = users.get_db()
+	history = conn.execute("SELECT count(*) FROM passwords WHERE email_address = 'rider1@example.com';").fetchone()
+	conn.close()
+	assert history == (3,)
+	assert change("Fourth123x", "Secret123x") == 1  # pruned, so allowed again
+
+	opened = []
+	get_db = users.get_db
+	monkeypatch.setattr(users, "get_db", lambda: (opened.append(1), get_db())[1])
+	assert change("Secret123x", "Fifth123x") == 1
+	assert len(opened) == 1  # one connection for the read, the reuse check and the write
+
+
+def test_dashboard_returns_each_part_and_names_the_failed_ones(client, monkeypatch):
+	_create(client, "rider1")
+	forwarded = []
+
+	def fake_get(url, headers=None, **kwargs):
+		forwarded.append(headers["Authorization"])
+		if url.endswith("/api/payments/view"):
+			return FakeResponse({"status": 1, "balance": "12.50"})
+		return FakeResponse({"status": 1, "data": {"listingid": 7, "price": "9.00", "user": "driver1",
+												   "rating": "4.00"}})
+
+	monkeypatch.setattr(clients.requests, "get", fake_get)
+	headers = {"Authorization": f"Bearer {generate_jwt('rider1')}"}
+	resp = json.loads(client.get("/api/users/dashboard", headers=headers).data)
+	assert resp["status"] == 1
+	assert resp["data"]["profile"]["email_address"] == "rider1@example.com"
+	assert resp["data"]["balance"] == "12.50"
+	assert resp["data"]["reservation"]["listingid"] == 7
+	assert resp["unavailable"] == []
+	assert forwarded == [headers["Authorization"]] * 2
+
+	def payments_down(url, **kwargs):
+		if url.endswith("/api/payments/view"):
+			raise ConnectionError("payments is down")
+		return FakeResponse({"status": 2, "data": "NULL"})
+
+	monkeypatch.setattr(clients.requests, "get", payments_down)
+	resp = json.loads(client.get("/api/users/dashboard", headers=headers).data)
+	assert resp["status"] == 1
+	assert resp["data"]["profile"]["username"] == "rider1"
+	assert resp["data"]["balance"] is None and resp["data"]["reservation"] is None
+	assert resp["unavailable"] == ["balance"]
+
+	assert json.loads(client.get("/api/users/dashboard").data)["status"] == 2